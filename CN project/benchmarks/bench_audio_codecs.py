@@ -0,0 +1,101 @@
+"""Micro-benchmark: audio payload formats, per 20 ms frame.
+
+Encodes and decodes a synthetic voice-like signal (a gliding harmonic series
+rolling off at 12 dB per octave, with a syllable-rate envelope and a little
+noise) in every codec and rate of common/audio_codecs.py. Reports encode and decode time per frame, payload
+bytes, the bitrate on the wire (payload, audio header and IPv4/UDP headers),
+the saving against 48 kHz PCM for one stream and for the mixer's egress to
+--participants listeners, and the SNR after a round trip (resampled formats
+are compared against the signal low-passed the same way, so the figure
+measures the codec, not the band limit).
+
+	python benchmarks/bench_audio_codecs.py --frames 500 --participants 30
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Ensure project root is on sys.path when executed as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.audio_codecs import SUPPORTED_AUDIO_CODECS, SUPPORTED_AUDIO_RATES, AudioDecoder, AudioEncoder, Downsampler, Upsampler
+from common.constants import AUDIO_CHUNK_MS, AUDIO_SAMPLE_RATE
+from common.media import AUDIO_HEADER
+
+# IPv4 + UDP headers per datagram
+UDP_IP_OVERHEAD = 28
+
+
+def voice_signal(frames: int, chunk: int) -> np.ndarray:
+	t = np.arange(frames * chunk) / AUDIO_SAMPLE_RATE
+	pitch = 140 + 40 * np.sin(2 * np.pi * 0.7 * t)
+	phase = 2 * np.pi * np.cumsum(pitch) / AUDIO_SAMPLE_RATE
+	voice = sum(np.sin(k * phase) / k**2 for k in range(1, 25))
+	envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * t)
+	noise = np.random.default_rng(1).normal(0, 0.01, len(t))
+	return np.clip((voice * envelope / 1.6 + noise) * 12000, -32768, 32767).astype(np.int16)
+
+
+def snr_db(reference: np.ndarray, decoded: np.ndarray, skip: int) -> float:
+	ref = reference[skip:].astype(np.float64)
+	err = ref - decoded[skip:].astype(np.float64)
+	return float("inf") if not err.any() else 10 * np.log10(np.sum(ref * ref) / np.sum(err * err))
+
+
+def band_limited(signal: np.ndarray, chunk: int) -> np.ndarray:
+	"""signal through the same 48 -> 16 -> 48 kHz resampling, without a codec in between."""
+	down, up = Downsampler(), Upsampler()
+	return np.concatenate([up.process(down.process(signal[i : i + chunk])) for i in range(0, len(signal), chunk)])
+
+
+def bench(codec: str, rate: int, signal: np.ndarray, reference: np.ndarray, chunk: int, repeat: int):
+	frames = [signal[i : i + chunk] for i in range(0, len(signal), chunk)]
+	best_encode = best_decode = float("inf")
+	payloads = []
+	decoded = []
+	for _ in range(repeat):
+		encoder = AudioEncoder(codec, rate)
+		t0 = time.perf_counter()
+		payloads = [encoder.encode(frame) for frame in frames]
+		best_encode = min(best_encode, time.perf_counter() - t0)
+		decoder = AudioDecoder(codec, rate)
+		t0 = time.perf_counter()
+		decoded = [decoder.decode(payload) for payload in payloads]
+		best_decode = min(best_decode, time.perf_counter() - t0)
+	size = sum(len(p) for p in payloads) / len(payloads)
+	snr = snr_db(reference, np.concatenate(decoded), AUDIO_SAMPLE_RATE // 10)
+	return best_encode / len(frames) * 1e6, best_decode / len(frames) * 1e6, size, snr
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--frames", type=int, default=500)
+	parser.add_argument("--participants", type=int, default=30, help="listeners the mixer sends one stream each")
+	parser.add_argument("--repeat", type=int, default=3)
+	args = parser.parse_args()
+
+	chunk = AUDIO_SAMPLE_RATE * AUDIO_CHUNK_MS // 1000
+	per_second = 1000 // AUDIO_CHUNK_MS
+	signal = voice_signal(args.frames, chunk)
+	narrow = band_limited(signal, chunk)
+	wire_overhead = AUDIO_HEADER.size + UDP_IP_OVERHEAD
+	baseline = (chunk * 2 + wire_overhead) * 8 * per_second / 1000
+	print(f"{args.frames} frames of {AUDIO_CHUNK_MS} ms; wire rate includes {wire_overhead} header bytes per datagram")
+	print(f"{'format':<14} {'encode':>9} {'decode':>9} {'bytes':>7} {'kbps':>7} {'saved':>7} {'egress':>10} {'SNR':>8}")
+	for codec in SUPPORTED_AUDIO_CODECS[::-1]:
+		for rate in SUPPORTED_AUDIO_RATES[::-1]:
+			reference = narrow if rate != AUDIO_SAMPLE_RATE else signal
+			encode_us, decode_us, size, snr = bench(codec, rate, signal, reference, chunk, args.repeat)
+			kbps = (size + wire_overhead) * 8 * per_second / 1000
+			egress = kbps * args.participants / 1000
+			print(
+				f"{codec + '/' + str(rate // 1000) + 'k':<14} {encode_us:7.0f}us {decode_us:7.0f}us {size:7.0f} {kbps:7.1f} "
+				f"{1 - kbps / baseline:6.0%} {egress:6.2f} Mbps {snr:6.1f}dB"
+			)
+
+
+if __name__ == "__main__":
+	main()
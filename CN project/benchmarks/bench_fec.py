@@ -0,0 +1,125 @@
+"""Loss-injection benchmark: frame and audio delivery with and without FEC.
+
+Sends --frames video frames of --frame-bytes each (fragment_frame, plus
+frame_parity with FEC) and as many 20 ms audio datagrams (plus AudioFecEncoder
+parity) through a lossy channel into the receivers' FrameReassembler and
+AudioFecDecoder. The channel drops datagrams at each --loss rate, in bursts of
+--burst datagrams on average (1: independent losses). With FEC the group size
+is what the senders would pick from a receiver report of that loss. Reports the
+share of frames and of audio datagrams delivered, and the bandwidth FEC added.
+
+	python benchmarks/bench_fec.py --frames 2000 --loss 0.01 0.05 0.1 --burst 1
+"""
+import argparse
+import os
+import random
+import sys
+from typing import List
+
+# Ensure project root is on sys.path when executed as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.fec import AUDIO_FEC_MAX_GROUP, VIDEO_FEC_MAX_GROUP, fec_group_size
+from common.media import (
+	AUDIO_FEC_FORMAT,
+	AudioFecDecoder,
+	AudioFecEncoder,
+	FrameReassembler,
+	fragment_frame,
+	frame_parity,
+	pack_audio,
+	parse_audio,
+	sender_prefix,
+)
+
+# ADPCM at 16 kHz: 20 ms of audio in bytes
+AUDIO_PAYLOAD_BYTES = 180
+
+
+class LossyChannel:
+	"""Gilbert model: losses start at a rate that gives the wanted average and last --burst datagrams on average."""
+
+	def __init__(self, loss: float, burst: float, seed: int) -> None:
+		self.rng = random.Random(seed)
+		self.end = 1.0 / max(1.0, burst)
+		self.start = loss * self.end / (1.0 - loss) if loss < 1.0 else 1.0
+		self.losing = False
+
+	def passes(self) -> bool:
+		self.losing = self.rng.random() >= self.end if self.losing else self.rng.random() < self.start
+		return not self.losing
+
+
+def run_video(args: argparse.Namespace, loss: float, fec: bool) -> tuple:
+	channel = LossyChannel(loss, args.burst, args.seed)
+	receiver = FrameReassembler()
+	prefix = sender_prefix("bench")
+	data = os.urandom(args.frame_bytes)
+	group = fec_group_size(loss, VIDEO_FEC_MAX_GROUP)
+	delivered = sent_bytes = data_bytes = 0
+	seq = 0
+	for frame_id in range(1, args.frames + 1):
+		packets = fragment_frame(prefix, frame_id, data, seq=seq)
+		data_bytes += sum(len(p) for p in packets)
+		first, seq = seq, seq + len(packets)
+		if fec:
+			packets = packets + frame_parity(prefix, frame_id, data, group, seq=first)
+		sent_bytes += sum(len(p) for p in packets)
+		for packet in packets:
+			if channel.passes() and receiver.add(packet) is not None:
+				delivered += 1
+	return delivered / args.frames, sent_bytes / data_bytes - 1, receiver.recovered, group if fec else 0
+
+
+def run_audio(args: argparse.Namespace, loss: float, fec: bool) -> tuple:
+	channel = LossyChannel(loss, args.burst, args.seed + 1)
+	group = fec_group_size(loss, AUDIO_FEC_MAX_GROUP)
+	encoder = AudioFecEncoder(group if fec else 0)
+	decoder = AudioFecDecoder()
+	payload = os.urandom(AUDIO_PAYLOAD_BYTES)
+	heard = set()
+	sent_bytes = data_bytes = 0
+	for seq in range(args.frames):
+		packet = pack_audio(seq & 0xFFFF, seq * 960, payload, 0x82)
+		out: List[bytes] = [packet]
+		parity = encoder.add(seq & 0xFFFF, packet)
+		if parity is not None:
+			out.append(parity)
+		data_bytes += len(packet)
+		sent_bytes += sum(len(p) for p in out)
+		for datagram in out:
+			if not channel.passes():
+				continue
+			s, _, fmt, body = parse_audio(datagram)
+			if fmt == AUDIO_FEC_FORMAT:
+				recovered = decoder.add_parity(s, body)  # type: ignore[arg-type]
+			else:
+				heard.add(s)
+				recovered = decoder.add(s, datagram)  # type: ignore[arg-type]
+			if recovered is not None:
+				heard.add(parse_audio(recovered)[0])
+	return len(heard) / args.frames, sent_bytes / data_bytes - 1, decoder.recovered, group if fec else 0
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--frames", type=int, default=2000)
+	parser.add_argument("--frame-bytes", type=int, default=30000, help="encoded frame size (30 kB: a 720p JPEG, 27 fragments)")
+	parser.add_argument("--loss", type=float, nargs="+", default=[0.01, 0.02, 0.05, 0.1])
+	parser.add_argument("--burst", type=float, default=1.0, help="mean datagrams per loss burst")
+	parser.add_argument("--seed", type=int, default=1)
+	args = parser.parse_args()
+
+	print(f"{args.frames} frames of {args.frame_bytes} bytes and {args.frames} audio datagrams, mean loss burst {args.burst:g}")
+	print(f"{'stream':<7} {'loss':>6} {'group':>6} {'delivered':>10} {'with FEC':>9} {'recovered':>10} {'overhead':>9}")
+	for name, run in (("video", run_video), ("audio", run_audio)):
+		for loss in args.loss:
+			plain = run(args, loss, False)
+			protected = run(args, loss, True)
+			print(
+				f"{name:<7} {loss:6.1%} {protected[3]:6d} {plain[0]:10.1%} {protected[0]:9.1%} {protected[2]:10d} {protected[1]:9.1%}"
+			)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,7 +1,11 @@
+import math
+import queue
 import socket
 import struct
 import threading
-from typing import Optional, Callable
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Callable, Set, Tuple
 
 import cv2
 import numpy as np
@@ -12,49 +16,458 @@ from common.constants import (
 	AUDIO_UDP_PORT,
 	VIDEO_WIDTH,
 	VIDEO_HEIGHT,
-	VIDEO_JPEG_QUALITY,
+	VIDEO_LAYERS,
+	VIDEO_QUALITY_MIN,
+	VIDEO_FPS_MAX,
+	VIDEO_FPS_MIN,
+	VIDEO_SCALE_MIN,
 	AUDIO_SAMPLE_RATE,
 	AUDIO_CHANNELS,
 	AUDIO_CHUNK_MS,
 )
-from common.protocol import make_message, send_json_line, REGISTER_AV
+from common.audio_codecs import CODEC_ADPCM, CODEC_PCM, CODEC_ULAW, AUDIO_NARROW_RATE, AudioDecoder, AudioEncoder, decoder_for
+from common.fec import AUDIO_FEC_MAX_GROUP, VIDEO_FEC_MAX_GROUP, LossMeter, fec_group_size
+from common.media import (
+	AUDIO_FEC_FORMAT,
+	AUDIO_PACKET_VERSION,
+	AUDIO_SID_INTERVAL_CHUNKS,
+	AudioFecDecoder,
+	AudioFecEncoder,
+	FrameReassembler,
+	RateController,
+	fragment_frame,
+	frame_parity,
+	initial_frame_id,
+	media_timestamp,
+	pack_audio,
+	pack_sid,
+	parse_audio,
+	sender_prefix,
+	seq_before,
+	sid_level,
+)
+from common.protocol import make_message, REGISTER_AV
+
+# Receive buffer for the video socket; one 720p keyframe arrives as dozens of back-to-back datagrams.
+VIDEO_RECV_BUFFER = 4 * 1024 * 1024
+# Longest the receiver waits for a datagram before checking whether a report is due.
+VIDEO_REPORT_POLL = 0.25
+# Static-scene suppression: captures are compared on a thumbnail about this many pixels wide,
+# a sample counts as changed once it moves by more than SCENE_PIXEL_DELTA, and a capture with
+# fewer than SCENE_CHANGE_FRACTION of its samples changed is not sent ...
+SCENE_THUMB_WIDTH = 160
+SCENE_PIXEL_DELTA = 12
+SCENE_CHANGE_FRACTION = 0.005
+# ... unless this long has passed, so late joiners and lossy receivers catch up. Kept under the
+# relay's LAYER_TIMEOUT so a still sender does not drop out of layer selection.
+STATIC_REFRESH_INTERVAL = 0.5
+# The camera is read again after this delay when a read fails, rather than spinning.
+CAPTURE_RETRY_DELAY = 0.05
+# A frame's datagrams are spread over this fraction of its layer's frame interval.
+PACING_FRACTION = 0.5
+# Pacing sleeps are at least this long; datagrams due within one go out together.
+PACING_MIN_SLEEP = 0.001
+# Encoded frames waiting for the send thread; beyond this the oldest is dropped.
+VIDEO_SEND_QUEUE_FRAMES = 4
+# Weight of each new sample in the per-stage latency averages.
+LATENCY_EWMA = 0.1
+# Audio playout: the jitter buffer aims for AUDIO_JITTER_MULTIPLIER x the measured jitter plus one
+# chunk, kept within AUDIO_MIN/MAX_DELAY_CHUNKS, and sheds at most one surplus chunk per
+# AUDIO_SHRINK_INTERVAL seconds once the network calms down.
+AUDIO_MIN_DELAY_CHUNKS = 1
+AUDIO_MAX_DELAY_CHUNKS = 10
+AUDIO_JITTER_MULTIPLIER = 3.0
+AUDIO_SHRINK_INTERVAL = 0.5
+# Lost chunks are concealed by repeating the last good one, scaled by AUDIO_PLC_DECAY per chunk,
+# for at most AUDIO_PLC_MAX_CHUNKS; longer gaps play silence.
+AUDIO_PLC_MAX_CHUNKS = 3
+AUDIO_PLC_DECAY = 0.5
+# The ring between the playout feeder and the device callback holds AUDIO_RING_CHUNKS chunks and is
+# kept AUDIO_RING_FILL_CHUNKS deep, which is all the latency the device side adds.
+AUDIO_RING_CHUNKS = 4
+AUDIO_RING_FILL_CHUNKS = 2
+# Audio payload formats offered to the server, preferred first; it answers with AUDIO_FORMAT.
+AUDIO_CODEC_PREFERENCE = (CODEC_ADPCM, CODEC_ULAW, CODEC_PCM)
+AUDIO_RATE_PREFERENCE = (AUDIO_NARROW_RATE, AUDIO_SAMPLE_RATE)
+# Voice activity: a chunk is speech when its level is VAD_MARGIN_DB above the tracked noise floor
+# and above VAD_SPEECH_MIN_DBFS. The floor follows quieter chunks at once (by VAD_FLOOR_FALL of
+# the gap) and creeps up by VAD_FLOOR_RISE_DB per chunk otherwise, from VAD_INITIAL_FLOOR_DBFS.
+VAD_MARGIN_DB = 10.0
+VAD_SPEECH_MIN_DBFS = -55.0
+VAD_FLOOR_FALL = 0.5
+VAD_FLOOR_RISE_DB = 0.02
+VAD_INITIAL_FLOOR_DBFS = -60.0
+# Chunks still sent after the last speech chunk, so word endings and short pauses are not clipped.
+VAD_HANGOVER_CHUNKS = 15
+# Threads decoding received JPEGs; cv2.imdecode releases the GIL, so they run in parallel.
+VIDEO_DECODE_WORKERS = 2
+# (scale factor, imdecode flag), largest reduction first
+_REDUCED_DECODE = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+class SceneChangeDetector:
+	"""Motion check on a strided thumbnail of the green channel, against the last frame sent."""
+
+	def __init__(self) -> None:
+		self.reference: Optional[np.ndarray] = None
+		# thumbnail of the frame last passed to changed()
+		self.thumb: Optional[np.ndarray] = None
+
+	def changed(self, frame: np.ndarray) -> bool:
+		step = max(1, frame.shape[1] // SCENE_THUMB_WIDTH)
+		thumb = frame[::step, ::step, 1].astype(np.int16)
+		self.thumb = thumb
+		if self.reference is None or self.reference.shape != thumb.shape:
+			return True
+		moved = np.count_nonzero(np.abs(thumb - self.reference) > SCENE_PIXEL_DELTA)
+		return moved > SCENE_CHANGE_FRACTION * thumb.size
+
+	def mark_sent(self, thumb: np.ndarray) -> None:
+		"""The frame with this thumbnail was encoded and queued; compare later ones against it."""
+		self.reference = thumb
+
+
+class VoiceActivityDetector:
+	"""Energy VAD against an adaptive noise floor, with hangover."""
+
+	def __init__(self) -> None:
+		self.floor_dbfs = VAD_INITIAL_FLOOR_DBFS
+		self.hangover = 0
+
+	def active(self, samples: np.ndarray) -> bool:
+		"""Whether this chunk of float samples in [-1, 1] should be sent."""
+		power = float(np.dot(samples, samples)) / max(1, len(samples))
+		level = 10 * math.log10(max(power, 1e-10))
+		if level < self.floor_dbfs:
+			self.floor_dbfs += (level - self.floor_dbfs) * VAD_FLOOR_FALL
+		else:
+			self.floor_dbfs = min(level, self.floor_dbfs + VAD_FLOOR_RISE_DB)
+		if level > max(self.floor_dbfs + VAD_MARGIN_DB, VAD_SPEECH_MIN_DBFS):
+			self.hangover = VAD_HANGOVER_CHUNKS
+			return True
+		if self.hangover > 0:
+			self.hangover -= 1
+			return True
+		return False
+
+
+class LatestSlot:
+	"""One-slot handoff between pipeline stages; a new item replaces one not yet taken."""
+
+	def __init__(self) -> None:
+		self.cond = threading.Condition()
+		self.item: Any = None
+		self.closed = False
+		self.replaced = 0
+
+	def put(self, item: Any) -> None:
+		with self.cond:
+			if self.item is not None:
+				self.replaced += 1
+			self.item = item
+			self.cond.notify()
+
+	def take(self) -> Any:
+		"""Block for the next item; None once closed."""
+		with self.cond:
+			while self.item is None and not self.closed:
+				self.cond.wait()
+			item, self.item = self.item, None
+			return item
+
+	def close(self) -> None:
+		with self.cond:
+			self.closed = True
+			self.item = None
+			self.cond.notify_all()
 
 
 class VideoSender(threading.Thread):
-	def __init__(self, server_ip: str, username: str) -> None:
+	"""Capture -> encode -> paced send, one thread per stage.
+
+	This thread reads the camera at its own pace and hands the newest frame to
+	the encoder, replacing one it has not picked up yet, so encoding never slows
+	capture down. The encoder applies rate control and encodes every layer; the
+	sender spreads each frame's datagrams over PACING_FRACTION of the frame
+	interval instead of bursting them. If sending falls behind, the oldest
+	waiting frame is dropped; a send error skips the rest of its frame. Frames carry their capture time in the
+	datagram header, and ``latency`` holds running per-stage averages in ms.
+	With ``fec``, each layer's frames are followed by XOR parity datagrams, one
+	per group of fragments sized to the loss its receivers last reported.
+	"""
+
+	def __init__(
+		self,
+		server_ip: str,
+		username: str,
+		sock: Optional[socket.socket] = None,
+		simulcast: bool = False,
+		fec: bool = False,
+	) -> None:
 		super().__init__(daemon=True)
 		self.server_addr = (server_ip, VIDEO_UDP_PORT)
-		self.username = username.encode("utf-8")[:255]
-		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.prefix = sender_prefix(username)
+		self.frame_id = initial_frame_id()
+		# (layer id, width, height, quality) per encoded stream; without simulcast only the full-size one
+		top = len(VIDEO_LAYERS) - 1
+		self.layers = [(i, *VIDEO_LAYERS[i]) for i in (range(len(VIDEO_LAYERS)) if simulcast else (top,))]
+		# per layer: congestion control fed by VIDEO_FEEDBACK, datagram seq, and when the next frame is due
+		self.controllers = {
+			layer: RateController(quality, VIDEO_QUALITY_MIN, VIDEO_FPS_MAX, VIDEO_FPS_MIN, VIDEO_SCALE_MIN)
+			for layer, _, _, quality in self.layers
+		}
+		self.control_lock = threading.Lock()
+		self.seqs = {layer: 0 for layer, _, _, _ in self.layers}
+		self.next_send = {layer: 0.0 for layer, _, _, _ in self.layers}
+		self.fec = fec
+		self.scene = SceneChangeDetector()
+		self.last_sent = 0.0
+		self.frames_suppressed = 0
+		# sending from the registered receive socket lets the relay attribute frames to our room
+		self.owns_sock = sock is None
+		self.sock = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 		self.cap = cv2.VideoCapture(0)
+		# capture at the send size so frames rarely need resizing
+		self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, VIDEO_WIDTH)
+		self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, VIDEO_HEIGHT)
+		# (capture time, frame, scene thumbnail) waiting for the encoder
+		self.captured = LatestSlot()
+		# (capture time, encode start, encode end, datagrams, pacing budget) in frame order; None stops
+		self.encoded: "queue.Queue[Optional[Tuple[float, float, float, List[bytes], float]]]" = queue.Queue(VIDEO_SEND_QUEUE_FRAMES)
+		self.frames_dropped = 0
+		self.send_errors = 0
+		# ms: capture to encode start, encode, first to last datagram, capture to last datagram
+		self.latency = {"queue": 0.0, "encode": 0.0, "pacing": 0.0, "total": 0.0}
+		self.stages = [threading.Thread(target=self._encode_loop, daemon=True), threading.Thread(target=self._send_loop, daemon=True)]
 		self.running = True
 
 	def run(self) -> None:
-		name_len = len(self.username)
-		prefix = bytes([name_len]) + self.username
+		for stage in self.stages:
+			stage.start()
 		while self.running:
 			ok, frame = self.cap.read()
 			if not ok:
+				time.sleep(CAPTURE_RETRY_DELAY)
 				continue
-			frame = cv2.resize(frame, (VIDEO_WIDTH, VIDEO_HEIGHT))
-			encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), VIDEO_JPEG_QUALITY]
-			ok, enc = cv2.imencode('.jpg', frame, encode_param)
-			if not ok:
+			now = time.monotonic()
+			# near-identical captures are skipped before any resize or encode work
+			if not self.scene.changed(frame) and now - self.last_sent < STATIC_REFRESH_INTERVAL:
+				self.frames_suppressed += 1
+				continue
+			# a frame replaced before the encoder takes it never becomes the reference
+			self.captured.put((now, frame, self.scene.thumb))
+
+	def _encode_loop(self) -> None:
+		while self.running:
+			item = self.captured.take()
+			if item is None:
+				return
+			captured_at, frame, thumb = item
+			started = time.monotonic()
+			if frame.shape[1] != VIDEO_WIDTH or frame.shape[0] != VIDEO_HEIGHT:
+				# the camera did not honour CAP_PROP_FRAME_WIDTH/HEIGHT
+				frame = cv2.resize(frame, (VIDEO_WIDTH, VIDEO_HEIGHT))
+			# every layer of one capture shares its frame id and timestamp
+			self.frame_id += 1
+			timestamp = media_timestamp(captured_at)
+			packets: List[bytes] = []
+			fps_max = 0.0
+			for layer, width, height, _ in self.layers:
+				controller = self.controllers[layer]
+				with self.control_lock:
+					controller.update(started)
+					quality, fps, scale, loss = controller.quality, controller.fps, controller.scale, controller.loss
+				if started < self.next_send[layer]:
+					continue
+				self.next_send[layer] = max(self.next_send[layer] + 1.0 / fps, started)
+				fps_max = max(fps_max, fps)
+				if scale < 1.0:
+					width, height = max(2, int(width * scale) & ~1), max(2, int(height * scale) & ~1)
+				scaled = frame if width == VIDEO_WIDTH else cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+				ok, enc = cv2.imencode('.jpg', scaled, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+				if not ok:
+					continue
+				data = enc.tobytes()
+				seq = self.seqs[layer]
+				layer_packets = fragment_frame(self.prefix, self.frame_id, data, layer=layer, seq=seq, timestamp=timestamp)
+				self.seqs[layer] = (seq + len(layer_packets)) & 0xFFFF
+				packets.extend(layer_packets)
+				if self.fec:
+					group = fec_group_size(loss, VIDEO_FEC_MAX_GROUP)
+					packets.extend(frame_parity(self.prefix, self.frame_id, data, group, layer=layer, seq=seq, timestamp=timestamp))
+			if packets:
+				self.scene.mark_sent(thumb)
+				self.last_sent = captured_at
+				self._enqueue((captured_at, started, time.monotonic(), packets, PACING_FRACTION / fps_max))
+
+	def _enqueue(self, job: Optional[Tuple[float, float, float, List[bytes], float]]) -> None:
+		# the receivers see a dropped frame's seqs as loss, which is what it is
+		while True:
+			try:
+				self.encoded.put_nowait(job)
+				return
+			except queue.Full:
+				pass
+			try:
+				oldest = self.encoded.get_nowait()
+			except queue.Empty:
 				continue
-			self.sock.sendto(prefix + enc.tobytes(), self.server_addr)
+			if oldest is None:
+				# stopping: keep the sentinel, drop the new frame
+				self.encoded.put(None)
+				return
+			self.frames_dropped += 1
+
+	def _send_loop(self) -> None:
+		while True:
+			job = self.encoded.get()
+			if job is None:
+				return
+			captured_at, encode_start, encoded_at, packets, budget = job
+			start = time.monotonic()
+			count = len(packets)
+			sent = 0
+			try:
+				while sent < count:
+					if not self.encoded.empty():
+						# the next frame is already waiting: flush this one rather than fall behind
+						budget = 0.0
+					elapsed = time.monotonic() - start
+					due = count if budget <= 0 else min(count, int(elapsed / budget * count) + 1)
+					while sent < due:
+						self.sock.sendto(packets[sent], self.server_addr)
+						sent += 1
+					if sent < count:
+						time.sleep(max(PACING_MIN_SLEEP, start + budget * sent / count - time.monotonic()))
+			except OSError:
+				if not self.running:
+					return
+				# timeout or ENOBUFS on the shared socket: skip the rest of this frame, not the stream
+				self.send_errors += 1
+				continue
+			done = time.monotonic()
+			self._record("queue", encode_start - captured_at)
+			self._record("encode", encoded_at - encode_start)
+			self._record("pacing", done - start)
+			self._record("total", done - captured_at)
+
+	def _record(self, stage: str, seconds: float) -> None:
+		self.latency[stage] += (seconds * 1000 - self.latency[stage]) * LATENCY_EWMA
+
+	def on_feedback(self, payload: Dict[str, Any]) -> None:
+		"""Apply one receiver's VIDEO_FEEDBACK; safe to call from any thread."""
+		controller = self.controllers.get(int(payload.get("layer", -1)))
+		if controller is None:
+			return
+		with self.control_lock:
+			controller.on_report(
+				str(payload.get("from", "")),
+				float(payload.get("fraction_lost", 0.0)),
+				float(payload.get("jitter_ms", 0.0)),
+				float(payload.get("bitrate_kbps", 0.0)),
+				time.monotonic(),
+			)
 
 	def stop(self) -> None:
 		self.running = False
+		self.captured.close()
+		self._enqueue(None)
 		self.cap.release()
-		self.sock.close()
+		if self.owns_sock:
+			self.sock.close()
+
+
+class DecodePool:
+	"""JPEG decode workers fed through a one-slot mailbox per sender.
+
+	A frame arriving while its sender's previous one still waits replaces it, so
+	each sender has at most one frame queued and one being decoded, and frames of
+	one sender are handed to on_frame in order. When target_width is set, frames
+	are decoded at the largest 1/2, 1/4 or 1/8 reduction still at least that wide,
+	judged from the sender's last frame.
+	"""
+
+	def __init__(self, on_frame: Callable[[str, np.ndarray], None], workers: int = VIDEO_DECODE_WORKERS) -> None:
+		self.on_frame = on_frame
+		self.cond = threading.Condition()
+		self.mailbox: Dict[str, bytes] = {}
+		# senders with a frame in the mailbox and no decode in progress, oldest first
+		self.ready: Deque[str] = deque()
+		self.busy: Set[str] = set()
+		# sender -> full width of its last frame
+		self.widths: Dict[str, int] = {}
+		self.target_width = 0
+		self.replaced = 0
+		self.running = True
+		self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(max(1, workers))]
+		for t in self.threads:
+			t.start()
+
+	def submit(self, name: str, jpeg: bytes) -> None:
+		with self.cond:
+			if name in self.mailbox:
+				self.replaced += 1
+			elif name not in self.busy:
+				self.ready.append(name)
+				self.cond.notify()
+			self.mailbox[name] = jpeg
+
+	def stop(self) -> None:
+		with self.cond:
+			self.running = False
+			self.mailbox.clear()
+			self.ready.clear()
+			self.cond.notify_all()
+
+	def _decode_flag(self, name: str) -> tuple[int, int]:
+		full, target = self.widths.get(name, 0), self.target_width
+		if full and target:
+			for factor, flag in _REDUCED_DECODE:
+				if full // factor >= target:
+					return factor, flag
+		return 1, cv2.IMREAD_COLOR
+
+	def _work(self) -> None:
+		while True:
+			with self.cond:
+				while self.running and not self.ready:
+					self.cond.wait()
+				if not self.running:
+					return
+				name = self.ready.popleft()
+				jpeg = self.mailbox.pop(name)
+				self.busy.add(name)
+				factor, flag = self._decode_flag(name)
+			frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flag)
+			if frame is not None:
+				self.widths[name] = frame.shape[1] * factor
+				self.on_frame(name, frame)
+			with self.cond:
+				self.busy.discard(name)
+				if name in self.mailbox and self.running:
+					self.ready.append(name)
+					self.cond.notify()
 
 
 class VideoReceiver(threading.Thread):
-	def __init__(self, on_frame: Callable[[str, np.ndarray], None]) -> None:
+	def __init__(
+		self,
+		on_frame: Callable[[str, np.ndarray], None],
+		on_report: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+	) -> None:
 		super().__init__(daemon=True)
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		try:
+			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, VIDEO_RECV_BUFFER)
+		except OSError:
+			pass
 		self.sock.bind(("0.0.0.0", 0))
-		self.on_frame = on_frame
+		# wake up between datagrams too, so reports go out while nothing arrives
+		self.sock.settimeout(VIDEO_REPORT_POLL)
+		self.on_report = on_report
+		self.reassembler = FrameReassembler()
+		# decoding happens off the socket thread so the kernel buffer keeps draining
+		self.decoder = DecodePool(on_frame)
 		self.running = True
 
 	@property
@@ -62,36 +475,255 @@ class VideoReceiver(threading.Thread):
 		return self.sock.getsockname()
 
 	def run(self) -> None:
+		stats = self.reassembler.stats
 		while self.running:
-			data, _ = self.sock.recvfrom(65535)
-			if not data:
+			try:
+				data, _ = self.sock.recvfrom(65535)
+			except socket.timeout:
+				data = None
+			now = time.monotonic()
+			if stats.due(now):
+				reports = stats.reports(now)
+				if reports and self.on_report is not None:
+					self.on_report(reports)
+			if data is None:
 				continue
-			name_len = data[0]
-			name = data[1:1+name_len].decode('utf-8', errors='ignore')
-			jpeg = data[1+name_len:]
-			arr = np.frombuffer(jpeg, dtype=np.uint8)
-			frame = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-			if frame is not None:
-				self.on_frame(name, frame)
+			done = self.reassembler.add(data)
+			if done is None:
+				continue
+			self.decoder.submit(*done)
+
+	def set_tile_width(self, width: int) -> None:
+		"""Width frames are displayed at; decoding may be reduced down to it (0: full size)."""
+		self.decoder.target_width = width
 
 	def stop(self) -> None:
 		self.running = False
+		self.decoder.stop()
 		self.sock.close()
 
 
+class PcmRing:
+	"""Single-producer, single-consumer int16 sample ring shared without a lock.
+
+	Only the writer advances ``written`` and only the reader advances ``read``;
+	each is one int store, atomic under the GIL, so the sounddevice callback can
+	read while the feeder writes. The writer checks space() before writing.
+	"""
+
+	def __init__(self, capacity: int) -> None:
+		self.buf = np.zeros(capacity, dtype=np.int16)
+		self.capacity = capacity
+		self.written = 0
+		self.read = 0
+		self.underflows = 0
+
+	def fill(self) -> int:
+		return self.written - self.read
+
+	def space(self) -> int:
+		return self.capacity - self.fill()
+
+	def write(self, samples: np.ndarray) -> None:
+		n = len(samples)
+		pos = self.written % self.capacity
+		first = min(n, self.capacity - pos)
+		self.buf[pos : pos + first] = samples[:first]
+		self.buf[: n - first] = samples[first:]
+		self.written += n
+
+	def read_into(self, out: np.ndarray) -> None:
+		"""Fill out from the ring, padding with silence on underflow."""
+		n = len(out)
+		k = min(n, self.written - self.read)
+		pos = self.read % self.capacity
+		first = min(k, self.capacity - pos)
+		out[:first] = self.buf[pos : pos + first]
+		out[first:k] = self.buf[: k - first]
+		if k < n:
+			out[k:] = 0
+			self.underflows += 1
+		self.read += k
+
+
+class AdaptiveJitterBuffer:
+	"""Sequence-ordered audio chunks with a playout depth that follows measured jitter.
+
+	The target depth is AUDIO_JITTER_MULTIPLIER times the RFC 3550 jitter of the
+	sample timestamps, plus one chunk, within the AUDIO_*_DELAY_CHUNKS bounds. When
+	the buffer runs dry it rebuffers up to the target, which is how delay grows
+	as jitter rises; while it holds more than the target it sheds one chunk every
+	AUDIO_SHRINK_INTERVAL, which is how it shrinks once the network is calm. A lost
+	or missing chunk is concealed by repeating the last good one at decaying volume.
+
+	After a silence descriptor the stream is in DTX: running dry is expected, so it
+	plays comfort noise at the descriptor's level instead of concealing, and the
+	next chunk restarts the sequence.
+
+	While the stream carries FEC, ``fec_chunks`` (the parity group size) is the
+	least target depth, so a chunk rebuilt at the end of its group is still in time.
+	"""
+
+	def __init__(self, chunk_samples: int, sample_rate: int) -> None:
+		self.chunk_samples = chunk_samples
+		self.sample_rate = sample_rate
+		self.chunk_ms = chunk_samples * 1000 / sample_rate
+		self.lock = threading.Lock()
+		self.chunks: Dict[int, np.ndarray] = {}
+		self.next_seq: Optional[int] = None
+		self.playing = False
+		self.target = AUDIO_MIN_DELAY_CHUNKS
+		self.jitter_ms = 0.0
+		self.transit: Optional[float] = None
+		self.last_good: Optional[np.ndarray] = None
+		self.loss_run = 0
+		self.last_shrink = 0.0
+		self.silence = np.zeros(chunk_samples, dtype=np.int16)
+		self.talking = True
+		self.noise_dbov: Optional[int] = None
+		self.rng = np.random.default_rng()
+		self.fec_chunks = 0
+		self.late = 0
+		self.concealed = 0
+		self.shed = 0
+
+	def push(self, seq: int, timestamp: Optional[int], samples: np.ndarray, now: float) -> None:
+		with self.lock:
+			self._arrival(timestamp, now)
+			if not self.talking:
+				self.talking = True
+				if not self.chunks:
+					self.next_seq = seq
+			if self.next_seq is None:
+				self.next_seq = seq
+			elif seq_before(seq, self.next_seq):
+				self.late += 1
+				return
+			self.chunks[seq] = samples
+			# a burst far beyond any target: skip ahead rather than play it all late
+			while len(self.chunks) > 2 * AUDIO_MAX_DELAY_CHUNKS:
+				self.chunks.pop(self.next_seq, None)
+				self.next_seq = (self.next_seq + 1) & 0xFFFF
+				self.shed += 1
+
+	def push_sid(self, seq: int, timestamp: int, noise_dbov: int, now: float) -> None:
+		"""The sender went quiet; its background noise is noise_dbov below full scale."""
+		with self.lock:
+			self._arrival(timestamp, now)
+			if self.next_seq is not None and seq_before(seq, self.next_seq):
+				self.late += 1
+				return
+			self.noise_dbov = noise_dbov
+			self.talking = False
+
+	def _arrival(self, timestamp: Optional[int], now: float) -> None:
+		if timestamp is None:
+			return
+		transit = now * 1000 - timestamp * 1000 / self.sample_rate
+		if self.transit is not None:
+			self.jitter_ms += (abs(transit - self.transit) - self.jitter_ms) / 16
+		self.transit = transit
+		wanted = max(math.ceil(AUDIO_JITTER_MULTIPLIER * self.jitter_ms / self.chunk_ms) + 1, self.fec_chunks)
+		self.target = max(AUDIO_MIN_DELAY_CHUNKS, min(AUDIO_MAX_DELAY_CHUNKS, wanted))
+
+	def pop(self, now: float) -> np.ndarray:
+		"""The next chunk_samples to play; silence or comfort noise while buffering."""
+		with self.lock:
+			if self.next_seq is None:
+				return self._idle()
+			if not self.playing:
+				if len(self.chunks) < self.target:
+					return self._idle()
+				self.playing = True
+			if len(self.chunks) > self.target + 1 and now - self.last_shrink >= AUDIO_SHRINK_INTERVAL:
+				self.chunks.pop(self.next_seq, None)
+				self.next_seq = (self.next_seq + 1) & 0xFFFF
+				self.last_shrink = now
+				self.shed += 1
+			if not self.chunks:
+				self.playing = False
+				return self._conceal() if self.talking else self._idle()
+			chunk = self.chunks.pop(self.next_seq, None)
+			self.next_seq = (self.next_seq + 1) & 0xFFFF
+			if chunk is None:
+				return self._conceal()
+			self.loss_run = 0
+			self.last_good = chunk
+			return chunk
+
+	def _idle(self) -> np.ndarray:
+		if self.noise_dbov is None:
+			return self.silence
+		rms = 32767 * 10 ** (-self.noise_dbov / 20)
+		return np.clip(self.rng.normal(0, rms, self.chunk_samples), -32768, 32767).astype(np.int16)
+
+	def _conceal(self) -> np.ndarray:
+		self.loss_run += 1
+		self.concealed += 1
+		if self.last_good is None or self.loss_run > AUDIO_PLC_MAX_CHUNKS:
+			return self.silence
+		return (self.last_good * AUDIO_PLC_DECAY ** self.loss_run).astype(np.int16)
+
+
 class AudioSender(threading.Thread):
-	def __init__(self, server_ip: str) -> None:
+	"""Microphone -> VAD/DTX -> encoder -> server, from the sound device callback.
+
+	With ``fec``, every few datagrams are followed by an XOR parity datagram. The
+	group size follows ``loss``, a LossMeter on the mix coming back over the same
+	link (the server sends no audio loss reports), or stays at its largest without one.
+	"""
+
+	def __init__(self, server_ip: str, sock: Optional[socket.socket] = None, fec: bool = False, loss: Optional[LossMeter] = None) -> None:
 		super().__init__(daemon=True)
 		self.server_addr = (server_ip, AUDIO_UDP_PORT)
-		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		self.owns_sock = sock is None
+		self.sock = sock or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 		self.running = True
 		self.blocksize = int(AUDIO_SAMPLE_RATE * AUDIO_CHUNK_MS / 1000)
+		self.seq = 0
+		self.timestamp = 0
+		# discontinuous transmission: while the VAD hears no speech only a SID goes out,
+		# when the silence starts and then every AUDIO_SID_INTERVAL_CHUNKS chunks
+		self.vad = VoiceActivityDetector()
+		self.sid_countdown = 0
+		self.suppressed = 0
+		# 48 kHz PCM until the server's AUDIO_FORMAT arrives
+		self.encoder = AudioEncoder(CODEC_PCM, AUDIO_SAMPLE_RATE)
+		self.fec = AudioFecEncoder(AUDIO_FEC_MAX_GROUP if fec else 0)
+		self.loss = loss
+
+	def set_format(self, codec: str, rate: int) -> None:
+		"""Send from now on in the format the server negotiated."""
+		self.encoder = AudioEncoder(codec, rate)
 
 	def _callback(self, indata, frames, time, status):
 		if not self.running:
 			return
-		pcm16 = (indata[:, 0] * 32767.0).astype(np.int16).tobytes()
-		self.sock.sendto(pcm16, self.server_addr)
+		samples = indata[:, 0]
+		sid = False
+		if self.vad.active(samples):
+			encoder = self.encoder
+			payload = encoder.encode((samples * 32767.0).astype(np.int16))
+			packet = pack_audio(self.seq, self.timestamp, payload, encoder.format)
+			self.sid_countdown = 0
+		elif self.sid_countdown <= 0:
+			packet = pack_sid(self.seq, self.timestamp, -self.vad.floor_dbfs)
+			self.sid_countdown = AUDIO_SID_INTERVAL_CHUNKS - 1
+			sid = True
+		else:
+			packet = None
+			self.sid_countdown -= 1
+			self.suppressed += 1
+		if packet is not None:
+			self.sock.sendto(packet, self.server_addr)
+			fec = self.fec
+			if fec.group and self.loss is not None:
+				fec.group = fec_group_size(self.loss.fraction, AUDIO_FEC_MAX_GROUP)
+			parity = fec.add(self.seq, packet, flush=sid)
+			if parity is not None:
+				self.sock.sendto(parity, self.server_addr)
+			self.seq = (self.seq + 1) & 0xFFFF
+		self.timestamp = (self.timestamp + frames) & 0xFFFFFFFF
 
 	def run(self) -> None:
 		with sd.InputStream(samplerate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS, callback=self._callback, blocksize=self.blocksize):
@@ -100,17 +732,37 @@ class AudioSender(threading.Thread):
 
 	def stop(self) -> None:
 		self.running = False
-		self.sock.close()
+		if self.owns_sock:
+			self.sock.close()
 
 
 class AudioReceiver(threading.Thread):
-	def __init__(self, control_sock: socket.socket) -> None:
+	"""Receives the server's mix into an AdaptiveJitterBuffer; playout is callback-driven.
+
+	A feeder thread keeps a small PcmRing topped up from the jitter buffer, and the
+	sounddevice callback only copies out of the ring, so network timing never
+	blocks the audio device and the device never waits on the network.
+
+	Parity datagrams rebuild single lost ones; with ``fec`` the receiver also asks
+	the server to send its mix with parity. ``loss`` measures the mix's loss
+	before recovery.
+	"""
+
+	def __init__(self, send_message: Callable[[Dict[str, Any]], None], fec: bool = False) -> None:
 		super().__init__(daemon=True)
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 		self.sock.bind(("0.0.0.0", 0))
 		self.running = True
 		self.blocksize = int(AUDIO_SAMPLE_RATE * AUDIO_CHUNK_MS / 1000)
-		self.control_sock = control_sock
+		# the control connection's send path, so REGISTER_AV uses its lock and codec
+		self.send_message = send_message
+		self.jitter = AdaptiveJitterBuffer(self.blocksize, AUDIO_SAMPLE_RATE)
+		self.ring = PcmRing(AUDIO_RING_CHUNKS * self.blocksize)
+		self.legacy_seq = 0
+		self.decoders: Dict[int, AudioDecoder] = {}
+		self.want_fec = fec
+		self.fec = AudioFecDecoder()
+		self.loss = LossMeter()
 
 	@property
 	def local_addr(self) -> tuple[str, int]:
@@ -118,12 +770,65 @@ class AudioReceiver(threading.Thread):
 
 	def run(self) -> None:
 		# register local ports for server-side relays
-		msg = make_message(REGISTER_AV, {"video_port": 0, "audio_port": self.local_addr[1]})
-		send_json_line(self.control_sock, msg)
-		with sd.OutputStream(samplerate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS, dtype='int16', blocksize=self.blocksize) as stream:
+		msg = make_message(REGISTER_AV, {
+			"video_port": 0,
+			"audio_port": self.local_addr[1],
+			"audio_header": AUDIO_PACKET_VERSION,
+			"audio_codecs": list(AUDIO_CODEC_PREFERENCE),
+			"audio_rates": list(AUDIO_RATE_PREFERENCE),
+			"audio_fec": self.want_fec,
+		})
+		self.send_message(msg)
+		threading.Thread(target=self._feed, daemon=True).start()
+		with sd.OutputStream(samplerate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS, dtype='int16', blocksize=self.blocksize, callback=self._play):
 			while self.running:
 				data, _ = self.sock.recvfrom(65535)
-				stream.write(np.frombuffer(data, dtype=np.int16).reshape(-1, 1))
+				try:
+					self._receive(data)
+				except ValueError:
+					# a malformed payload costs its datagram, not playback
+					continue
+
+	def _receive(self, data: bytes) -> None:
+		seq, timestamp, fmt, payload = parse_audio(data)
+		if seq is None:
+			seq = self.legacy_seq
+			self.legacy_seq = (seq + 1) & 0xFFFF
+			self._accept(seq, None, fmt, payload)
+			return
+		if fmt == AUDIO_FEC_FORMAT:
+			if payload:
+				self.jitter.fec_chunks = payload[0]
+			recovered = self.fec.add_parity(seq, payload)
+		else:
+			self.loss.packet(seq)
+			recovered = self.fec.add(seq, data)
+			self._accept(seq, timestamp, fmt, payload)
+		if recovered is not None:
+			self._accept(*parse_audio(recovered))  # type: ignore[arg-type]
+
+	def _accept(self, seq: int, timestamp: Optional[int], fmt: int, payload: bytes) -> None:
+		level = sid_level(payload) if timestamp is not None else None
+		if level is not None:
+			self.jitter.push_sid(seq, timestamp, level, time.monotonic())  # type: ignore[arg-type]
+			return
+		decoder = decoder_for(self.decoders, fmt)
+		if decoder is None:
+			return
+		samples = decoder.decode(payload)[: self.blocksize]
+		if len(samples) < self.blocksize:
+			samples = np.concatenate((samples, np.zeros(self.blocksize - len(samples), dtype=np.int16)))
+		self.jitter.push(seq, timestamp, samples, time.monotonic())
+
+	def _feed(self) -> None:
+		while self.running:
+			if self.ring.fill() < AUDIO_RING_FILL_CHUNKS * self.blocksize and self.ring.space() >= self.blocksize:
+				self.ring.write(self.jitter.pop(time.monotonic()))
+			else:
+				time.sleep(AUDIO_CHUNK_MS / 4000)
+
+	def _play(self, outdata, frames, time_info, status) -> None:
+		self.ring.read_into(outdata[:, 0])
 
 	def stop(self) -> None:
 		self.running = False
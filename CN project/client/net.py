@@ -1,8 +1,25 @@
 import socket
 import threading
-from typing import Optional
+from typing import List, Optional
 
-from common.protocol import make_message, send_json_line, recv_json_lines, HELLO
+from common.protocol import (
+	make_message,
+	encode_message,
+	send_json_line,
+	HELLO,
+	WELCOME,
+	HISTORY_REQUEST,
+	HISTORY,
+	FEATURE_ROSTER,
+	FEATURE_HEARTBEAT,
+	PING,
+	PONG,
+	CODEC_JSON,
+	DEFAULT_ROOM,
+	SUPPORTED_CODECS,
+	LineFramer,
+	LineTooLongError,
+)
 
 
 class ClientThread(threading.Thread):
@@ -10,39 +27,95 @@ class ClientThread(threading.Thread):
 		super().__init__(daemon=True)
 		self.window = window
 		self.sock: Optional[socket.socket] = None
-		self.buffer = bytearray()
+		self.framer = LineFramer()
+		# JSON until the server's WELCOME names another codec
+		self.codec = CODEC_JSON
+		self.history_page = 100
+		# oldest chat seq loaded so far, whether the server has older ones, and how many
+		# records the current load still wants (a page may come back trimmed)
+		self.history_oldest: Optional[int] = None
+		self.history_more = False
+		self.history_wanted = 0
+		self.send_lock = threading.Lock()
 		self.running = True
 
-	def connect_to_server(self, host: str, port: int, username: str) -> None:
+	def connect_to_server(self, host: str, port: int, username: str, room: str = DEFAULT_ROOM) -> None:
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.sock.connect((host, port))
 		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-		send_json_line(self.sock, make_message(HELLO, {"username": username}))
+		send_json_line(self.sock, make_message(HELLO, {"username": username, "room": room, "codecs": list(SUPPORTED_CODECS), "features": [FEATURE_ROSTER, FEATURE_HEARTBEAT]}))
 
 	def run(self) -> None:
 		if self.sock is None:
 			return
 		try:
 			while self.running:
-				chunk = self.sock.recv(4096)
-				if not chunk:
+				if not self.framer.recv_from(self.sock):
 					break
-				self.buffer.extend(chunk)
-				while True:
-					obj, self.buffer = recv_json_lines(self.buffer)
-					if obj is None:
-						break
-					self.window.handle_server_message(obj)
-		except OSError:
+				try:
+					messages = self.framer.messages()
+				except LineTooLongError as exc:
+					self._handle_all(exc.messages)
+					raise
+				self._handle_all(messages)
+		except (OSError, LineTooLongError):
 			pass
 		finally:
 			self.window.on_disconnected()
 
-	def send_chat(self, text: str) -> None:
+	def _handle_all(self, messages: List[dict]) -> None:
+		for obj in messages:
+			if obj.get("type") == WELCOME:
+				self._on_welcome(obj.get("payload", {}))
+			elif obj.get("type") == HISTORY:
+				self._on_history(obj.get("payload", {}))
+			elif obj.get("type") == PING:
+				self.send_message(make_message(PONG, {}))
+				continue
+			self.window.handle_server_message(obj)
+
+	def _on_welcome(self, payload: dict) -> None:
+		self.codec = str(payload.get("codec", CODEC_JSON))
+		history_seq = payload.get("history_seq")
+		self.history_more = False
+		if history_seq:
+			# everything after history_seq arrives live as CHAT_BROADCAST
+			self.history_oldest = int(history_seq) + 1
+			self.history_wanted = self.history_page
+			self.request_history_before(self.history_oldest)
+
+	def _on_history(self, payload: dict) -> None:
+		messages = payload.get("messages", [])
+		if messages:
+			self.history_oldest = int(messages[0]["seq"])
+		self.history_more = bool(payload.get("has_more")) and self.history_oldest is not None
+		self.history_wanted -= len(messages)
+		if self.history_more and self.history_wanted > 0 and messages:
+			self.request_history_before(self.history_oldest, self.history_wanted)
+		else:
+			self.history_wanted = 0
+
+	def request_older_history(self) -> bool:
+		"""Ask for the page before the oldest loaded message; False if there is none or a load is running."""
+		if not self.history_more or self.history_wanted > 0 or self.history_oldest is None:
+			return False
+		self.history_wanted = self.history_page
+		self.request_history_before(self.history_oldest)
+		return True
+
+	def request_history_before(self, seq: int, limit: Optional[int] = None) -> None:
+		self.send_message(make_message(HISTORY_REQUEST, {"before": seq, "limit": limit or self.history_page}))
+
+	def send_message(self, message: dict) -> None:
 		if self.sock is None:
 			return
+		data = encode_message(message, self.codec)
+		with self.send_lock:
+			self.sock.sendall(data)
+
+	def send_chat(self, text: str) -> None:
 		from common.protocol import CHAT
-		send_json_line(self.sock, make_message(CHAT, {"text": text}))
+		self.send_message(make_message(CHAT, {"text": text}))
 
 	def close(self) -> None:
 		self.running = False
@@ -7,19 +7,26 @@ from PIL import ImageGrab, Image
 import io
 
 from common.constants import SCREEN_TCP_PORT
+from common.protocol import DEFAULT_ROOM, SCREEN_PRESENT_ROOM, SCREEN_VIEWER_ROOM
+
+
+def _role_header(role: bytes, room: str) -> bytes:
+	name = room.encode("utf-8")[:255]
+	return role + bytes([len(name)]) + name
 
 
 class ScreenPresenter(threading.Thread):
-	def __init__(self, server_ip: str) -> None:
+	def __init__(self, server_ip: str, room: str = DEFAULT_ROOM) -> None:
 		super().__init__(daemon=True)
 		self.server_ip = server_ip
+		self.room = room
 		self.running = True
 		self.sock: socket.socket | None = None
 
 	def run(self) -> None:
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.sock.connect((self.server_ip, SCREEN_TCP_PORT))
-		self.sock.sendall(b"PRESENT")
+		self.sock.sendall(_role_header(SCREEN_PRESENT_ROOM, self.room))
 		try:
 			while self.running:
 				img = ImageGrab.grab()
@@ -48,9 +55,10 @@ class ScreenPresenter(threading.Thread):
 
 
 class ScreenViewer(threading.Thread):
-	def __init__(self, server_ip: str, on_image: Callable[[Image.Image], None]) -> None:
+	def __init__(self, server_ip: str, on_image: Callable[[Image.Image], None], room: str = DEFAULT_ROOM) -> None:
 		super().__init__(daemon=True)
 		self.server_ip = server_ip
+		self.room = room
 		self.on_image = on_image
 		self.running = True
 		self.sock: socket.socket | None = None
@@ -58,7 +66,7 @@ class ScreenViewer(threading.Thread):
 	def run(self) -> None:
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.sock.connect((self.server_ip, SCREEN_TCP_PORT))
-		self.sock.sendall(b"VIEWER\n")
+		self.sock.sendall(_role_header(SCREEN_VIEWER_ROOM, self.room))
 		try:
 			while self.running:
 				hdr = self._recv_exact(self.sock, 4)
@@ -1,12 +1,23 @@
+import threading
+
 from PyQt6 import QtCore, QtGui, QtWidgets
-from typing import Optional, Dict
+from typing import Any, Dict, List, Optional
 
-from common.protocol import CHAT_BROADCAST, USER_JOINED, USER_LEFT, ERROR
+from common.constants import VIDEO_LAYERS
+from common.protocol import DEFAULT_ROOM, VIDEO_LAYER, VIDEO_SUBSCRIBE, VIDEO_REPORT, VIDEO_FEEDBACK, AUDIO_FORMAT, ACTIVE_SPEAKER, make_message, CHAT_BROADCAST, USER_JOINED, USER_LEFT, ERROR, HISTORY, ROSTER_SNAPSHOT, ROSTER_DELTA
 from client.net import ClientThread
 from client.av import VideoSender, VideoReceiver, AudioSender, AudioReceiver
 from client.screenshare import ScreenPresenter, ScreenViewer
 from client.files import upload_file, download_file
 
+# Grid tiles are at least this wide; frames are scaled down to the tile width.
+VIDEO_TILE_MIN_WIDTH = 160
+VIDEO_GRID_COLUMNS = 2
+# Scrolling, resizing and roster changes are coalesced into one subscription update per this many ms.
+SUBSCRIPTION_DEBOUNCE_MS = 200
+# Upper bound on how often the video grid repaints, whatever the display's refresh rate.
+VIDEO_COMPOSITOR_MAX_HZ = 60
+
 
 class ChatWindow(QtWidgets.QWidget):
 	def __init__(self) -> None:
@@ -19,6 +30,8 @@ class ChatWindow(QtWidgets.QWidget):
 		self.server_port.setPlaceholderText("Port e.g. 5000")
 		self.username = QtWidgets.QLineEdit()
 		self.username.setPlaceholderText("Username")
+		self.room = QtWidgets.QLineEdit()
+		self.room.setPlaceholderText(f"Room (default: {DEFAULT_ROOM})")
 		self.connect_btn = QtWidgets.QPushButton("Connect")
 
 		self.tabs = QtWidgets.QTabWidget()
@@ -33,6 +46,7 @@ class ChatWindow(QtWidgets.QWidget):
 		top_form.addWidget(self.server_ip)
 		top_form.addWidget(self.server_port)
 		top_form.addWidget(self.username)
+		top_form.addWidget(self.room)
 		top_form.addWidget(self.connect_btn)
 		layout.addLayout(top_form)
 		layout.addWidget(self.tabs)
@@ -47,9 +61,30 @@ class ChatWindow(QtWidgets.QWidget):
 		self.viewer: Optional[ScreenViewer] = None
 
 		self.video_views: Dict[str, QtWidgets.QLabel] = {}
+		# latest decoded frame per sender not yet painted; decode threads fill it, the compositor tick drains it
+		self.pending_frames: Dict[str, Any] = {}
+		self.pending_lock = threading.Lock()
+		self.compositor_timer = QtCore.QTimer(self)
+		self.compositor_timer.setTimerType(QtCore.Qt.TimerType.PreciseTimer)
+		self.compositor_timer.timeout.connect(self._composite)
+		self.tile_width = VIDEO_LAYERS[-1][0]
+		# simulcast layer last requested from the relay (-1: none yet)
+		self.video_layer = -1
+		# payload last sent in VIDEO_SUBSCRIBE (None: nothing sent since A/V started)
+		self.video_subscription: Optional[Dict[str, Any]] = None
+		self.subscription_timer = QtCore.QTimer(self)
+		self.subscription_timer.setSingleShot(True)
+		self.subscription_timer.setInterval(SUBSCRIPTION_DEBOUNCE_MS)
+		self.subscription_timer.timeout.connect(self._update_subscriptions)
+		# id -> username, kept in sync from ROSTER_SNAPSHOT/ROSTER_DELTA
+		self.participants: Dict[str, str] = {}
+		self.roster_version = 0
+		# roster id of the room's current dominant speaker (ACTIVE_SPEAKER)
+		self.active_speaker: Optional[str] = None
 
 		self.connect_btn.clicked.connect(self.on_connect)
 		self.send_btn.clicked.connect(self.on_send)
+		self.older_btn.clicked.connect(self.on_load_older)
 		self.start_audio_btn.clicked.connect(self.on_start_audio)
 		self.stop_audio_btn.clicked.connect(self.on_stop_audio)
 		self.start_av_btn.clicked.connect(self.on_start_av)
@@ -60,6 +95,10 @@ class ChatWindow(QtWidgets.QWidget):
 		self.stop_view_btn.clicked.connect(self.on_stop_view)
 		self.upload_btn.clicked.connect(self.on_upload)
 		self.download_btn.clicked.connect(self.on_download)
+		self.mosaic_box.toggled.connect(self._on_mosaic_toggled)
+		self.tabs.currentChanged.connect(self._schedule_subscription_update)
+		self.video_scroll.verticalScrollBar().valueChanged.connect(self._schedule_subscription_update)
+		self.video_scroll.horizontalScrollBar().valueChanged.connect(self._schedule_subscription_update)
 
 	def _build_chat_tab(self) -> None:
 		self.chat_view = QtWidgets.QTextEdit()
@@ -67,11 +106,22 @@ class ChatWindow(QtWidgets.QWidget):
 		self.chat_input = QtWidgets.QLineEdit()
 		self.send_btn = QtWidgets.QPushButton("Send")
 		self.send_btn.setEnabled(False)
+		self.older_btn = QtWidgets.QPushButton("Load older")
+		self.older_btn.setEnabled(False)
+
+		self.participants_view = QtWidgets.QPlainTextEdit()
+		self.participants_view.setReadOnly(True)
+		self.participants_view.setMaximumWidth(180)
+		self.participants_view.setPlaceholderText("Participants")
 
 		chat_tab = QtWidgets.QWidget()
 		v = QtWidgets.QVBoxLayout(chat_tab)
-		v.addWidget(self.chat_view)
+		top = QtWidgets.QHBoxLayout()
+		top.addWidget(self.chat_view)
+		top.addWidget(self.participants_view)
+		v.addLayout(top)
 		h = QtWidgets.QHBoxLayout()
+		h.addWidget(self.older_btn)
 		h.addWidget(self.chat_input)
 		h.addWidget(self.send_btn)
 		v.addLayout(h)
@@ -82,6 +132,9 @@ class ChatWindow(QtWidgets.QWidget):
 		self.stop_audio_btn = QtWidgets.QPushButton("Stop Audio Chat")
 		self.stop_audio_btn.setEnabled(False)
 		
+		self.audio_fec_box = QtWidgets.QCheckBox("Audio FEC")
+		self.audio_fec_box.setToolTip("Send and receive audio with parity packets that repair single losses (lossy Wi-Fi)")
+
 		self.audio_status = QtWidgets.QLabel("Audio chat is not active")
 		self.audio_status.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
 		self.audio_status.setStyleSheet("padding: 20px; border: 1px solid gray; background-color: #f0f0f0;")
@@ -92,6 +145,7 @@ class ChatWindow(QtWidgets.QWidget):
 		h = QtWidgets.QHBoxLayout()
 		h.addWidget(self.start_audio_btn)
 		h.addWidget(self.stop_audio_btn)
+		h.addWidget(self.audio_fec_box)
 		v.addLayout(h)
 		self.tabs.addTab(audio_tab, "Audio Chat")
 
@@ -99,18 +153,30 @@ class ChatWindow(QtWidgets.QWidget):
 		self.video_grid = QtWidgets.QGridLayout()
 		self.start_av_btn = QtWidgets.QPushButton("Start A/V")
 		self.stop_av_btn = QtWidgets.QPushButton("Stop A/V")
+		self.simulcast_box = QtWidgets.QCheckBox("Simulcast")
+		self.simulcast_box.setToolTip("Also send smaller copies so viewers with small tiles download less")
+		self.simulcast_box.setChecked(True)
+		self.mosaic_box = QtWidgets.QCheckBox("Mosaic")
+		self.mosaic_box.setToolTip("Receive everyone as one server-composited stream (for slower machines)")
+		self.video_fec_box = QtWidgets.QCheckBox("Video FEC")
+		self.video_fec_box.setToolTip("Send parity packets so viewers on lossy links can repair lost fragments")
 
 		video_tab = QtWidgets.QWidget()
+		self.video_tab = video_tab
 		v = QtWidgets.QVBoxLayout(video_tab)
 		container = QtWidgets.QWidget()
 		container.setLayout(self.video_grid)
 		scroll = QtWidgets.QScrollArea()
 		scroll.setWidgetResizable(True)
 		scroll.setWidget(container)
+		self.video_scroll = scroll
 		v.addWidget(scroll)
 		h = QtWidgets.QHBoxLayout()
 		h.addWidget(self.start_av_btn)
 		h.addWidget(self.stop_av_btn)
+		h.addWidget(self.simulcast_box)
+		h.addWidget(self.mosaic_box)
+		h.addWidget(self.video_fec_box)
 		v.addLayout(h)
 		self.tabs.addTab(video_tab, "Video/Audio")
 
@@ -170,16 +236,20 @@ class ChatWindow(QtWidgets.QWidget):
 			return
 		self.thread = ClientThread(self)
 		try:
-			self.thread.connect_to_server(host, port, username)
+			self.thread.connect_to_server(host, port, username, self.room_name())
 		except OSError as e:
 			self.append_line(f"[system] Connection failed: {e}")
 			self.thread = None
 			return
 		self.thread.start()
 		self.connect_btn.setEnabled(False)
+		self.room.setEnabled(False)
 		self.send_btn.setEnabled(True)
 		self.append_line(f"[system] Connected to {host}:{port}")
 
+	def room_name(self) -> str:
+		return self.room.text().strip() or DEFAULT_ROOM
+
 	def on_send(self) -> None:
 		text = self.chat_input.text().strip()
 		if not text or self.thread is None:
@@ -200,12 +270,12 @@ class ChatWindow(QtWidgets.QWidget):
 			
 			# Start audio receiver first
 			if self.audio_receiver is None:
-				self.audio_receiver = AudioReceiver(self.thread.sock)  # type: ignore[arg-type]
+				self.audio_receiver = AudioReceiver(self.thread.send_message, self.audio_fec_box.isChecked())
 				self.audio_receiver.start()
 			
 			# Start audio sender
 			if self.audio_sender is None:
-				self.audio_sender = AudioSender(server_ip)
+				self.audio_sender = AudioSender(server_ip, self.audio_receiver.sock, self.audio_fec_box.isChecked(), self.audio_receiver.loss)
 				self.audio_sender.start()
 			
 			self.append_line("[audio] Audio chat started")
@@ -230,21 +300,34 @@ class ChatWindow(QtWidgets.QWidget):
 
 	def on_start_av(self) -> None:
 		if self.video_receiver is None:
-			self.video_receiver = VideoReceiver(self._on_video_frame)
+			self.video_receiver = VideoReceiver(self._on_video_frame, self._send_video_reports)
 			self.video_receiver.start()
 			# register video receive port
-			from common.protocol import make_message, send_json_line, REGISTER_AV
+			from common.protocol import REGISTER_AV
 			msg = make_message(REGISTER_AV, {"video_port": self.video_receiver.local_addr[1], "audio_port": 0})
-			send_json_line(self.thread.sock, msg)  # type: ignore[attr-defined]
+			self.thread.send_message(msg)  # type: ignore[union-attr]
+			self.video_layer = -1
+			self.video_subscription = None
+			self._update_tile_size()
+			self._schedule_subscription_update()
+			screen = self.screen()
+			hz = min(VIDEO_COMPOSITOR_MAX_HZ, screen.refreshRate() if screen is not None else VIDEO_COMPOSITOR_MAX_HZ)
+			self.compositor_timer.start(max(1, round(1000 / max(1.0, hz))))
 		if self.audio_receiver is None:
-			self.audio_receiver = AudioReceiver(self.thread.sock)  # type: ignore[arg-type]
+			self.audio_receiver = AudioReceiver(self.thread.send_message, self.audio_fec_box.isChecked())  # type: ignore[union-attr]
 			self.audio_receiver.start()
 		host = self.server_ip.text().strip()
 		if self.video_sender is None:
-			self.video_sender = VideoSender(host, self.username.text().strip())
+			self.video_sender = VideoSender(
+				host,
+				self.username.text().strip(),
+				self.video_receiver.sock,
+				self.simulcast_box.isChecked(),
+				self.video_fec_box.isChecked(),
+			)
 			self.video_sender.start()
 		if self.audio_sender is None:
-			self.audio_sender = AudioSender(host)
+			self.audio_sender = AudioSender(host, self.audio_receiver.sock, self.audio_fec_box.isChecked(), self.audio_receiver.loss)
 			self.audio_sender.start()
 
 	def on_stop_av(self) -> None:
@@ -260,28 +343,46 @@ class ChatWindow(QtWidgets.QWidget):
 		if self.audio_receiver:
 			self.audio_receiver.stop()
 			self.audio_receiver = None
+		self.compositor_timer.stop()
+		with self.pending_lock:
+			self.pending_frames.clear()
 		self._clear_video_grid()
 
+	def _send_video_reports(self, reports: List[Dict[str, Any]]) -> None:
+		# receiver thread; send_message serializes with the GUI thread's sends
+		if self.thread:
+			try:
+				self.thread.send_message(make_message(VIDEO_REPORT, {"reports": reports}))
+			except OSError:
+				pass
+
 	def _on_video_frame(self, name, frame) -> None:
-		label = self.video_views.get(name)
-		if label is None:
-			label = QtWidgets.QLabel()
-			label.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-			self.video_views[name] = label
-			self._relayout_grid()
-		# update pixmap
-		h, w, ch = frame.shape
-		bytes_per_line = ch * w
-		qimg = QtGui.QImage(frame.data, w, h, bytes_per_line, QtGui.QImage.Format.Format_BGR888)
-		pix = QtGui.QPixmap.fromImage(qimg)
-		def set_pix():
+		# decode threads: park the frame, replacing any the compositor has not painted yet
+		with self.pending_lock:
+			self.pending_frames[name] = frame
+
+	def _composite(self) -> None:
+		"""Compositor tick (GUI thread): paint each tile whose sender produced a frame since the last tick."""
+		with self.pending_lock:
+			if not self.pending_frames:
+				return
+			frames, self.pending_frames = self.pending_frames, {}
+		added = False
+		for name, frame in frames.items():
+			label = self.video_views.get(name)
+			if label is None:
+				label = QtWidgets.QLabel()
+				label.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
+				self.video_views[name] = label
+				added = True
+			h, w, ch = frame.shape
+			qimg = QtGui.QImage(frame.data, w, h, ch * w, QtGui.QImage.Format.Format_BGR888)
+			pix = QtGui.QPixmap.fromImage(qimg)
+			if w > self.tile_width:
+				pix = pix.scaledToWidth(self.tile_width, QtCore.Qt.TransformationMode.SmoothTransformation)
 			label.setPixmap(pix)
-		QtCore.QMetaObject.invokeMethod(self, "_noop", QtCore.Qt.ConnectionType.QueuedConnection)
-		QtCore.QTimer.singleShot(0, set_pix)
-
-	@QtCore.pyqtSlot()
-	def _noop(self) -> None:
-		pass
+		if added:
+			self._relayout_grid()
 
 	def _relayout_grid(self) -> None:
 		# simple grid placement
@@ -289,7 +390,8 @@ class ChatWindow(QtWidgets.QWidget):
 			item = self.video_grid.itemAt(i)
 			self.video_grid.removeItem(item)
 		row = col = 0
-		cols = 2
+		cols = VIDEO_GRID_COLUMNS
+		self._update_tile_size()
 		for name, label in self.video_views.items():
 			self.video_grid.addWidget(QtWidgets.QLabel(name), row, col)
 			self.video_grid.addWidget(label, row+1, col)
@@ -297,6 +399,63 @@ class ChatWindow(QtWidgets.QWidget):
 			if col >= cols:
 				col = 0
 				row += 2
+		self._schedule_subscription_update()
+
+	def _update_tile_size(self) -> None:
+		"""Recompute the tile width and ask the relay for the smallest layer that fills it."""
+		cols = max(1, min(VIDEO_GRID_COLUMNS, len(self.video_views)))
+		self.tile_width = max(VIDEO_TILE_MIN_WIDTH, self.video_scroll.viewport().width() // cols)
+		layer = next((i for i, (w, _, _) in enumerate(VIDEO_LAYERS) if w >= self.tile_width), len(VIDEO_LAYERS) - 1)
+		if self.video_receiver is not None:
+			self.video_receiver.set_tile_width(self.tile_width)
+		if layer != self.video_layer and self.thread is not None and self.video_receiver is not None:
+			self.video_layer = layer
+			self.thread.send_message(make_message(VIDEO_LAYER, {"layer": layer}))
+
+	def resizeEvent(self, event: QtGui.QResizeEvent) -> None:
+		super().resizeEvent(event)
+		self._update_tile_size()
+		self._schedule_subscription_update()
+
+	def changeEvent(self, event: QtCore.QEvent) -> None:
+		super().changeEvent(event)
+		if event.type() == QtCore.QEvent.Type.WindowStateChange:
+			# minimized: nothing is on screen, so stop all video
+			self._schedule_subscription_update()
+
+	def _schedule_subscription_update(self, *_: Any) -> None:
+		# callable from any thread; the update itself runs on the GUI thread
+		QtCore.QMetaObject.invokeMethod(self.subscription_timer, "start", QtCore.Qt.ConnectionType.QueuedConnection)
+
+	def _update_subscriptions(self) -> None:
+		"""Subscribe to the senders whose tiles are on screen, plus those without a tile yet."""
+		if self.thread is None or self.video_receiver is None or not self.participants:
+			return
+		streams: List[Dict[str, Any]] = []
+		visible = self.tabs.currentWidget() is self.video_tab and not self.isMinimized()
+		if visible:
+			viewport = self.video_scroll.viewport()
+			for member_id, username in list(self.participants.items()):
+				label = self.video_views.get(username)
+				if label is None or label.pixmap().isNull():
+					# no frame yet: stay subscribed so the tile can appear
+					streams.append({"id": member_id, "priority": 0})
+				elif QtCore.QRect(label.mapTo(viewport, QtCore.QPoint(0, 0)), label.size()).intersects(viewport.rect()):
+					streams.append({"id": member_id, "priority": 1})
+		payload: Dict[str, Any] = {"streams": streams}
+		if visible and self.mosaic_box.isChecked():
+			# "all" keeps every stream coming from servers without mosaic support
+			payload = {"all": True, "mosaic": True}
+		if payload != self.video_subscription:
+			self.video_subscription = payload
+			self.thread.send_message(make_message(VIDEO_SUBSCRIBE, payload))
+
+	def _on_mosaic_toggled(self, _checked: bool) -> None:
+		# the tiles shown so far belong to the other mode
+		with self.pending_lock:
+			self.pending_frames.clear()
+		self._clear_video_grid()
+		self._schedule_subscription_update()
 
 	def _clear_video_grid(self) -> None:
 		self.video_views.clear()
@@ -312,7 +471,7 @@ class ChatWindow(QtWidgets.QWidget):
 			if not server_ip:
 				self.append_line("[screen] Enter server IP first")
 				return
-			self.presenter = ScreenPresenter(server_ip)
+			self.presenter = ScreenPresenter(server_ip, self.room_name())
 			self.presenter.start()
 			self.append_line("[screen] Started presenting")
 			self.start_present_btn.setEnabled(False)
@@ -332,7 +491,7 @@ class ChatWindow(QtWidgets.QWidget):
 			if not server_ip:
 				self.append_line("[screen] Enter server IP first")
 				return
-			self.viewer = ScreenViewer(server_ip, self._on_screen_image)
+			self.viewer = ScreenViewer(server_ip, self._on_screen_image, self.room_name())
 			self.viewer.start()
 			self.append_line("[screen] Started viewing")
 			self.start_view_btn.setEnabled(False)
@@ -403,6 +562,62 @@ class ChatWindow(QtWidgets.QWidget):
 		if type_ == CHAT_BROADCAST:
 			self.append_line(f"{payload.get('username')}: {payload.get('text')}")
 			return
+		if type_ == HISTORY:
+			# every page is older than what is on screen, so it goes above it
+			lines = [f"[history] {r.get('username')}: {r.get('text')}" for r in payload.get("messages", [])]
+			if lines:
+				QtCore.QMetaObject.invokeMethod(
+					self,
+					"_prepend_lines",
+					QtCore.Qt.ConnectionType.QueuedConnection,
+					QtCore.Q_ARG(str, "\n".join(lines)),
+				)
+			thread = self.thread
+			idle = thread is not None and thread.history_more and thread.history_wanted <= 0
+			QtCore.QMetaObject.invokeMethod(
+				self.older_btn,
+				"setEnabled",
+				QtCore.Qt.ConnectionType.QueuedConnection,
+				QtCore.Q_ARG(bool, idle),
+			)
+			return
+		if type_ == ROSTER_SNAPSHOT:
+			self.participants = {m["id"]: m["username"] for m in payload.get("members", [])}
+			self.roster_version = int(payload.get("version", 0))
+			self._show_participants()
+			self._schedule_subscription_update()
+			return
+		if type_ == ROSTER_DELTA:
+			if int(payload.get("version", 0)) <= self.roster_version:
+				return
+			self.roster_version = int(payload.get("version", 0))
+			for member_id in payload.get("left", []):
+				name = self.participants.pop(member_id, None)
+				if name is not None:
+					self.append_line(f"[leave] {name}")
+			for m in payload.get("joined", []):
+				if m["id"] not in self.participants:
+					self.append_line(f"[join] {m['username']}")
+				self.participants[m["id"]] = m["username"]
+			self._show_participants()
+			self._schedule_subscription_update()
+			return
+		if type_ == VIDEO_FEEDBACK:
+			sender = self.video_sender
+			if sender is not None:
+				sender.on_feedback(payload)
+			return
+		if type_ == AUDIO_FORMAT:
+			# the sender is created with the receiver that registered, so it exists by now
+			audio_sender = self.audio_sender
+			if audio_sender is not None:
+				audio_sender.set_format(str(payload.get("codec")), int(payload.get("rate", 0)))
+				self.append_line(f"[audio] Sending {payload.get('codec')} at {payload.get('rate')} Hz")
+			return
+		if type_ == ACTIVE_SPEAKER:
+			self.active_speaker = str(payload.get("id"))
+			self._show_participants()
+			return
 		if type_ == USER_JOINED:
 			self.append_line(f"[join] {payload.get('username')}")
 			return
@@ -413,6 +628,28 @@ class ChatWindow(QtWidgets.QWidget):
 			self.append_line(f"[error] {payload.get('message')}")
 			return
 
+	def _show_participants(self) -> None:
+		names = sorted(
+			(f"{name} (speaking)" if member_id == self.active_speaker else name for member_id, name in self.participants.items()),
+			key=str.lower,
+		)
+		QtCore.QMetaObject.invokeMethod(
+			self.participants_view,
+			"setPlainText",
+			QtCore.Qt.ConnectionType.QueuedConnection,
+			QtCore.Q_ARG(str, "\n".join(names)),
+		)
+
+	@QtCore.pyqtSlot(str)
+	def _prepend_lines(self, text: str) -> None:
+		cursor = QtGui.QTextCursor(self.chat_view.document())
+		cursor.movePosition(QtGui.QTextCursor.MoveOperation.Start)
+		cursor.insertText(text + "\n")
+
+	def on_load_older(self) -> None:
+		if self.thread is not None and self.thread.request_older_history():
+			self.older_btn.setEnabled(False)
+
 	def append_line(self, text: str) -> None:
 		QtCore.QMetaObject.invokeMethod(
 			self.chat_view,
@@ -423,5 +660,11 @@ class ChatWindow(QtWidgets.QWidget):
 
 	def on_disconnected(self) -> None:
 		self.append_line("[system] Disconnected")
+		self.participants.clear()
+		self.roster_version = 0
+		self.active_speaker = None
+		self._show_participants()
 		self.connect_btn.setEnabled(True)
+		self.room.setEnabled(True)
 		self.send_btn.setEnabled(False)
+		self.older_btn.setEnabled(False)
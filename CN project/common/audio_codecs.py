@@ -0,0 +1,239 @@
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from common.constants import AUDIO_SAMPLE_RATE
+
+# Audio payload codecs. Every stream is mixed and played at AUDIO_SAMPLE_RATE; a codec may carry
+# it at AUDIO_NARROW_RATE instead, which is plenty for speech and a third of the samples.
+CODEC_PCM = "pcm"
+CODEC_ULAW = "ulaw"
+CODEC_ADPCM = "adpcm"
+AUDIO_NARROW_RATE = 16000
+SUPPORTED_AUDIO_CODECS = (CODEC_ADPCM, CODEC_ULAW, CODEC_PCM)
+SUPPORTED_AUDIO_RATES = (AUDIO_NARROW_RATE, AUDIO_SAMPLE_RATE)
+# Wire id of a payload format (the audio header's format byte): codec in the low bits, high bit
+# set for AUDIO_NARROW_RATE. 0 is 48 kHz PCM, what headerless and version 1 datagrams carry.
+_CODEC_IDS = {CODEC_PCM: 0, CODEC_ULAW: 1, CODEC_ADPCM: 2}
+_NARROW_FLAG = 0x80
+
+# G.711 mu-law: bias added before finding the segment, and the largest magnitude it encodes.
+ULAW_BIAS = 0x84
+ULAW_CLIP = 32635
+# IMA-ADPCM is coded in independent blocks of ADPCM_BLOCK_SAMPLES, each opening with its first
+# sample and step index, so one datagram never depends on the one before. The blocks of a frame
+# are coded side by side as the rows of one array; only the samples within a block are serial.
+ADPCM_BLOCK_SAMPLES = 32
+_ADPCM_BLOCK_HEADER = 3
+# Resampling: windowed-sinc low-pass of RESAMPLE_TAPS (a multiple of the 48/16 ratio) cutting
+# off at RESAMPLE_CUTOFF of the narrow rate's Nyquist frequency.
+RESAMPLE_TAPS = 48
+RESAMPLE_CUTOFF = 0.9
+
+_IMA_STEPS = np.array([
+	7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+	50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307,
+	337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+	2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899,
+	15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+], dtype=np.int32)
+_IMA_INDEX_ADJUST = np.array([-1, -1, -1, -1, 2, 4, 6, 8], dtype=np.int32)
+# ADPCM coder state is step index * 8; adding a 3-bit magnitude code gives the row of tables for
+# the reconstructed difference and the next state, and _ADPCM_STEP maps a state to its step. The
+# predictor is not clamped between samples (both ends track it in int32); decoded output is.
+_ADPCM_STEP = np.repeat(_IMA_STEPS, 8)
+_ADPCM_DELTA = ((_IMA_STEPS[:, None] * (2 * np.arange(8) + 1)) >> 3).reshape(-1).astype(np.int32)
+_ADPCM_NEXT = (np.clip(np.arange(len(_IMA_STEPS))[:, None] + _IMA_INDEX_ADJUST, 0, len(_IMA_STEPS) - 1) * 8).reshape(-1).astype(np.int32)
+
+
+def _ulaw_tables() -> Tuple[np.ndarray, np.ndarray]:
+	# the ITU reference works on 14-bit samples; the arithmetic shift rounds negatives away from zero
+	pcm = np.arange(-32768, 32768, dtype=np.int32) >> 2
+	mag = np.minimum(np.abs(pcm), ULAW_CLIP >> 2) + (ULAW_BIAS >> 2)
+	segment = np.floor(np.log2(mag)).astype(np.int32) - 5
+	codes = np.where(segment > 7, 0x7F, (np.minimum(segment, 7) << 4) | ((mag >> (np.minimum(segment, 7) + 1)) & 0x0F))
+	codes ^= np.where(pcm < 0, 0x7F, 0xFF)
+	# indexed by the int16 sample reinterpreted as uint16
+	encode = np.roll(codes.astype(np.uint8), -32768)
+	u = ~np.arange(256, dtype=np.int32) & 0xFF
+	mag = (((u & 0x0F) << 3) + ULAW_BIAS << ((u >> 4) & 7)) - ULAW_BIAS
+	decode = np.where(u & 0x80, -mag, mag).astype(np.int16)
+	return encode, decode
+
+
+_ULAW_ENCODE, _ULAW_DECODE = _ulaw_tables()
+
+
+def ulaw_encode(pcm: np.ndarray) -> bytes:
+	return _ULAW_ENCODE[pcm.view(np.uint16)].tobytes()
+
+
+def ulaw_decode(data: bytes) -> np.ndarray:
+	return _ULAW_DECODE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def adpcm_encode(pcm: np.ndarray) -> bytes:
+	"""IMA-ADPCM, 4 bits per sample: [first sample i16 per block][step index u8 per block][nibbles]."""
+	pad = -len(pcm) % ADPCM_BLOCK_SAMPLES
+	x = np.concatenate((pcm, np.repeat(pcm[-1:], pad))) if pad else pcm
+	x = x.astype(np.int32).reshape(-1, ADPCM_BLOCK_SAMPLES)
+	# open each block at a step of about twice its average slope, which tracks voice best
+	slope = 2 * np.abs(np.diff(x, axis=1)).mean(axis=1)
+	index = np.minimum(np.searchsorted(_IMA_STEPS, slope), len(_IMA_STEPS) - 1)
+	header = x[:, 0].astype(">i2").tobytes() + index.astype(np.uint8).tobytes()
+	# sample-major, so each step of the loop reads and writes one contiguous row
+	xt = np.ascontiguousarray(x.T)
+	mags = np.empty(xt.shape, dtype=np.int32)
+	negative = np.empty(xt.shape, dtype=bool)
+	pred = xt[0].copy()
+	state = index.astype(np.int32) * 8
+	step = _ADPCM_STEP[state]
+	for i in range(ADPCM_BLOCK_SAMPLES):
+		diff = xt[i] - pred
+		neg = np.less(diff, 0, out=negative[i])
+		mag = np.minimum(np.abs(diff) * 4 // step, 7, out=mags[i])
+		k = state + mag
+		delta = _ADPCM_DELTA[k]
+		pred += np.where(neg, -delta, delta)
+		state = _ADPCM_NEXT[k]
+		step = _ADPCM_STEP[state]
+	flat = (mags | (negative << 3)).T.astype(np.uint8).reshape(-1)
+	return header + (flat[0::2] | (flat[1::2] << 4)).tobytes()
+
+
+def adpcm_decode(data: bytes) -> np.ndarray:
+	blocks = len(data) // (_ADPCM_BLOCK_HEADER + ADPCM_BLOCK_SAMPLES // 2)
+	first = np.frombuffer(data, dtype=">i2", count=blocks).astype(np.int32)
+	index = np.frombuffer(data, dtype=np.uint8, count=blocks, offset=2 * blocks).astype(np.int32)
+	packed = np.frombuffer(data, dtype=np.uint8, count=blocks * ADPCM_BLOCK_SAMPLES // 2, offset=_ADPCM_BLOCK_HEADER * blocks)
+	codes = np.empty((blocks, ADPCM_BLOCK_SAMPLES), dtype=np.int32)
+	codes.reshape(-1)[0::2] = packed & 0x0F
+	codes.reshape(-1)[1::2] = packed >> 4
+	mags = codes & 7
+	# only the step index is serial; it depends on the codes alone
+	mags_t = np.ascontiguousarray(mags.T)
+	states = np.empty(mags_t.shape, dtype=np.int32)
+	state = np.minimum(index, len(_IMA_STEPS) - 1) * 8
+	for i in range(ADPCM_BLOCK_SAMPLES):
+		states[i] = state
+		state = _ADPCM_NEXT[state + mags_t[i]]
+	delta = _ADPCM_DELTA[states.T + mags]
+	pred = first[:, None] + np.cumsum(np.where(codes & 8, -delta, delta), axis=1)
+	return np.clip(pred, -32768, 32767).astype(np.int16).reshape(-1)
+
+
+_ENCODERS = {CODEC_PCM: lambda pcm: pcm.astype("<i2").tobytes(), CODEC_ULAW: ulaw_encode, CODEC_ADPCM: adpcm_encode}
+_DECODERS = {CODEC_PCM: lambda data: np.frombuffer(data[: len(data) & ~1], dtype="<i2").astype(np.int16), CODEC_ULAW: ulaw_decode, CODEC_ADPCM: adpcm_decode}
+
+
+def _lowpass() -> np.ndarray:
+	ratio = AUDIO_SAMPLE_RATE // AUDIO_NARROW_RATE
+	cutoff = RESAMPLE_CUTOFF / (2 * ratio)
+	n = np.arange(RESAMPLE_TAPS) - (RESAMPLE_TAPS - 1) / 2
+	taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(RESAMPLE_TAPS)
+	return taps / taps.sum()
+
+
+_LOWPASS = _lowpass()
+
+
+class Downsampler:
+	"""48 kHz -> AUDIO_NARROW_RATE for one stream; keeps the filter history between chunks."""
+
+	def __init__(self) -> None:
+		self.ratio = AUDIO_SAMPLE_RATE // AUDIO_NARROW_RATE
+		self.history = np.zeros(RESAMPLE_TAPS - 1)
+
+	def process(self, pcm: np.ndarray) -> np.ndarray:
+		if not len(pcm):
+			return np.zeros(0, dtype=np.int16)
+		x = np.concatenate((self.history, pcm))
+		self.history = x[len(x) - (RESAMPLE_TAPS - 1) :]
+		# only the kept outputs: every ratio-th window dotted with the (symmetric) filter
+		y = sliding_window_view(x, RESAMPLE_TAPS)[:: self.ratio] @ _LOWPASS
+		return np.clip(np.rint(y), -32768, 32767).astype(np.int16)
+
+
+class Upsampler:
+	"""AUDIO_NARROW_RATE -> 48 kHz for one stream, polyphase, with history between chunks."""
+
+	def __init__(self) -> None:
+		self.ratio = AUDIO_SAMPLE_RATE // AUDIO_NARROW_RATE
+		self.width = RESAMPLE_TAPS // self.ratio
+		self.history = np.zeros(self.width - 1)
+		# phases[k, p]: tap for output phase p from the input k samples back
+		self.phases = (_LOWPASS * self.ratio).reshape(self.width, self.ratio)[::-1]
+
+	def process(self, pcm: np.ndarray) -> np.ndarray:
+		if not len(pcm):
+			# an empty (or sub-sample) payload; the caller pads its chunk with silence
+			return np.zeros(0, dtype=np.int16)
+		x = np.concatenate((self.history, pcm))
+		self.history = x[len(x) - (self.width - 1) :]
+		y = (sliding_window_view(x, self.width) @ self.phases).reshape(-1)
+		return np.clip(np.rint(y), -32768, 32767).astype(np.int16)
+
+
+def format_id(codec: str, rate: int) -> int:
+	return _CODEC_IDS[codec] | (_NARROW_FLAG if rate == AUDIO_NARROW_RATE else 0)
+
+
+def parse_format(fmt: int) -> Optional[Tuple[str, int]]:
+	"""(codec, rate) of a wire format id, or None if unknown."""
+	for codec, code in _CODEC_IDS.items():
+		if code == fmt & ~_NARROW_FLAG:
+			return codec, AUDIO_NARROW_RATE if fmt & _NARROW_FLAG else AUDIO_SAMPLE_RATE
+	return None
+
+
+def negotiate_audio_format(codecs: Any, rates: Any) -> Tuple[str, int]:
+	"""First codec and rate we support from a REGISTER_AV offer; 48 kHz PCM if none."""
+	codec = next((c for c in codecs if c in SUPPORTED_AUDIO_CODECS), CODEC_PCM) if isinstance(codecs, list) else CODEC_PCM
+	rate = next((r for r in rates if r in SUPPORTED_AUDIO_RATES), AUDIO_SAMPLE_RATE) if isinstance(rates, list) else AUDIO_SAMPLE_RATE
+	return codec, rate
+
+
+class AudioEncoder:
+	"""48 kHz int16 chunks -> payloads of one format. One per outgoing stream (resampler state)."""
+
+	def __init__(self, codec: str, rate: int) -> None:
+		self.codec = codec
+		self.rate = rate
+		self.format = format_id(codec, rate)
+		self.encode_chunk = _ENCODERS[codec]
+		self.resampler = Downsampler() if rate != AUDIO_SAMPLE_RATE else None
+
+	def encode(self, pcm: np.ndarray) -> bytes:
+		if self.resampler is not None:
+			pcm = self.resampler.process(pcm)
+		return self.encode_chunk(pcm)
+
+
+class AudioDecoder:
+	"""Payloads of one format -> 48 kHz int16. One per incoming stream and format.
+
+	A payload too short to hold a sample decodes to no samples; receivers pad
+	chunks to full length, so it plays as silence.
+	"""
+
+	def __init__(self, codec: str, rate: int) -> None:
+		self.decode_chunk = _DECODERS[codec]
+		self.resampler = Upsampler() if rate != AUDIO_SAMPLE_RATE else None
+
+	def decode(self, payload: bytes) -> np.ndarray:
+		pcm = self.decode_chunk(payload)
+		if self.resampler is not None:
+			pcm = self.resampler.process(pcm)
+		return pcm
+
+
+def decoder_for(decoders: Dict[int, AudioDecoder], fmt: int) -> Optional[AudioDecoder]:
+	"""The stream's decoder for fmt from decoders, created on first use; None if fmt is unknown."""
+	decoder = decoders.get(fmt)
+	if decoder is None:
+		parsed = parse_format(fmt)
+		if parsed is None:
+			return None
+		decoder = decoders[fmt] = AudioDecoder(*parsed)
+	return decoder
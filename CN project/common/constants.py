@@ -4,9 +4,16 @@ AUDIO_UDP_PORT = 5002
 SCREEN_TCP_PORT = 5003
 FILE_TCP_PORT = 5004
 
-VIDEO_WIDTH = 320
-VIDEO_HEIGHT = 240
+VIDEO_WIDTH = 1280
+VIDEO_HEIGHT = 720
 VIDEO_JPEG_QUALITY = 50
+# Simulcast layers as (width, height, JPEG quality), lowest first; the last is the full-size stream.
+VIDEO_LAYERS = ((320, 180, 45), (640, 360, 50), (VIDEO_WIDTH, VIDEO_HEIGHT, VIDEO_JPEG_QUALITY))
+# Bounds for the sender's congestion control; each layer starts at its own quality, VIDEO_FPS_MAX and full size.
+VIDEO_QUALITY_MIN = 20
+VIDEO_FPS_MAX = 30.0
+VIDEO_FPS_MIN = 5.0
+VIDEO_SCALE_MIN = 0.5
 
 AUDIO_SAMPLE_RATE = 48000
 AUDIO_CHANNELS = 1
@@ -0,0 +1,108 @@
+import struct
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# XOR-parity forward error correction. A parity packet is the XOR of a group of
+# packets, each zero-padded to the longest, plus the XOR of their lengths; with it,
+# any one packet of the group can be rebuilt from the others. Two losses in one
+# group are not recoverable, so groups shrink as loss rises.
+
+# Groups are as large as keeps the chance of two losses in one group (parity
+# included) at the measured loss within this ...
+FEC_TARGET_LOSS = 0.01
+# ... between these many data packets per parity packet.
+FEC_MIN_GROUP = 2
+VIDEO_FEC_MAX_GROUP = 16
+# Audio waits for a whole group before it can recover, so its groups stay short.
+AUDIO_FEC_MAX_GROUP = 3
+
+# Loss is measured over windows of this many expected packets ...
+LOSS_WINDOW = 50
+# ... and smoothed across windows with this weight.
+LOSS_SMOOTHING = 0.5
+# A sequence jump larger than this is a restarted sender, not loss.
+LOSS_MAX_GAP = 1000
+
+_LENGTH = struct.Struct("!H")
+
+
+def fec_group_size(loss: float, max_group: int) -> int:
+	"""Data packets per parity packet for a channel losing fraction loss of its packets."""
+	q = 1.0 - loss
+	for k in range(max_group, FEC_MIN_GROUP - 1, -1):
+		n = k + 1
+		if 1.0 - q**n - n * loss * q ** (n - 1) <= FEC_TARGET_LOSS:
+			return k
+	return FEC_MIN_GROUP
+
+
+def xor_parity(packets: Sequence[bytes]) -> bytes:
+	"""[XOR of the lengths u16][XOR of the packets, zero-padded to the longest]."""
+	size = max(len(p) for p in packets)
+	rows = np.zeros((len(packets), size), dtype=np.uint8)
+	length = 0
+	for row, packet in zip(rows, packets):
+		row[: len(packet)] = np.frombuffer(packet, dtype=np.uint8)
+		length ^= len(packet)
+	return _LENGTH.pack(length) + np.bitwise_xor.reduce(rows, axis=0).tobytes()
+
+
+def xor_recover(parity: bytes, others: Sequence[bytes]) -> Optional[bytes]:
+	"""The one packet of a group missing from others, given the group's xor_parity; None if malformed."""
+	if len(parity) < _LENGTH.size:
+		return None
+	(length,) = _LENGTH.unpack_from(parity)
+	rebuilt = np.frombuffer(parity, dtype=np.uint8, offset=_LENGTH.size).copy()
+	for packet in others:
+		if len(packet) > len(rebuilt):
+			return None
+		rebuilt[: len(packet)] ^= np.frombuffer(packet, dtype=np.uint8)
+		length ^= len(packet)
+	if length > len(rebuilt):
+		return None
+	return rebuilt[:length].tobytes()
+
+
+def xor_parity_interleaved(data: bytes, chunk: int, groups: int) -> List[bytes]:
+	"""xor_parity per group of data cut into chunk-byte packets, packet i in group i % groups."""
+	count = max(1, -(-len(data) // chunk))
+	rows = -(-count // groups) * groups
+	matrix = np.zeros(rows * chunk, dtype=np.uint8)
+	matrix[: len(data)] = np.frombuffer(data, dtype=np.uint8)
+	bodies = np.bitwise_xor.reduce(matrix.reshape(rows // groups, groups, chunk), axis=0)
+	lengths = [0] * groups
+	for i in range(count):
+		lengths[i % groups] ^= chunk if i < count - 1 else len(data) - i * chunk
+	return [_LENGTH.pack(lengths[g]) + bodies[g].tobytes() for g in range(groups)]
+
+
+class LossMeter:
+	"""Fraction of a u16-sequenced stream's packets that never arrived.
+
+	Counts the sequence numbers expected against the packets received, per
+	LOSS_WINDOW expected, and smooths the windows' loss into ``fraction``.
+	Reordered packets count as received; duplicates are not told apart.
+	"""
+
+	def __init__(self) -> None:
+		self.highest: Optional[int] = None
+		self.expected = 0
+		self.received = 0
+		self.fraction = 0.0
+
+	def packet(self, seq: int) -> None:
+		if self.highest is None:
+			self.highest = seq
+			self.expected = 1
+		else:
+			delta = (seq - self.highest) & 0xFFFF
+			if 0 < delta < 0x8000:
+				self.expected += delta if delta <= LOSS_MAX_GAP else 1
+				self.highest = seq
+		self.received += 1
+		if self.expected >= LOSS_WINDOW:
+			lost = max(0, self.expected - self.received)
+			self.fraction += (lost / self.expected - self.fraction) * LOSS_SMOOTHING
+			self.expected = self.received = 0
+
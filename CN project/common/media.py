@@ -0,0 +1,562 @@
+import random
+import struct
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from common.fec import xor_parity, xor_parity_interleaved, xor_recover
+
+# Video datagrams: [name_len u8][name][version u8][layer u8][frame_id u32][frag_idx u16][frag_count u16]
+# [seq u16][timestamp u32][payload]. seq counts datagrams per sender and layer; timestamp is the
+# capture time in milliseconds (mod 2**32), shared by every fragment of a frame.
+# A legacy datagram carries a whole JPEG right after the name, so its next byte is 0xFF.
+VIDEO_PACKET_VERSION = 3
+VIDEO_FRAGMENT_HEADER = struct.Struct("!BBIHHHI")
+# A fragment index at or past frag_count marks FEC parity (see frame_parity); its payload is
+# [parity count u16][common/fec.py xor_parity]. Receivers without FEC ignore such indices.
+VIDEO_PARITY_HEADER = struct.Struct("!H")
+# Datagram size kept under a 1500-byte Ethernet MTU after IP and UDP headers, so the IP layer never fragments.
+VIDEO_MTU = 1200
+# Incomplete frames are dropped once they are this old; a newer frame makes them moot anyway.
+REASSEMBLY_TIMEOUT = 0.5
+# Cap on frames being reassembled at once, across all senders.
+REASSEMBLY_MAX_FRAMES = 64
+# A frame id more than this many frames behind the last one handed out for its sender, or one
+# arriving after the sender has completed nothing for this many seconds, means the sender started
+# over: its earlier frames are forgotten instead of its new ones being dropped as stale.
+REASSEMBLY_RESTART_FRAMES = 256
+REASSEMBLY_RESTART_SILENCE = 2.0
+
+# Seconds between receiver reports; a report covers the datagrams received since the previous one.
+VIDEO_REPORT_INTERVAL = 1.0
+# Streams silent for this many report intervals are forgotten.
+REPORT_STALE_INTERVALS = 5
+
+# Rate control: a report window with more loss or jitter than the HIGH marks steps the stream down,
+# one with less than the LOW marks steps it back up; in between it holds.
+LOSS_HIGH = 0.10
+LOSS_LOW = 0.02
+JITTER_HIGH_MS = 40.0
+JITTER_LOW_MS = 20.0
+QUALITY_STEP_DOWN = 10
+QUALITY_STEP_UP = 5
+FPS_DECREASE = 0.7
+FPS_STEP_UP = 2.0
+SCALE_DECREASE = 0.75
+SCALE_STEP_UP = 0.125
+
+# Audio datagrams: [magic u8][version u8][format u8][seq u16][timestamp u32, in 48 kHz samples][payload].
+# format names the payload codec and rate (common/audio_codecs.py). Version 1 had no format
+# byte and always carried 48 kHz PCM; anything else not starting with the magic is bare PCM.
+AUDIO_MAGIC = 0xAD
+AUDIO_PACKET_VERSION = 2
+AUDIO_HEADER = struct.Struct("!BBBHI")
+_AUDIO_HEADER_V1 = struct.Struct("!BBHI")
+# A headered datagram whose payload is one byte is a silence descriptor (SID, as in RFC 3389):
+# the sender's background noise level in -dBov. A silent sender (DTX) sends one when it goes
+# quiet and then every AUDIO_SID_INTERVAL_CHUNKS chunks, instead of PCM; kept well under the
+# mixer's AUDIO_SOURCE_TIMEOUT so a quiet source is not forgotten.
+AUDIO_SID_INTERVAL_CHUNKS = 25
+AUDIO_SID_MAX_DBOV = 127
+# A headered datagram of this format is FEC parity over whole datagrams: its seq is the first one
+# it covers, its payload [count u8][common/fec.py xor_parity of the count datagrams from seq]. No
+# codec has this id, so receivers without FEC drop it; it does not use up a seq of its own.
+AUDIO_FEC_FORMAT = 0x7F
+# Datagrams an AudioFecDecoder remembers for rebuilding a lost one.
+AUDIO_FEC_HISTORY = 32
+
+# Sender name of the server's composited stream (see server/mcu.py); not a valid username.
+MOSAIC_STREAM_NAME = "[mosaic]"
+
+# Simulcast layers, lowest first; see VIDEO_LAYERS in common.constants. Legacy senders count as layer 0.
+LAYER_COUNT = 3
+
+
+def _choose_layer(mask: int, want: int) -> int:
+	"""Highest layer in mask not above want, else the lowest one above it; -1 if mask is empty."""
+	below = [layer for layer in range(LAYER_COUNT) if mask >> layer & 1 and layer <= want]
+	if below:
+		return below[-1]
+	above = [layer for layer in range(LAYER_COUNT) if mask >> layer & 1]
+	return above[0] if above else -1
+
+
+# LAYER_CHOICE[available layer mask][wanted layer] -> layer to forward
+LAYER_CHOICE = [[_choose_layer(mask, want) for want in range(LAYER_COUNT)] for mask in range(1 << LAYER_COUNT)]
+
+
+def sender_prefix(username: str) -> bytes:
+	name = username.encode("utf-8")[:255]
+	return bytes([len(name)]) + name
+
+
+def packet_layer(packet: bytes) -> int:
+	"""Simulcast layer of a video datagram (0 for legacy and malformed ones)."""
+	pos = 1 + packet[0] if packet else 0
+	if len(packet) > pos + 1 and packet[pos] == VIDEO_PACKET_VERSION:
+		return min(packet[pos + 1], LAYER_COUNT - 1)
+	return 0
+
+
+def media_timestamp(t: float) -> int:
+	"""Datagram timestamp (u32 milliseconds) for a time.monotonic() value."""
+	return int(t * 1000) & 0xFFFFFFFF
+
+
+def initial_frame_id() -> int:
+	"""Random first frame id for a new stream, so a restarted sender does not reuse recent ids."""
+	return random.getrandbits(32)
+
+
+def fragment_frame(
+	prefix: bytes,
+	frame_id: int,
+	data: bytes,
+	mtu: int = VIDEO_MTU,
+	layer: int = LAYER_COUNT - 1,
+	seq: int = 0,
+	timestamp: int = 0,
+) -> List[bytes]:
+	"""Split one encoded frame into datagrams of at most mtu bytes, numbered from seq."""
+	chunk = mtu - len(prefix) - VIDEO_FRAGMENT_HEADER.size
+	count = max(1, -(-len(data) // chunk))
+	if count > 0xFFFF:
+		raise ValueError(f"frame of {len(data)} bytes needs more than 65535 fragments")
+	frame_id &= 0xFFFFFFFF
+	timestamp &= 0xFFFFFFFF
+	view = memoryview(data)
+	return [
+		prefix
+		+ VIDEO_FRAGMENT_HEADER.pack(VIDEO_PACKET_VERSION, layer, frame_id, i, count, (seq + i) & 0xFFFF, timestamp)
+		+ view[i * chunk : (i + 1) * chunk]
+		for i in range(count)
+	]
+
+
+def frame_parity(
+	prefix: bytes,
+	frame_id: int,
+	data: bytes,
+	group: int,
+	mtu: int = VIDEO_MTU,
+	layer: int = LAYER_COUNT - 1,
+	seq: int = 0,
+	timestamp: int = 0,
+) -> List[bytes]:
+	"""FEC parity datagrams for fragment_frame's fragments of data, one per group fragments.
+
+	With n parity datagrams, parity i (fragment index count + i) covers fragments i, i + n,
+	i + 2n, ..., so a burst of up to n consecutive losses is still recoverable. Parity carries
+	seq, the frame's first datagram's, and does not use up datagram seqs. A parity datagram is
+	four bytes longer than a full fragment, still well inside the MTU VIDEO_MTU leaves room for.
+	"""
+	chunk = mtu - len(prefix) - VIDEO_FRAGMENT_HEADER.size
+	count = max(1, -(-len(data) // chunk))
+	groups = -(-count // max(1, group))
+	if count + groups > 0xFFFF:
+		raise ValueError(f"frame of {len(data)} bytes needs more than 65535 datagrams with parity")
+	return [
+		prefix
+		+ VIDEO_FRAGMENT_HEADER.pack(VIDEO_PACKET_VERSION, layer, frame_id & 0xFFFFFFFF, count + g, count, seq & 0xFFFF, timestamp & 0xFFFFFFFF)
+		+ VIDEO_PARITY_HEADER.pack(groups)
+		+ body
+		for g, body in enumerate(xor_parity_interleaved(data, chunk, groups))
+	]
+
+
+def pack_audio(seq: int, timestamp: int, payload: bytes, fmt: int = 0) -> bytes:
+	return AUDIO_HEADER.pack(AUDIO_MAGIC, AUDIO_PACKET_VERSION, fmt, seq & 0xFFFF, timestamp & 0xFFFFFFFF) + payload
+
+
+def parse_audio(packet: bytes) -> Tuple[Optional[int], Optional[int], int, bytes]:
+	"""(seq, timestamp, format, payload) of an audio datagram; seq and timestamp are None for legacy bare PCM."""
+	if len(packet) >= AUDIO_HEADER.size and packet[0] == AUDIO_MAGIC and packet[1] == AUDIO_PACKET_VERSION:
+		_, _, fmt, seq, timestamp = AUDIO_HEADER.unpack_from(packet)
+		return seq, timestamp, fmt, packet[AUDIO_HEADER.size :]
+	if len(packet) >= _AUDIO_HEADER_V1.size and packet[0] == AUDIO_MAGIC and packet[1] == 1:
+		_, _, seq, timestamp = _AUDIO_HEADER_V1.unpack_from(packet)
+		return seq, timestamp, 0, packet[_AUDIO_HEADER_V1.size :]
+	return None, None, 0, packet
+
+
+def pack_sid(seq: int, timestamp: int, noise_dbov: float) -> bytes:
+	return pack_audio(seq, timestamp, bytes([max(0, min(AUDIO_SID_MAX_DBOV, round(noise_dbov)))]))
+
+
+def sid_level(payload: bytes) -> Optional[int]:
+	"""Noise level (-dBov) of a silence descriptor payload, or None for PCM."""
+	return payload[0] if len(payload) == 1 else None
+
+
+def seq_before(a: int, b: int) -> bool:
+	"""a comes before b in u16 sequence order, allowing for wraparound."""
+	return 0 < (b - a) & 0xFFFF < 0x8000
+
+
+class AudioFecEncoder:
+	"""Follows every group audio datagrams with an AUDIO_FEC_FORMAT parity datagram (group 0: off).
+
+	Datagrams are added in seq order. flush ends a group early; senders flush on a SID
+	so a group never waits across a silence for datagrams that are not coming.
+	"""
+
+	def __init__(self, group: int = 0) -> None:
+		self.group = group
+		self.pending: List[bytes] = []
+		self.base_seq = 0
+
+	def add(self, seq: int, packet: bytes, flush: bool = False) -> Optional[bytes]:
+		"""Note a datagram as sent; returns the parity datagram to send after it, if one is due."""
+		if self.group <= 0:
+			self.pending = []
+			return None
+		if not self.pending:
+			self.base_seq = seq
+		self.pending.append(packet)
+		if len(self.pending) < self.group and not flush:
+			return None
+		parity = pack_audio(self.base_seq, 0, bytes([len(self.pending)]) + xor_parity(self.pending), AUDIO_FEC_FORMAT)
+		self.pending = []
+		return parity
+
+
+class AudioFecDecoder:
+	"""Rebuilds an audio datagram lost from a parity group once the rest of the group is in.
+
+	Keeps the last AUDIO_FEC_HISTORY datagrams by seq and the parity still waiting
+	on more than one missing member. Both add calls return a rebuilt datagram, to be
+	handled as if it had just arrived, or None.
+	"""
+
+	def __init__(self) -> None:
+		self.packets: "OrderedDict[int, bytes]" = OrderedDict()
+		# first seq covered -> (datagrams covered, xor_parity)
+		self.parity: "OrderedDict[int, Tuple[int, bytes]]" = OrderedDict()
+		self.recovered = 0
+
+	def add(self, seq: int, packet: bytes) -> Optional[bytes]:
+		self._remember(seq, packet)
+		for base in list(self.parity):
+			if (seq - base) & 0xFFFF < self.parity[base][0]:
+				return self._recover(base)
+		return None
+
+	def add_parity(self, base_seq: int, payload: bytes) -> Optional[bytes]:
+		if len(payload) < 2 or not payload[0]:
+			return None
+		self.parity[base_seq] = (payload[0], payload[1:])
+		while len(self.parity) > AUDIO_FEC_HISTORY // 2:
+			self.parity.popitem(last=False)
+		return self._recover(base_seq)
+
+	def _remember(self, seq: int, packet: bytes) -> None:
+		self.packets[seq] = packet
+		while len(self.packets) > AUDIO_FEC_HISTORY:
+			self.packets.popitem(last=False)
+
+	def _recover(self, base: int) -> Optional[bytes]:
+		count, parity = self.parity[base]
+		members = [(base + i) & 0xFFFF for i in range(count)]
+		missing = [seq for seq in members if seq not in self.packets]
+		if len(missing) > 1:
+			return None
+		del self.parity[base]
+		if not missing:
+			return None
+		packet = xor_recover(parity, [self.packets[seq] for seq in members if seq != missing[0]])
+		if packet is None:
+			return None
+		self._remember(missing[0], packet)
+		self.recovered += 1
+		return packet
+
+
+def _newer(a: int, b: int) -> bool:
+	"""a is after b in u32 frame-id order, allowing for wraparound."""
+	return 0 < (a - b) & 0xFFFFFFFF < 0x80000000
+
+
+class _StreamStats:
+	"""RTCP-style reception counters for one (sender, layer) stream (RFC 3550 A.1, A.3, A.8)."""
+
+	__slots__ = ("base_seq", "max_seq", "cycles", "received", "expected_prior", "received_prior", "transit", "jitter", "bytes", "last_packet")
+
+	def __init__(self, seq: int, now: float) -> None:
+		self.base_seq = seq
+		self.max_seq = seq
+		self.cycles = 0
+		self.received = 0
+		self.expected_prior = 0
+		self.received_prior = 0
+		self.transit: Optional[int] = None
+		self.jitter = 0.0
+		self.bytes = 0
+		self.last_packet = now
+
+	def packet(self, seq: int, timestamp: int, size: int, now: float) -> None:
+		delta = (seq - self.max_seq) & 0xFFFF
+		if 0 < delta < 0x8000:
+			if seq < self.max_seq:
+				self.cycles += 0x10000
+			self.max_seq = seq
+		self.received += 1
+		self.bytes += size
+		self.last_packet = now
+		transit = media_timestamp(now) - timestamp
+		if self.transit is not None:
+			# transit times wrap with the u32 clocks; take the short way round
+			d = ((transit - self.transit + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+			self.jitter += (abs(d) - self.jitter) / 16
+		self.transit = transit
+
+	def report(self, interval: float) -> Tuple[float, float, float]:
+		"""(fraction lost, jitter ms, received kbit/s) since the previous report."""
+		expected = self.cycles + self.max_seq - self.base_seq + 1
+		expected_interval = expected - self.expected_prior
+		received_interval = self.received - self.received_prior
+		self.expected_prior = expected
+		self.received_prior = self.received
+		lost = expected_interval - received_interval
+		fraction = lost / expected_interval if expected_interval > 0 and lost > 0 else 0.0
+		kbps = self.bytes * 8 / interval / 1000 if interval > 0 else 0.0
+		self.bytes = 0
+		return fraction, self.jitter, kbps
+
+
+class ReceptionStats:
+	"""Loss, jitter and bitrate per received video stream, drained into receiver reports."""
+
+	def __init__(self, interval: float = VIDEO_REPORT_INTERVAL) -> None:
+		self.interval = interval
+		self.streams: Dict[Tuple[str, int], _StreamStats] = {}
+		self.last_report = time.monotonic()
+
+	def packet(self, name: str, layer: int, seq: int, timestamp: int, size: int, now: float) -> None:
+		stats = self.streams.get((name, layer))
+		if stats is None:
+			stats = self.streams[(name, layer)] = _StreamStats(seq, now)
+		stats.packet(seq, timestamp, size, now)
+
+	def due(self, now: float) -> bool:
+		return now - self.last_report >= self.interval
+
+	def reports(self, now: float) -> List[Dict[str, Any]]:
+		"""One report per stream heard from since the last call."""
+		elapsed = now - self.last_report
+		self.last_report = now
+		out = []
+		for (name, layer), stats in list(self.streams.items()):
+			if now - stats.last_packet > self.interval * REPORT_STALE_INTERVALS:
+				del self.streams[(name, layer)]
+				continue
+			if stats.received == stats.received_prior:
+				continue
+			fraction, jitter, kbps = stats.report(elapsed)
+			out.append({
+				"sender": name,
+				"layer": layer,
+				"fraction_lost": round(fraction, 4),
+				"jitter_ms": round(jitter, 1),
+				"bitrate_kbps": round(kbps, 1),
+			})
+		return out
+
+
+class RateController:
+	"""Loss- and jitter-driven JPEG quality, frame rate and resolution for one encoded stream.
+
+	Receivers' reports are collected per receiver; once per report interval the
+	worst recent one decides. Congestion steps down quality first, then frame
+	rate, then resolution, each multiplicatively or in large steps; clean windows
+	step back up additively in the reverse order, so recovery is gentler than
+	backoff. Without reports the stream holds where it is.
+	"""
+
+	def __init__(
+		self,
+		quality: int,
+		quality_min: int,
+		fps_max: float,
+		fps_min: float,
+		scale_min: float,
+		interval: float = VIDEO_REPORT_INTERVAL,
+	) -> None:
+		self.quality_max = self.quality = quality
+		self.quality_min = min(quality_min, quality)
+		self.fps_max = self.fps = fps_max
+		self.fps_min = min(fps_min, fps_max)
+		self.scale_min = scale_min
+		self.scale = 1.0
+		self.interval = interval
+		# receiver id -> (fraction lost, jitter ms, received kbit/s, arrival time)
+		self.reports: Dict[str, Tuple[float, float, float, float]] = {}
+		self.last_update = time.monotonic()
+		# worst loss among the last update's fresh reports, before any FEC recovery
+		self.loss = 0.0
+
+	def on_report(self, receiver: str, fraction_lost: float, jitter_ms: float, bitrate_kbps: float, now: float) -> None:
+		self.reports[receiver] = (fraction_lost, jitter_ms, bitrate_kbps, now)
+
+	def update(self, now: float) -> None:
+		if now - self.last_update < self.interval:
+			return
+		self.last_update = now
+		fresh = [r for r in self.reports.values() if now - r[3] <= 2 * self.interval]
+		self.reports = {k: r for k, r in self.reports.items() if now - r[3] <= 2 * self.interval}
+		if not fresh:
+			return
+		loss = self.loss = max(r[0] for r in fresh)
+		jitter = max(r[1] for r in fresh)
+		if loss > LOSS_HIGH or jitter > JITTER_HIGH_MS:
+			self._decrease()
+		elif loss < LOSS_LOW and jitter < JITTER_LOW_MS:
+			self._increase()
+
+	def _decrease(self) -> None:
+		if self.quality > self.quality_min:
+			self.quality = max(self.quality_min, self.quality - QUALITY_STEP_DOWN)
+		elif self.fps > self.fps_min:
+			self.fps = max(self.fps_min, self.fps * FPS_DECREASE)
+		else:
+			self.scale = max(self.scale_min, self.scale * SCALE_DECREASE)
+
+	def _increase(self) -> None:
+		if self.scale < 1.0:
+			self.scale = min(1.0, self.scale + SCALE_STEP_UP)
+		elif self.fps < self.fps_max:
+			self.fps = min(self.fps_max, self.fps + FPS_STEP_UP)
+		else:
+			self.quality = min(self.quality_max, self.quality + QUALITY_STEP_UP)
+
+
+class _PartialFrame:
+	__slots__ = ("parts", "missing", "started", "groups", "parity")
+
+	def __init__(self, count: int, now: float) -> None:
+		self.parts: List[Optional[bytes]] = [None] * count
+		self.missing = count
+		self.started = now
+		# FEC: parity datagrams the sender made for this frame (0: none seen yet), and those received
+		self.groups = 0
+		self.parity: Dict[int, bytes] = {}
+
+
+class FrameReassembler:
+	"""Rebuilds frames from video datagrams, per sender.
+
+	Fragments may arrive in any order; duplicates are ignored. A frame is handed
+	out once all of its fragments are in, and anything older than the last frame
+	handed out for that sender is dropped, as are frames still incomplete after
+	timeout seconds. Simulcast layers of one capture share a frame id, so while
+	the relay switches a receiver between layers only the first copy is shown.
+	A frame id far behind the last one, or one after a silence, restarts the
+	sender (see REASSEMBLY_RESTART_FRAMES). Legacy single-datagram frames pass straight through. Every fragment also
+	feeds ``stats``, the source of this receiver's reports.
+
+	FEC parity datagrams (see frame_parity) rebuild a fragment once all the others
+	of its parity group are in; ``recovered`` counts the fragments rebuilt. Parity
+	is left out of ``stats``, so reports give the loss before recovery.
+	"""
+
+	def __init__(self, timeout: float = REASSEMBLY_TIMEOUT, max_frames: int = REASSEMBLY_MAX_FRAMES) -> None:
+		self.timeout = timeout
+		self.max_frames = max_frames
+		self.partial: "OrderedDict[Tuple[str, int, int], _PartialFrame]" = OrderedDict()
+		# sender name -> (last frame id handed out, when)
+		self.last_frame: Dict[str, Tuple[int, float]] = {}
+		self.restarts = 0
+		self.dropped = 0
+		self.recovered = 0
+		self.stats = ReceptionStats()
+
+	def add(self, packet: bytes) -> Optional[Tuple[str, bytes]]:
+		"""Feed one datagram; returns (sender name, frame bytes) when it completes a frame."""
+		if not packet or packet[0] + 1 > len(packet):
+			return None
+		name_end = 1 + packet[0]
+		name = packet[1:name_end].decode("utf-8", errors="ignore")
+		if len(packet) == name_end or packet[name_end] != VIDEO_PACKET_VERSION:
+			return name, packet[name_end:]
+		if len(packet) < name_end + VIDEO_FRAGMENT_HEADER.size:
+			return None
+		_, layer, frame_id, index, count, seq, timestamp = VIDEO_FRAGMENT_HEADER.unpack_from(packet, name_end)
+		parity = index >= count
+		now = time.monotonic()
+		if not parity:
+			self.stats.packet(name, layer, seq, timestamp, len(packet), now)
+		last = self.last_frame.get(name)
+		if last is not None and not _newer(frame_id, last[0]):
+			if (last[0] - frame_id) & 0xFFFFFFFF <= REASSEMBLY_RESTART_FRAMES and now - last[1] < REASSEMBLY_RESTART_SILENCE:
+				return None
+			self._restart(name)
+		self._expire(now)
+		key = (name, layer, frame_id)
+		frame = self.partial.get(key)
+		if frame is None:
+			if count == 1 and not parity:
+				self._complete(name, frame_id, now)
+				return name, packet[name_end + VIDEO_FRAGMENT_HEADER.size :]
+			frame = self.partial[key] = _PartialFrame(count, now)
+			while len(self.partial) > self.max_frames:
+				self.partial.popitem(last=False)
+				self.dropped += 1
+		if len(frame.parts) != count:
+			return None
+		body = packet[name_end + VIDEO_FRAGMENT_HEADER.size :]
+		if parity:
+			group = index - count
+			if len(body) < VIDEO_PARITY_HEADER.size:
+				return None
+			(groups,) = VIDEO_PARITY_HEADER.unpack_from(body)
+			if group >= groups or (frame.groups and groups != frame.groups) or group in frame.parity:
+				return None
+			frame.groups = groups
+			frame.parity[group] = body[VIDEO_PARITY_HEADER.size :]
+		else:
+			if frame.parts[index] is not None:
+				return None
+			frame.parts[index] = body
+			frame.missing -= 1
+			group = index % frame.groups if frame.groups else -1
+		if frame.missing and group in frame.parity:
+			self._recover(frame, group)
+		if frame.missing:
+			return None
+		del self.partial[key]
+		self._complete(name, frame_id, now)
+		return name, b"".join(frame.parts)  # type: ignore[arg-type]
+
+	def _recover(self, frame: _PartialFrame, group: int) -> None:
+		"""Rebuild the fragment missing from group, if it is the only one."""
+		members = range(group, len(frame.parts), frame.groups)
+		missing = [i for i in members if frame.parts[i] is None]
+		if len(missing) != 1:
+			return
+		part = xor_recover(frame.parity[group], [frame.parts[i] for i in members if i != missing[0]])  # type: ignore[misc]
+		if part is None:
+			return
+		frame.parts[missing[0]] = part
+		frame.missing -= 1
+		self.recovered += 1
+
+	def _complete(self, name: str, frame_id: int, now: float) -> None:
+		self.last_frame[name] = (frame_id, now)
+		# older frames from this sender can no longer be shown
+		for key in [k for k in self.partial if k[0] == name and not _newer(k[2], frame_id)]:
+			del self.partial[key]
+			self.dropped += 1
+
+	def _restart(self, name: str) -> None:
+		del self.last_frame[name]
+		for key in [k for k in self.partial if k[0] == name]:
+			del self.partial[key]
+			self.dropped += 1
+		self.restarts += 1
+
+	def _expire(self, now: float) -> None:
+		while self.partial:
+			key, frame = next(iter(self.partial.items()))
+			if now - frame.started < self.timeout:
+				break
+			del self.partial[key]
+			self.dropped += 1
@@ -1,35 +1,278 @@
 import json
 import socket
-from typing import Any, Dict, Optional, Tuple
+import struct
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 ENCODING = "utf-8"
 BUFFER_SIZE = 65536
 
 # Control message types (JSON line delimited over TCP)
-HELLO = "HELLO"  # payload: {"username": str}
-WELCOME = "WELCOME"  # payload: {"message": str}
+# payload: {"username": str, "room": str, "codecs": [str], "features": [str]} (all but username optional)
+HELLO = "HELLO"
+WELCOME = "WELCOME"  # payload: {"message": str, "codec": str, "room": str, "history_seq": int}
 CHAT = "CHAT"  # payload: {"text": str}
-CHAT_BROADCAST = "CHAT_BROADCAST"  # payload: {"username": str, "text": str}
-USER_JOINED = "USER_JOINED"  # payload: {"username": str}
-USER_LEFT = "USER_LEFT"  # payload: {"username": str}
+CHAT_BROADCAST = "CHAT_BROADCAST"  # payload: {"seq": int, "username": str, "text": str}
+USER_JOINED = "USER_JOINED"  # payload: {"username": str} (clients without the roster feature)
+USER_LEFT = "USER_LEFT"  # payload: {"username": str} (clients without the roster feature)
 ERROR = "ERROR"  # payload: {"message": str}
 PING = "PING"
 PONG = "PONG"
-REGISTER_AV = "REGISTER_AV"  # payload: {"video_port": int, "audio_port": int}
+# payload: {"video_port": int, "audio_port": int, "audio_header": int, "audio_codecs": [str], "audio_rates": [int],
+# "audio_fec": bool}; audio_header (optional) is the AUDIO_PACKET_VERSION the client understands, so its mix
+# arrives sequenced and timestamped; audio_codecs and audio_rates (optional) offer payload formats, preferred
+# first; audio_fec (optional) asks for FEC parity datagrams with the mix
+REGISTER_AV = "REGISTER_AV"
 FILE_AVAILABLE = "FILE_AVAILABLE"  # payload: {"filename": str, "size": int}
 PRESENTER_STATUS = "PRESENTER_STATUS"  # payload: {"active": bool}
+# payload: {"since": int} or {"before": int} (neither: latest page), plus optional "limit": int
+HISTORY_REQUEST = "HISTORY_REQUEST"
+# payload: {"messages": [{"seq": int, "ts": float, "username": str, "text": str}], "last_seq": int, "has_more": bool}
+HISTORY = "HISTORY"
+# payload: {"version": int, "members": [{"id": str, "username": str}]}
+ROSTER_SNAPSHOT = "ROSTER_SNAPSHOT"
+# payload: {"version": int, "joined": [{"id": str, "username": str}], "left": [str]}
+ROSTER_DELTA = "ROSTER_DELTA"
+# payload: {"layer": int}; the simulcast layer this client wants relayed to its video port
+VIDEO_LAYER = "VIDEO_LAYER"
+# payload: {"streams": [{"id": str, "priority": int}]} (roster ids, higher priority first) or {"all": true};
+# either may add "mosaic": true to get the room as one server-composited stream instead (if the server has it)
+VIDEO_SUBSCRIBE = "VIDEO_SUBSCRIBE"
+# payload: {"reports": [{"sender": str, "layer": int, "fraction_lost": float, "jitter_ms": float, "bitrate_kbps": float}]}
+# receiver -> server, one entry per video stream received in the last report interval
+VIDEO_REPORT = "VIDEO_REPORT"
+# payload: {"from": str, "layer": int, "fraction_lost": float, "jitter_ms": float, "bitrate_kbps": float}
+# server -> sender, one receiver's report on one of its layers ("from" is the receiver's roster id)
+VIDEO_FEEDBACK = "VIDEO_FEEDBACK"
+# payload: {"codec": str, "rate": int}; server -> client after a headered audio REGISTER_AV: the format
+# picked from its offer, which its mix arrives in and its microphone should be sent in
+AUDIO_FORMAT = "AUDIO_FORMAT"
+# payload: {"id": str, "username": str, "recent": [str]}; server -> room when its dominant speaker changes,
+# with the roster ids of the room's speakers so far, most recent first
+ACTIVE_SPEAKER = "ACTIVE_SPEAKER"
+
+DEFAULT_ROOM = "main"
+MAX_ROOM_NAME = 64
+
+# Screen-share role headers (TCP, SCREEN_TCP_PORT). The *_ROOM variants are followed by
+# [name_len u8][room name]; the plain ones mean DEFAULT_ROOM.
+SCREEN_PRESENT = b"PRESENT"
+SCREEN_VIEWER = b"VIEWER\n"
+SCREEN_PRESENT_ROOM = b"PRESRM\n"
+SCREEN_VIEWER_ROOM = b"VIEWRM\n"
+
+# Optional behaviours a client opts into via HELLO "features".
+FEATURE_ROSTER = "roster"  # ROSTER_SNAPSHOT + batched ROSTER_DELTA instead of USER_JOINED/USER_LEFT
+FEATURE_HEARTBEAT = "heartbeat"  # answers server PING with PONG; silent sessions are dropped
 
 LINE_SEP = "\n"
+# LineFramer compacts its buffer once less than this much room is left at the tail ...
+FRAMER_MIN_READ = 4096
+# ... and starts at this size, growing only while a longer line or frame is pending, so idle
+# sessions hold a few KB each rather than room for the longest message.
+FRAMER_INITIAL_BUFFER = 4 * FRAMER_MIN_READ
+
+# Control codecs. A client lists the codecs it speaks in HELLO; the server picks one
+# and announces it in WELCOME (always sent as JSON). From then on the server writes
+# that codec to the session, and the client may send it too. Binary frames start with
+# a NUL byte, which never begins a JSON line, so both directions may mix the two.
+CODEC_JSON = "json"
+CODEC_BINARY = "bin1"
+SUPPORTED_CODECS = (CODEC_BINARY, CODEC_JSON)
+
+# Binary frame: [0x00][type id u8][payload length u16][payload]
+FRAME_MARKER = 0
+FRAME_HEADER = struct.Struct("!BBH")
+MAX_FRAME_PAYLOAD = 0xFFFF
+# LineFramer drops a peer whose pending JSON line outgrows the largest binary frame.
+MAX_LINE_LENGTH = FRAME_HEADER.size + MAX_FRAME_PAYLOAD
+# Frame type 0 carries a whole JSON message, for types without a numeric ID.
+FRAME_TYPE_JSON = 0
+
+
+def encode_json_line(message: Dict[str, Any]) -> bytes:
+	return (json.dumps(message) + LINE_SEP).encode(ENCODING)
 
 
 def send_json_line(sock: socket.socket, message: Dict[str, Any]) -> None:
-	data = (json.dumps(message) + LINE_SEP).encode(ENCODING)
+	data = encode_json_line(message)
 	view = memoryview(data)
 	while view:
 		sent = sock.send(view)
 		view = view[sent:]
 
 
+_U16 = struct.Struct("!H")
+
+
+class PayloadLayout:
+	"""Fixed-shape payload: struct-packed scalars, then u16-length-prefixed strings (the last one unprefixed)."""
+
+	def __init__(self, scalars: Sequence[Tuple[str, str]] = (), strings: Sequence[str] = ()) -> None:
+		self.scalar_names = [name for name, _ in scalars]
+		self.scalar_kinds = [kind for _, kind in scalars]
+		self.scalars = struct.Struct("!" + "".join(self.scalar_kinds))
+		self.strings = list(strings)
+		self.keys = set(self.scalar_names) | set(self.strings)
+		self._prefixed = self.strings[:-1]
+		self._last = self.strings[-1] if self.strings else None
+		# the scalars and the first string's length, unpacked in one call
+		self._head = struct.Struct(self.scalars.format + ("H" if self._prefixed else ""))
+		self._first = self._prefixed[0] if self._prefixed else None
+
+	def encode(self, payload: Dict[str, Any]) -> Optional[bytes]:
+		"""Pack payload, or return None when it does not have exactly this shape."""
+		if payload.keys() != self.keys:
+			return None
+		values = []
+		for name, kind in zip(self.scalar_names, self.scalar_kinds):
+			value = payload[name]
+			if (kind == "?") != isinstance(value, bool) or not isinstance(value, int):
+				return None
+			values.append(value)
+		try:
+			parts = [self.scalars.pack(*values)]
+		except struct.error:
+			return None
+		for i, name in enumerate(self.strings):
+			value = payload[name]
+			if not isinstance(value, str):
+				return None
+			raw = value.encode(ENCODING)
+			if i < len(self.strings) - 1:
+				if len(raw) > 0xFFFF:
+					return None
+				parts.append(_U16.pack(len(raw)))
+			parts.append(raw)
+		return b"".join(parts)
+
+	def decode(self, data: bytes) -> Dict[str, Any]:
+		return self.decode_from(data, 0, len(data))
+
+	def decode_from(self, buf: Union[bytes, bytearray], pos: int, end: int) -> Dict[str, Any]:
+		"""Decode the payload in buf[pos:end] without copying it out first."""
+		head = self._head
+		if end - pos < head.size:
+			raise struct.error("payload too short")
+		values = head.unpack_from(buf, pos)
+		pos += head.size
+		# zip stops at the scalars, leaving out the string length
+		payload = dict(zip(self.scalar_names, values))
+		if self._first is not None:
+			n = values[-1]
+			payload[self._first] = buf[pos : min(pos + n, end)].decode(ENCODING)
+			pos += n
+			for name in self._prefixed[1:]:
+				if end - pos < 2:
+					raise struct.error("payload too short")
+				(n,) = _U16.unpack_from(buf, pos)
+				pos += 2
+				payload[name] = buf[pos : min(pos + n, end)].decode(ENCODING)
+				pos += n
+		if self._last is not None:
+			payload[self._last] = buf[pos:end].decode(ENCODING)
+		return payload
+
+
+# Numeric IDs and layouts for the binary codec. Types with an ID but no layout send
+# their payload as JSON inside the frame; payloads that do not match their layout
+# exactly fall back the same way.
+MESSAGE_TYPE_IDS: Dict[str, int] = {
+	HELLO: 1,
+	WELCOME: 2,
+	CHAT: 3,
+	CHAT_BROADCAST: 4,
+	USER_JOINED: 5,
+	USER_LEFT: 6,
+	ERROR: 7,
+	PING: 8,
+	PONG: 9,
+	REGISTER_AV: 10,
+	FILE_AVAILABLE: 11,
+	PRESENTER_STATUS: 12,
+	HISTORY_REQUEST: 13,
+	HISTORY: 14,
+	ROSTER_SNAPSHOT: 15,
+	ROSTER_DELTA: 16,
+	VIDEO_LAYER: 17,
+	VIDEO_SUBSCRIBE: 18,
+	VIDEO_REPORT: 19,
+	VIDEO_FEEDBACK: 20,
+	AUDIO_FORMAT: 21,
+	ACTIVE_SPEAKER: 22,
+}
+MESSAGE_TYPES_BY_ID: Dict[int, str] = {v: k for k, v in MESSAGE_TYPE_IDS.items()}
+PAYLOAD_LAYOUTS: Dict[str, PayloadLayout] = {
+	CHAT: PayloadLayout(strings=("text",)),
+	CHAT_BROADCAST: PayloadLayout(scalars=(("seq", "Q"),), strings=("username", "text")),
+	USER_JOINED: PayloadLayout(strings=("username",)),
+	USER_LEFT: PayloadLayout(strings=("username",)),
+	ERROR: PayloadLayout(strings=("message",)),
+	PING: PayloadLayout(),
+	PONG: PayloadLayout(),
+	REGISTER_AV: PayloadLayout(scalars=(("video_port", "H"), ("audio_port", "H"))),
+	FILE_AVAILABLE: PayloadLayout(scalars=(("size", "Q"),), strings=("filename",)),
+	PRESENTER_STATUS: PayloadLayout(scalars=(("active", "?"),)),
+	VIDEO_LAYER: PayloadLayout(scalars=(("layer", "B"),)),
+}
+# The high bit of a frame's type id marks a JSON payload.
+JSON_PAYLOAD_FLAG = 0x80
+# type id -> (type, its layout's decode_from)
+_FRAME_LAYOUTS: Dict[int, Tuple[str, Callable[[Union[bytes, bytearray], int, int], Dict[str, Any]]]] = {
+	MESSAGE_TYPE_IDS[t]: (t, layout.decode_from) for t, layout in PAYLOAD_LAYOUTS.items()
+}
+
+
+def encode_binary_frame(message: Dict[str, Any]) -> bytes:
+	"""Encode one message as a binary frame (falls back to a JSON line if it cannot be framed)."""
+	type_ = message.get("type")
+	payload = message.get("payload") or {}
+	type_id = MESSAGE_TYPE_IDS.get(type_) if isinstance(type_, str) else None
+	body: Optional[bytes] = None
+	if type_id is None:
+		type_id = FRAME_TYPE_JSON
+		body = json.dumps(message).encode(ENCODING)
+	else:
+		layout = PAYLOAD_LAYOUTS.get(type_)
+		if layout is not None and message.keys() <= {"type", "payload"}:
+			body = layout.encode(payload)
+		if body is None:
+			type_id |= JSON_PAYLOAD_FLAG
+			body = json.dumps(payload).encode(ENCODING)
+	if len(body) > MAX_FRAME_PAYLOAD:
+		return encode_json_line(message)
+	return FRAME_HEADER.pack(FRAME_MARKER, type_id, len(body)) + body
+
+
+def decode_binary_frame(type_id: int, body: bytes) -> Dict[str, Any]:
+	try:
+		entry = _FRAME_LAYOUTS.get(type_id)
+		if entry is not None:
+			return {"type": entry[0], "payload": entry[1](body, 0, len(body))}
+		if type_id == FRAME_TYPE_JSON:
+			return json.loads(body)
+		type_ = MESSAGE_TYPES_BY_ID.get(type_id & ~JSON_PAYLOAD_FLAG)
+		if type_ is not None and type_id & JSON_PAYLOAD_FLAG:
+			return {"type": type_, "payload": json.loads(body)}
+	except (ValueError, struct.error):
+		pass
+	return {"type": ERROR, "payload": {"message": "Malformed frame"}}
+
+
+def encode_message(message: Dict[str, Any], codec: str = CODEC_JSON) -> bytes:
+	if codec == CODEC_BINARY:
+		return encode_binary_frame(message)
+	return encode_json_line(message)
+
+
+def negotiate_codec(offered: Any) -> str:
+	"""Pick the first codec we support from a client's HELLO offer; JSON if none."""
+	if isinstance(offered, list):
+		for codec in offered:
+			if codec in SUPPORTED_CODECS:
+				return codec
+	return CODEC_JSON
+
+
 def recv_json_lines(buffer: bytearray) -> Tuple[Optional[Dict[str, Any]], bytearray]:
 	"""Extract one JSON object from buffer if a full line exists; return (obj, new_buffer)."""
 	idx = buffer.find(ord("\n"))
@@ -46,5 +289,141 @@ def recv_json_lines(buffer: bytearray) -> Tuple[Optional[Dict[str, Any]], bytear
 		return {"type": ERROR, "payload": {"message": "Malformed JSON"}}, rest
 
 
+_decode_json = json.JSONDecoder().decode
+
+
+class LineTooLongError(ValueError):
+	"""Raised by LineFramer; ``messages`` holds those decoded before the over-long line."""
+
+	def __init__(self, message: str, messages: Optional[List[Dict[str, Any]]] = None) -> None:
+		super().__init__(message)
+		self.messages: List[Dict[str, Any]] = messages or []
+
+
+class LineFramer:
+	"""Incremental control-stream decoder over one reusable receive buffer.
+
+	Bytes land in the buffer via recv_from() (recv_into, no intermediate copy) or
+	feed(); messages() then decodes every complete JSON line and binary frame in a
+	single pass by advancing a read offset. Unconsumed bytes are moved to the front
+	only when the tail runs out of room; the buffer grows only when they fill it,
+	and drops back to FRAMER_INITIAL_BUFFER once drained. A partial line longer
+	than max_line raises LineTooLongError, which carries the messages completed
+	before it.
+	"""
+
+	def __init__(self, max_line: int = MAX_LINE_LENGTH) -> None:
+		self.max_line = max_line
+		self.buf = bytearray(FRAMER_INITIAL_BUFFER)
+		self.start = 0
+		self.end = 0
+
+	def recv_from(self, sock: socket.socket) -> int:
+		"""recv_into the free tail of the buffer; returns the byte count (0 on EOF)."""
+		self._reserve()
+		n = sock.recv_into(memoryview(self.buf)[self.end :])
+		self.end += n
+		return n
+
+	def feed(self, data: bytes) -> List[Dict[str, Any]]:
+		"""Append already-received bytes and return every message they complete."""
+		out: List[Dict[str, Any]] = []
+		view = memoryview(data)
+		while view:
+			room = self._reserve()
+			n = min(room, len(view))
+			self.buf[self.end : self.end + n] = view[:n]
+			self.end += n
+			view = view[n:]
+			try:
+				out.extend(self.messages())
+			except LineTooLongError as exc:
+				exc.messages[:0] = out
+				raise
+		return out
+
+	def messages(self) -> List[Dict[str, Any]]:
+		out: List[Dict[str, Any]] = []
+		buf = self.buf
+		start = self.start
+		end = self.end
+		header_size = FRAME_HEADER.size
+		unpack_header = FRAME_HEADER.unpack_from
+		layouts = _FRAME_LAYOUTS
+		while start < end:
+			if buf[start] == FRAME_MARKER:
+				if end - start < header_size:
+					break
+				_, type_id, length = unpack_header(buf, start)
+				body_start = start + header_size
+				body_end = body_start + length
+				if body_end > end:
+					break
+				entry = layouts.get(type_id)
+				if entry is None:
+					out.append(decode_binary_frame(type_id, bytes(buf[body_start:body_end])))
+				else:
+					# fixed-shape payloads decode straight out of the buffer
+					try:
+						out.append({"type": entry[0], "payload": entry[1](buf, body_start, body_end)})
+					except (ValueError, struct.error):
+						out.append({"type": ERROR, "payload": {"message": "Malformed frame"}})
+				start = body_end
+				continue
+			# JSON never contains a raw NUL, so the next one starts a binary frame
+			limit = buf.find(b"\0", start, end)
+			if limit == -1:
+				limit = end
+			last = buf.rfind(b"\n", start, limit)
+			if last == -1:
+				if limit == end:
+					break
+				out.append({"type": ERROR, "payload": {"message": "Malformed JSON"}})
+				start = limit
+				continue
+			self._decode_lines(buf[start:last], out)
+			start = last + 1
+		if start == end:
+			start = end = 0
+			if len(buf) > FRAMER_INITIAL_BUFFER:
+				self.buf = bytearray(FRAMER_INITIAL_BUFFER)
+		self.start = start
+		self.end = end
+		if end - start > self.max_line:
+			raise LineTooLongError(f"line exceeds {self.max_line} bytes", out)
+		return out
+
+	@staticmethod
+	def _decode_lines(chunk: bytearray, out: List[Dict[str, Any]]) -> None:
+		# one decode for every complete line, then split in C
+		try:
+			lines = chunk.decode(ENCODING).split(LINE_SEP)
+		except UnicodeDecodeError:
+			lines = chunk.decode(ENCODING, errors="replace").split(LINE_SEP)
+		for line in lines:
+			if not line:
+				continue
+			try:
+				out.append(_decode_json(line))
+			except ValueError:
+				out.append({"type": ERROR, "payload": {"message": "Malformed JSON"}})
+
+	def _reserve(self) -> int:
+		room = len(self.buf) - self.end
+		if room >= FRAMER_MIN_READ:
+			return room
+		pending = self.end - self.start
+		if len(self.buf) - pending < FRAMER_MIN_READ:
+			# a long line or frame is still arriving; messages() bounds it by max_line
+			grown = bytearray(max(min(2 * len(self.buf), self.max_line + 2 * FRAMER_MIN_READ), pending + FRAMER_MIN_READ))
+			grown[:pending] = self.buf[self.start : self.end]
+			self.buf = grown
+		elif self.start:
+			self.buf[:pending] = self.buf[self.start : self.end]
+		self.start = 0
+		self.end = pending
+		return len(self.buf) - pending
+
+
 def make_message(msg_type: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
 	return {"type": msg_type, "payload": payload or {}}
@@ -1,75 +1,722 @@
 import socket
 import struct
 import threading
-from typing import Dict, Tuple, Optional
+import time
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
 
-from common.constants import VIDEO_UDP_PORT, AUDIO_UDP_PORT, AUDIO_SAMPLE_RATE, AUDIO_CHANNELS
+from common.constants import VIDEO_UDP_PORT, AUDIO_UDP_PORT, AUDIO_SAMPLE_RATE, AUDIO_CHANNELS, AUDIO_CHUNK_MS
+from common.fec import AUDIO_FEC_MAX_GROUP, LossMeter, fec_group_size
+from common.media import (
+	AUDIO_FEC_FORMAT,
+	AUDIO_SID_INTERVAL_CHUNKS,
+	AudioFecDecoder,
+	AudioFecEncoder,
+	LAYER_CHOICE,
+	LAYER_COUNT,
+	VIDEO_PACKET_VERSION,
+	pack_audio,
+	pack_sid,
+	parse_audio,
+	seq_before,
+	sid_level,
+)
+from common.audio_codecs import AudioDecoder, AudioEncoder, decoder_for
+from common.protocol import DEFAULT_ROOM
+from server.mcu import MOSAIC_LAYER, MosaicCompositor
+from server.speakers import ActiveSpeakerDetector
 import numpy as np
 
+Addr = Tuple[str, int]
+
+# Datagrams drained per wakeup of the video relay before fanning them out.
+RELAY_BATCH = 64
+RELAY_MAX_DATAGRAM = 65535
+# A sender's simulcast layer counts as available until it has been silent this long.
+LAYER_TIMEOUT = 1.0
+# With last-N on, senders outside a room's N most recent speakers get one frame of their
+# lowest layer per this many seconds.
+LAST_N_TRICKLE_INTERVAL = 1.0
+
+# Kernel socket buffers sized for bursts (a keyframe from every sender at once); the OS may clamp this.
+RELAY_SOCKET_BUFFER = 4 * 1024 * 1024
+
+# Audio is mixed in chunks of AUDIO_CHUNK_MS.
+AUDIO_CHUNK_SAMPLES = AUDIO_SAMPLE_RATE * AUDIO_CHUNK_MS // 1000
+# A source starts playing once this many chunks are buffered ...
+JITTER_TARGET_CHUNKS = 2
+# ... and its oldest chunks are dropped beyond this many.
+JITTER_MAX_CHUNKS = 6
+# Sources silent this long are forgotten.
+AUDIO_SOURCE_TIMEOUT = 1.0
+# A mixer clock this far behind restarts rather than catching up tick by tick.
+MIX_MAX_LAG = 0.2
+
+# The relay drains its socket with non-blocking recvfrom_into; where MSG_DONTWAIT is missing it takes one datagram per wakeup.
+_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+def _size_buffers(sock: socket.socket) -> None:
+	for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+		try:
+			sock.setsockopt(socket.SOL_SOCKET, opt, RELAY_SOCKET_BUFFER)
+		except OSError:
+			pass
+
+
+class RelayTargets:
+	"""Registered UDP receivers grouped by room.
+
+	Datagrams are attributed to the sender's room by source address; clients that
+	send from the socket they registered match exactly, others fall back to the
+	room their IP registered in. Per-room target lists are cached and rebuilt
+	only on (un)registration, so the hot path is two dict lookups.
+	"""
+
+	def __init__(self) -> None:
+		self.lock = threading.Lock()
+		self.clients: Dict[Addr, Tuple[Addr, str]] = {}
+		self.by_ip: Dict[str, str] = {}
+		self._room_targets: Dict[str, List[Addr]] = {}
+		self._room_members: Dict[str, List[Tuple[Addr, Addr]]] = {}
+
+	def register(self, key: Addr, target: Addr, room: str = DEFAULT_ROOM) -> None:
+		with self.lock:
+			self.clients[key] = (target, room)
+			self._rebuild()
+
+	def unregister(self, key: Addr) -> None:
+		with self.lock:
+			if self.clients.pop(key, None) is not None:
+				self._rebuild()
+
+	def room_of(self, addr: Addr) -> Optional[str]:
+		entry = self.clients.get(addr)
+		if entry is not None:
+			return entry[1]
+		return self.by_ip.get(addr[0])
+
+	def targets(self, room: str) -> List[Addr]:
+		return self._room_targets.get(room, [])
+
+	def members(self, room: str) -> List[Tuple[Addr, Addr]]:
+		"""(key, target) of every registration in room."""
+		return self._room_members.get(room, [])
+
+	def _rebuild(self) -> None:
+		rooms: Dict[str, List[Addr]] = {}
+		members: Dict[str, List[Tuple[Addr, Addr]]] = {}
+		by_ip: Dict[str, Optional[str]] = {}
+		for key, (target, room) in self.clients.items():
+			rooms.setdefault(room, []).append(target)
+			members.setdefault(room, []).append((key, target))
+			# an IP registered in several rooms is ambiguous and gets no fallback
+			by_ip[key[0]] = room if by_ip.get(key[0], room) == room else None
+		# swap whole objects so readers never see a half-built table
+		self._room_targets = rooms
+		self._room_members = members
+		self.by_ip = {ip: room for ip, room in by_ip.items() if room is not None}
+
 
 class VideoRelay:
-	def __init__(self, host: str) -> None:
+	def __init__(self, host: str, reuse_port: bool = False, port: int = VIDEO_UDP_PORT) -> None:
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-		self.sock.bind((host, VIDEO_UDP_PORT))
+		if reuse_port:
+			# several worker processes bind the same port; the kernel spreads senders across them
+			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+		_size_buffers(self.sock)
+		self.sock.bind((host, port))
 		self.running = False
-		self.clients_lock = threading.Lock()
-		self.clients: Dict[Tuple[str, int], Tuple[str, int]] = {}
+		self.clients = RelayTargets()
+		# one preallocated slot per datagram of a batch; received bytes are forwarded straight from here
+		self._pool = bytearray(RELAY_BATCH * RELAY_MAX_DATAGRAM)
+		self._slots = [memoryview(self._pool)[i * RELAY_MAX_DATAGRAM : (i + 1) * RELAY_MAX_DATAGRAM] for i in range(RELAY_BATCH)]
+		# receive address -> simulcast layer it asked for (top layer if it never asked)
+		self.wants: Dict[Addr, int] = {}
+		# sender address -> [last seen per layer..., available layer mask, when the mask was computed]
+		self._senders: Dict[Addr, List[float]] = {}
+		# receive address -> {sender key: priority}; receivers not listed get every sender in their room
+		self.subscriptions: Dict[Addr, Dict[Addr, int]] = {}
+		# sender address -> receive addresses to forward to, highest priority first. Built lazily
+		# from the room table and subscriptions; replaced wholesale whenever either changes.
+		self._fanout: Dict[Addr, List[Addr]] = {}
+		# server-side mosaic (MCU); its viewers' receive addresses -> room. They are left out of
+		# every fan-out and get the room's mosaic instead.
+		self.mcu: Optional[MosaicCompositor] = None
+		self.mosaic: Dict[Addr, str] = {}
+		# last-N: only a room's last_n most recent speakers are forwarded at full rate (0: everyone)
+		self.last_n = 0
+		# room -> sender keys that have held the floor, most recent first
+		self.speakers: Dict[str, List[Addr]] = {}
+		# room -> its senders currently trickled; built lazily like the fan-out
+		self._trickled: Dict[str, FrozenSet[Addr]] = {}
+		# trickled sender -> [frame id being let through, when it was picked]
+		self._trickle_frames: Dict[Addr, List[float]] = {}
+
+	def enable_mosaic(self, workers: int) -> None:
+		self.mcu = MosaicCompositor(self.sock, workers)
+
+	def register_client(self, client_addr: Addr, video_recv_addr: Addr, room: str = DEFAULT_ROOM) -> None:
+		self.clients.register(client_addr, video_recv_addr, room)
+		self._fanout = {}
+		self._trickled = {}
+
+	def unregister_client(self, client_addr: Addr) -> None:
+		entry = self.clients.clients.get(client_addr)
+		if entry is not None:
+			self.wants.pop(entry[0], None)
+			if entry[0] in self.subscriptions:
+				subs = dict(self.subscriptions)
+				del subs[entry[0]]
+				self.subscriptions = subs
+			if entry[0] in self.mosaic:
+				self.set_mosaic(client_addr, False)
+		self._senders.pop(client_addr, None)
+		self._trickle_frames.pop(client_addr, None)
+		self.clients.unregister(client_addr)
+		self._fanout = {}
+		self._trickled = {}
 
-	def register_client(self, client_control_addr: Tuple[str, int], video_recv_addr: Tuple[str, int]) -> None:
-		with self.clients_lock:
-			self.clients[client_control_addr] = video_recv_addr
+	def subscribe(self, client_addr: Addr, streams: Optional[Dict[Addr, int]]) -> None:
+		"""Forward client_addr only the senders in streams (sender key -> priority); None: all of its room."""
+		entry = self.clients.clients.get(client_addr)
+		if entry is None:
+			return
+		subs = dict(self.subscriptions)
+		if streams is None:
+			subs.pop(entry[0], None)
+		else:
+			subs[entry[0]] = dict(streams)
+		# subscriptions before fan-out, so a relay thread that sees the new (empty) index also sees them
+		self.subscriptions = subs
+		self._fanout = {}
 
-	def unregister_client(self, client_control_addr: Tuple[str, int]) -> None:
-		with self.clients_lock:
-			self.clients.pop(client_control_addr, None)
+	def set_mosaic(self, client_addr: Addr, enabled: bool) -> None:
+		"""Send client_addr its room's composited mosaic instead of individual streams (needs enable_mosaic)."""
+		entry = self.clients.clients.get(client_addr)
+		if entry is None or self.mcu is None or (entry[0] in self.mosaic) == enabled:
+			return
+		mosaic = dict(self.mosaic)
+		if enabled:
+			mosaic[entry[0]] = entry[1]
+		else:
+			del mosaic[entry[0]]
+		self.mosaic = mosaic
+		rooms: Dict[str, List[Addr]] = {}
+		for target, room in mosaic.items():
+			rooms.setdefault(room, []).append(target)
+		self.mcu.set_viewers(rooms)
+		self._fanout = {}
+
+	def set_layer(self, client_addr: Addr, layer: int) -> None:
+		entry = self.clients.clients.get(client_addr)
+		if entry is not None:
+			self.wants[entry[0]] = max(0, min(layer, LAYER_COUNT - 1))
+
+	def set_last_n(self, n: int) -> None:
+		"""Forward only each room's n most recent speakers at full rate; the rest trickle. 0: off."""
+		self.last_n = max(0, n)
+		self._trickled = {}
+
+	def set_speakers(self, room: str, senders: List[Addr]) -> None:
+		"""Record room's speakers as sender keys, most recent first (from the active-speaker detector)."""
+		speakers = dict(self.speakers)
+		if senders:
+			speakers[room] = list(senders)
+		else:
+			speakers.pop(room, None)
+		self.speakers = speakers
+		self._trickled = {}
 
 	def run(self) -> None:
 		self.running = True
+		if self.mcu is not None:
+			threading.Thread(target=self.mcu.run, daemon=True).start()
 		while self.running:
-			data, addr = self.sock.recvfrom(65535)
-			# data format: [name_len u8][name bytes][jpeg...]
-			if not data:
+			try:
+				batch = self.receive_batch()
+			except OSError:
+				if not self.running:
+					break
+				raise
+			self.forward(batch)
+
+	def receive_batch(self) -> List[Tuple[int, int, Addr]]:
+		"""Block for one datagram, then drain what else is queued, up to RELAY_BATCH.
+
+		Returns (slot, length, sender) per datagram; the bytes stay in the pool.
+		"""
+		batch: List[Tuple[int, int, Addr]] = []
+		try:
+			n, addr = self.sock.recvfrom_into(self._slots[0])
+			batch.append((0, n, addr))
+			while _DONTWAIT and len(batch) < RELAY_BATCH:
+				slot = len(batch)
+				n, addr = self.sock.recvfrom_into(self._slots[slot], 0, _DONTWAIT)
+				batch.append((slot, n, addr))
+		except (BlockingIOError, InterruptedError, ConnectionResetError):
+			# queue drained, or (Windows) an ICMP unreachable from an earlier send
+			pass
+		return batch
+
+	def forward(self, batch: List[Tuple[int, int, Addr]]) -> None:
+		clients = self.clients
+		pool = self._pool
+		wants = self.wants
+		fanout = self._fanout
+		mcu = self.mcu
+		mosaic_rooms = mcu.viewers if mcu is not None else None
+		trickled = self._trickled if self.last_n else None
+		now = time.monotonic()
+		for slot, length, addr in batch:
+			# packet format: [name_len u8][name bytes][version][layer]..., relayed unchanged
+			offset = slot * RELAY_MAX_DATAGRAM
+			if not length or pool[offset] + 1 > length:
 				continue
-			name_len = data[0]
-			name = data[1:1+name_len]
-			jpeg = data[1+name_len:]
-			packet = bytes([name_len]) + name + jpeg
-			with self.clients_lock:
-				targets = [v for k, v in self.clients.items() if k != addr]
+			room = clients.room_of(addr)
+			if room is None:
+				continue
+			pos = offset + 1 + pool[offset]
+			layer = min(pool[pos + 1], LAYER_COUNT - 1) if pos + 1 < offset + length and pool[pos] == VIDEO_PACKET_VERSION else 0
+			choice = LAYER_CHOICE[self._layer_mask(addr, layer, now)]
+			if mosaic_rooms and room in mosaic_rooms and choice[MOSAIC_LAYER] == layer:
+				mcu.feed(room, bytes(pool[offset : offset + length]))  # type: ignore[union-attr]
+			# each receiver gets the sender's best layer at or below the one it asked for
+			receivers = fanout.get(addr)
+			if receivers is None:
+				receivers = fanout[addr] = self._build_fanout(addr, room)
+			if trickled is not None:
+				quiet = trickled.get(room)
+				if quiet is None:
+					quiet = trickled[room] = self._build_trickled(room)
+				if addr in quiet:
+					# not among the last N speakers: its lowest layer only, one frame per interval
+					if choice[0] != layer or not self._trickle_pass(addr, pool, pos, offset + length, now):
+						continue
+					targets = receivers
+				else:
+					targets = [t for t in receivers if choice[wants.get(t, LAYER_COUNT - 1)] == layer]
+			else:
+				targets = [t for t in receivers if choice[wants.get(t, LAYER_COUNT - 1)] == layer]
+			packet = self._slots[slot][:length]
 			for t in targets:
-				self.sock.sendto(packet, t)
+				try:
+					self.sock.sendto(packet, t)
+				except OSError:
+					# one unreachable receiver must not stop the rest of the fan-out
+					pass
+
+	def _build_fanout(self, addr: Addr, room: str) -> List[Addr]:
+		subs = self.subscriptions
+		mosaic = self.mosaic
+		ranked = []
+		for t in self.clients.targets(room):
+			if t == addr or t in mosaic:
+				continue
+			wanted = subs.get(t)
+			if wanted is None:
+				ranked.append((0, t))
+			elif addr in wanted:
+				ranked.append((wanted[addr], t))
+		ranked.sort(key=lambda r: -r[0])
+		return [t for _, t in ranked]
+
+	def _build_trickled(self, room: str) -> FrozenSet[Addr]:
+		"""room's senders outside its last_n: recent speakers rank first, then the rest in join order."""
+		members = [key for key, _ in self.clients.members(room)]
+		if len(members) <= self.last_n:
+			return frozenset()
+		present = set(members)
+		ranked = [key for key in self.speakers.get(room, []) if key in present]
+		spoke = set(ranked)
+		ranked.extend(key for key in members if key not in spoke)
+		return frozenset(ranked[self.last_n :])
+
+	def _trickle_pass(self, addr: Addr, pool: bytearray, pos: int, end: int, now: float) -> bool:
+		"""Whether a trickled sender's datagram belongs to the one frame per interval let through."""
+		# frame id follows the version and layer bytes; older datagrams carry none and stay paused
+		if pos + 6 > end or pool[pos] != VIDEO_PACKET_VERSION:
+			return False
+		frame_id = int.from_bytes(pool[pos + 2 : pos + 6], "big")
+		state = self._trickle_frames.get(addr)
+		if state is not None and (state[0] == frame_id or now - state[1] < LAST_N_TRICKLE_INTERVAL):
+			return state[0] == frame_id
+		self._trickle_frames[addr] = [frame_id, now]
+		return True
+
+	def _layer_mask(self, addr: Addr, layer: int, now: float) -> int:
+		"""Note a datagram of layer from addr; return the mask of layers it is currently sending."""
+		state = self._senders.get(addr)
+		if state is None:
+			state = self._senders[addr] = [0.0] * LAYER_COUNT + [0, 0.0]
+		state[layer] = now
+		mask = int(state[LAYER_COUNT])
+		if mask >> layer & 1 and now - state[LAYER_COUNT + 1] < LAYER_TIMEOUT / 2:
+			return mask
+		mask = 0
+		for i in range(LAYER_COUNT):
+			if now - state[i] < LAYER_TIMEOUT:
+				mask |= 1 << i
+		state[LAYER_COUNT] = mask
+		state[LAYER_COUNT + 1] = now
+		return mask
 
 	def stop(self) -> None:
 		self.running = False
+		if self.mcu is not None:
+			self.mcu.stop()
 		self.sock.close()
 
 
+class JitterBuffer:
+	"""One audio source's chunks, played out in sequence order.
+
+	Playout starts once JITTER_TARGET_CHUNKS are queued, so arrival jitter and
+	reordering up to that depth are absorbed. A missing chunk is skipped when its
+	turn comes, a chunk arriving after its turn is dropped, an empty buffer pauses
+	the source until it refills, and beyond JITTER_MAX_CHUNKS the oldest chunks are
+	dropped to bound latency. Legacy headerless packets are numbered on arrival.
+	Payloads are decoded to 48 kHz PCM on arrival, with one decoder per format the
+	source has used.
+
+	A silence descriptor marks the source quiet (DTX): its queued chunks play out,
+	then it leaves the mix without counting an underrun, and its next chunk restarts
+	the sequence rather than being held for the numbers the SIDs used up.
+
+	Parity datagrams rebuild single lost datagrams, which then go through the same
+	path as if they had arrived late. ``loss`` measures the source's loss before
+	recovery.
+	"""
+
+	def __init__(self, room: str, chunk_bytes: int) -> None:
+		self.room = room
+		self.chunk_bytes = chunk_bytes
+		self.chunks: Dict[int, bytes] = {}
+		self.next_seq: Optional[int] = None
+		self.legacy_seq = 0
+		self.playing = False
+		self.talking = True
+		# background noise level (-dBov) from the source's last SID
+		self.noise_dbov: Optional[int] = None
+		self.decoders: Dict[int, AudioDecoder] = {}
+		self.fec = AudioFecDecoder()
+		self.loss = LossMeter()
+		self.last_packet = 0.0
+		self.late = 0
+		self.lost = 0
+		self.dropped = 0
+		self.underruns = 0
+
+	def push(self, data: bytes, now: float) -> None:
+		self.last_packet = now
+		seq, _, fmt, payload = parse_audio(data)
+		if seq is None:
+			seq = self.legacy_seq
+			self.legacy_seq = (seq + 1) & 0xFFFF
+			self._accept(seq, fmt, payload)
+			return
+		if fmt == AUDIO_FEC_FORMAT:
+			recovered = self.fec.add_parity(seq, payload)
+		else:
+			self.loss.packet(seq)
+			recovered = self.fec.add(seq, data)
+			self._accept(seq, fmt, payload, headered=True)
+		if recovered is not None:
+			seq, _, fmt, payload = parse_audio(recovered)
+			self._accept(seq, fmt, payload, headered=True)  # type: ignore[arg-type]
+
+	def _accept(self, seq: int, fmt: int, payload: bytes, headered: bool = False) -> None:
+		if headered:
+			level = sid_level(payload)
+			if level is not None:
+				if self.next_seq is None or not seq_before(seq, self.next_seq):
+					self.noise_dbov = level
+					self.talking = False
+				return
+		if not self.talking:
+			self.talking = True
+			if not self.chunks:
+				self.next_seq = seq
+		if self.next_seq is None:
+			self.next_seq = seq
+		elif seq_before(seq, self.next_seq):
+			self.late += 1
+			return
+		decoder = decoder_for(self.decoders, fmt)
+		if decoder is None:
+			return
+		payload = decoder.decode(payload).tobytes()
+		if len(payload) != self.chunk_bytes:
+			payload = payload[: self.chunk_bytes].ljust(self.chunk_bytes, b"\0")
+		self.chunks[seq] = payload
+		while len(self.chunks) > JITTER_MAX_CHUNKS:
+			if self.chunks.pop(self.next_seq, None) is not None:
+				self.dropped += 1
+			self.next_seq = (self.next_seq + 1) & 0xFFFF
+		if not self.playing and len(self.chunks) >= JITTER_TARGET_CHUNKS:
+			self.playing = True
+
+	def pop(self) -> Optional[bytes]:
+		"""Next chunk to mix, or None while buffering or for a lost chunk."""
+		if not self.playing or self.next_seq is None:
+			return None
+		if not self.chunks:
+			self.playing = False
+			if self.talking:
+				self.underruns += 1
+			return None
+		chunk = self.chunks.pop(self.next_seq, None)
+		self.next_seq = (self.next_seq + 1) & 0xFFFF
+		if chunk is None:
+			self.lost += 1
+		return chunk
+
+
+class _Listener:
+	"""A headered listener's mix stream: its next seq, encoder and FEC."""
+
+	__slots__ = ("seq", "encoder", "fec")
+
+	def __init__(self, encoder: AudioEncoder, fec: bool = False) -> None:
+		self.seq = 0
+		self.encoder = encoder
+		self.fec = AudioFecEncoder(AUDIO_FEC_MAX_GROUP if fec else 0)
+
+
 class AudioMixerRelay:
+	"""Mix-minus audio conference mixer.
+
+	The receive loop feeds each sender's PCM into its own JitterBuffer. A mixer
+	thread ticks every AUDIO_CHUNK_MS and, per room, sums one chunk from every
+	playing source as int32 rows of one matrix; every registered listener gets
+	exactly one stream back: the clipped total minus its own contribution. A
+	listener's contribution is matched by its registered address, so clients
+	send from the socket they registered (as they do for video). Listeners that
+	registered with the audio header get sequenced, timestamped packets in the
+	format negotiated for them. A mix-minus is encoded per listener; the mix of
+	everyone, heard by all who are not talking, once per room and format.
+
+	Sources in DTX cost nothing per tick. When none of a room is talking, headered
+	listeners get a silence descriptor every AUDIO_SID_INTERVAL_CHUNKS instead of
+	a mix, carrying the loudest background noise among the others, so their client
+	can play matching comfort noise.
+
+	Listeners that asked for FEC get a parity datagram after every few of theirs.
+	The server hears no loss reports for audio, so the group size follows the loss
+	measured on the listener's own microphone stream, which crosses the same link.
+
+	The chunks mixed each tick also feed an ActiveSpeakerDetector; on_speaker, if
+	set, is called from the mixer thread as (room, speaker key, recent speaker keys)
+	whenever a room's dominant speaker changes.
+	"""
+
 	def __init__(self, host: str) -> None:
 		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 		self.sock.bind((host, AUDIO_UDP_PORT))
 		self.running = False
-		self.clients_lock = threading.Lock()
-		self.clients: Dict[Tuple[str, int], Tuple[str, int]] = {}
+		self.clients = RelayTargets()
+		self.interval = AUDIO_CHUNK_MS / 1000
+		self.chunk_bytes = AUDIO_CHUNK_SAMPLES * AUDIO_CHANNELS * 2
+		self.lock = threading.Lock()
+		self.sources: Dict[Addr, JitterBuffer] = {}
+		# listener key -> its mix stream; listeners not listed get bare PCM
+		self.listeners: Dict[Addr, _Listener] = {}
+		# (room, format) -> encoder of the room's everyone mix
+		self.room_encoders: Dict[Tuple[str, int], AudioEncoder] = {}
+		# mixer clock in samples, the timestamp of every mix sent on a tick
+		self.clock = 0
+		# quiet room -> ticks until its next SID round
+		self.sid_countdown: Dict[str, int] = {}
+		self.speakers = ActiveSpeakerDetector(self.interval)
+		self.on_speaker: Optional[Callable[[str, Addr, List[Addr]], None]] = None
+		# sources unregistered since the last tick, for the mixer thread to drop from the detector
+		self._departed: List[Addr] = []
 
-	def register_client(self, client_control_addr: Tuple[str, int], audio_recv_addr: Tuple[str, int]) -> None:
-		with self.clients_lock:
-			self.clients[client_control_addr] = audio_recv_addr
+	def register_client(self, client_addr: Addr, audio_recv_addr: Addr, room: str = DEFAULT_ROOM) -> None:
+		self.clients.register(client_addr, audio_recv_addr, room)
 
-	def unregister_client(self, client_control_addr: Tuple[str, int]) -> None:
-		with self.clients_lock:
-			self.clients.pop(client_control_addr, None)
+	def set_format(self, client_addr: Addr, codec: Optional[str], rate: int = AUDIO_SAMPLE_RATE, fec: bool = False) -> None:
+		"""Send client_addr's mix headered and encoded with codec at rate, with parity if fec; codec None: bare PCM."""
+		listeners = dict(self.listeners)
+		if codec is None:
+			listeners.pop(client_addr, None)
+		else:
+			current = listeners.get(client_addr)
+			if current is None or (current.encoder.codec, current.encoder.rate, current.fec.group > 0) != (codec, rate, fec):
+				listeners[client_addr] = _Listener(AudioEncoder(codec, rate), fec)
+		self.listeners = listeners
+
+	def unregister_client(self, client_addr: Addr) -> None:
+		room = self.clients.room_of(client_addr)
+		self.clients.unregister(client_addr)
+		self.set_format(client_addr, None)
+		if room is not None and not self.clients.members(room):
+			self.room_encoders = {k: v for k, v in self.room_encoders.items() if k[0] != room}
+		with self.lock:
+			self.sources.pop(client_addr, None)
+			self._departed.append(client_addr)
 
 	def run(self) -> None:
 		self.running = True
-		# Mix frames arriving sequentially by summing per-sample with clipping, rebroadcasting to all.
+		threading.Thread(target=self._mix_loop, daemon=True).start()
 		while self.running:
-			data, addr = self.sock.recvfrom(65535)
-			with self.clients_lock:
-				targets = list(self.clients.values())
-			# naive: forward the most recent packet as "mixed"; for real mixing we'd buffer by timestamps
-			for t in targets:
-				self.sock.sendto(data, t)
+			try:
+				data, addr = self.sock.recvfrom(65535)
+			except ConnectionResetError:
+				continue
+			except OSError:
+				if not self.running:
+					break
+				raise
+			room = self.clients.room_of(addr)
+			if room is None:
+				continue
+			now = time.monotonic()
+			with self.lock:
+				source = self.sources.get(addr)
+				if source is None or source.room != room:
+					source = self.sources[addr] = JitterBuffer(room, self.chunk_bytes)
+				try:
+					source.push(data, now)
+				except ValueError:
+					# a malformed payload costs its datagram, not the receive thread
+					continue
+
+	def _mix_loop(self) -> None:
+		next_tick = time.monotonic()
+		while self.running:
+			next_tick += self.interval
+			delay = next_tick - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			elif delay < -MIX_MAX_LAG:
+				# stalled (e.g. the machine was suspended): restart the clock instead of bursting
+				next_tick = time.monotonic()
+			try:
+				self.mix_once(time.monotonic())
+			except OSError:
+				if not self.running:
+					break
+
+	def mix_once(self, now: float) -> None:
+		"""One mixer tick: take a chunk from every playing source and send each room's mixes."""
+		rooms: Dict[str, List[Tuple[Addr, bytes]]] = {}
+		quiet: Dict[str, List[Tuple[Addr, int]]] = {}
+		with self.lock:
+			departed, self._departed = self._departed, []
+			for addr, source in list(self.sources.items()):
+				if now - source.last_packet > AUDIO_SOURCE_TIMEOUT:
+					del self.sources[addr]
+					departed.append(addr)
+					continue
+				if source.playing:
+					chunk = source.pop()
+					if chunk is not None:
+						rooms.setdefault(source.room, []).append((addr, chunk))
+						continue
+				# in DTX once its last chunk has played
+				if not source.playing and not source.talking and source.noise_dbov is not None:
+					quiet.setdefault(source.room, []).append((addr, source.noise_dbov))
+		for room, active in rooms.items():
+			self._send_mix(room, active)
+		for addr in departed:
+			self.speakers.forget(addr)
+		changes = self.speakers.update(rooms, now)
+		if changes and self.on_speaker is not None:
+			for room, speaker, recent in changes:
+				self.on_speaker(room, speaker, recent)
+		countdown = {}
+		for room, levels in quiet.items():
+			if room in rooms:
+				continue
+			# a room that just went quiet gets its first SID right away
+			ticks = self.sid_countdown.get(room, 0)
+			if ticks <= 0:
+				self._send_sid(room, levels)
+				ticks = AUDIO_SID_INTERVAL_CHUNKS
+			countdown[room] = ticks - 1
+		self.sid_countdown = countdown
+		self.clock = (self.clock + AUDIO_CHUNK_SAMPLES) & 0xFFFFFFFF
+
+	def _send_mix(self, room: str, active: List[Tuple[Addr, bytes]]) -> None:
+		# one row per source; int32 so the sum cannot wrap before clipping
+		sources = np.frombuffer(b"".join(chunk for _, chunk in active), dtype=np.int16).reshape(len(active), -1).astype(np.int32)
+		total = sources.sum(axis=0)
+		# mix-minus for every active source at once: the total without its own row
+		minus = np.clip(total - sources, -32768, 32767).astype(np.int16)
+		index = {addr: i for i, (addr, _) in enumerate(active)}
+		everyone: Optional[np.ndarray] = None
+		# the everyone mix as sent, per format (-1: bare PCM)
+		shared: Dict[int, bytes] = {}
+		listeners = self.listeners
+		for key, target in self.clients.members(room):
+			listener = listeners.get(key)
+			fmt = listener.encoder.format if listener is not None else -1
+			i = index.get(key)
+			if i is not None:
+				if len(active) == 1:
+					# only this listener is talking; there is nothing for it to hear
+					continue
+				payload = listener.encoder.encode(minus[i]) if listener is not None else minus[i].tobytes()
+			else:
+				cached = shared.get(fmt)
+				if cached is None:
+					if everyone is None:
+						everyone = np.clip(total, -32768, 32767).astype(np.int16)
+					if listener is None:
+						cached = everyone.tobytes()
+					else:
+						cached = self._room_encoder(room, listener.encoder).encode(everyone)
+					shared[fmt] = cached
+				payload = cached
+			parity = None
+			if listener is not None:
+				# only the mixer thread advances seqs; set_format swaps the dict, so a lost update just restarts one
+				payload = pack_audio(listener.seq, self.clock, payload, fmt)
+				parity = self._parity(key, listener, payload)
+				listener.seq = (listener.seq + 1) & 0xFFFF
+			try:
+				self.sock.sendto(payload, target)
+				if parity is not None:
+					self.sock.sendto(parity, target)
+			except OSError:
+				if not self.running:
+					raise
+
+	def _room_encoder(self, room: str, like: AudioEncoder) -> AudioEncoder:
+		encoder = self.room_encoders.get((room, like.format))
+		if encoder is None:
+			encoder = self.room_encoders[(room, like.format)] = AudioEncoder(like.codec, like.rate)
+		return encoder
+
+	def _send_sid(self, room: str, levels: List[Tuple[Addr, int]]) -> None:
+		listeners = self.listeners
+		for key, target in self.clients.members(room):
+			listener = listeners.get(key)
+			if listener is None:
+				continue
+			# -dBov: the smallest value is the loudest noise this listener would hear
+			others = [level for addr, level in levels if addr != key]
+			if not others:
+				continue
+			packet = pack_sid(listener.seq, self.clock, min(others))
+			# parity before the seq moves on: it covers the packet's own seq
+			parity = self._parity(key, listener, packet, flush=True)
+			listener.seq = (listener.seq + 1) & 0xFFFF
+			try:
+				self.sock.sendto(packet, target)
+				if parity is not None:
+					self.sock.sendto(parity, target)
+			except OSError:
+				if not self.running:
+					raise
+
+	def _parity(self, key: Addr, listener: _Listener, packet: bytes, flush: bool = False) -> Optional[bytes]:
+		fec = listener.fec
+		if not fec.group:
+			return None
+		source = self.sources.get(key)
+		fec.group = fec_group_size(source.loss.fraction if source is not None else 0.0, AUDIO_FEC_MAX_GROUP)
+		return fec.add(listener.seq, packet, flush)
 
 	def stop(self) -> None:
 		self.running = False
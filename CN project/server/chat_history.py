@@ -0,0 +1,195 @@
+import bisect
+import json
+import os
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List
+
+# Messages kept in memory for replay without touching disk.
+HISTORY_RING_SIZE = 1000
+# A segment is closed and a new one started once it grows past this size.
+HISTORY_SEGMENT_BYTES = 4 * 1024 * 1024
+# One sparse index entry (seq, file offset) is written every this many records.
+HISTORY_INDEX_INTERVAL = 64
+HISTORY_PAGE_MAX = 500
+
+INDEX_ENTRY = struct.Struct("!QQ")
+
+
+class _Segment:
+	def __init__(self, directory: str, base_seq: int) -> None:
+		self.base_seq = base_seq
+		self.log_path = os.path.join(directory, f"{base_seq:020d}.log")
+		self.idx_path = os.path.join(directory, f"{base_seq:020d}.idx")
+		# sparse index: parallel lists so bisect works on the seqs
+		self.index_seqs: List[int] = []
+		self.index_offsets: List[int] = []
+
+	def load_index(self) -> None:
+		if not os.path.exists(self.idx_path):
+			return
+		with open(self.idx_path, "rb") as f:
+			data = f.read()
+		usable = len(data) - len(data) % INDEX_ENTRY.size
+		for seq, offset in INDEX_ENTRY.iter_unpack(data[:usable]):
+			self.index_seqs.append(seq)
+			self.index_offsets.append(offset)
+
+	def seek_offset(self, seq: int) -> int:
+		"""Offset of the last indexed record at or before seq."""
+		i = bisect.bisect_right(self.index_seqs, seq) - 1
+		return self.index_offsets[i] if i >= 0 else 0
+
+
+class ChatHistory:
+	"""Sequenced chat history: an in-memory ring over an append-only segmented log.
+
+	Each segment is a JSON-lines file named after its first sequence number, with
+	a sidecar .idx of (seq, offset) pairs every HISTORY_INDEX_INTERVAL records.
+	Pages inside the ring are sliced directly; older pages bisect to a segment and
+	an index entry, seek, and read at most one index interval plus the page.
+	"""
+
+	def __init__(
+		self,
+		directory: str,
+		ring_size: int = HISTORY_RING_SIZE,
+		segment_bytes: int = HISTORY_SEGMENT_BYTES,
+		index_interval: int = HISTORY_INDEX_INTERVAL,
+	) -> None:
+		self.directory = directory
+		self.segment_bytes = segment_bytes
+		self.index_interval = index_interval
+		self.ring_size = ring_size
+		self.lock = threading.Lock()
+		self.ring: Deque[Dict[str, Any]] = deque(maxlen=ring_size)
+		self.segments: List[_Segment] = []
+		self.segment_bases: List[int] = []
+		self.next_seq = 1
+		os.makedirs(directory, exist_ok=True)
+		self._load()
+		self._log = open(self.segments[-1].log_path, "ab")
+		self._idx = open(self.segments[-1].idx_path, "ab")
+
+	@property
+	def last_seq(self) -> int:
+		return self.next_seq - 1
+
+	@property
+	def first_seq(self) -> int:
+		with self.lock:
+			return self._first_seq()
+
+	def append(self, username: str, text: str) -> Dict[str, Any]:
+		with self.lock:
+			record = {"seq": self.next_seq, "ts": time.time(), "username": username, "text": text}
+			self._write(record)
+			self.ring.append(record)
+			self.next_seq += 1
+			return record
+
+	def since(self, seq: int, limit: int) -> List[Dict[str, Any]]:
+		"""Records with seq > given seq, oldest first, at most limit."""
+		with self.lock:
+			first = max(seq + 1, self._first_seq())
+			last = min(first + limit, self.next_seq) - 1
+			return self._range(first, last)
+
+	def before(self, seq: int, limit: int) -> List[Dict[str, Any]]:
+		"""The limit records immediately preceding seq, oldest first."""
+		with self.lock:
+			last = min(seq, self.next_seq) - 1
+			first = max(last - limit + 1, self._first_seq())
+			return self._range(first, last)
+
+	def close(self) -> None:
+		with self.lock:
+			self._log.close()
+			self._idx.close()
+
+	def _first_seq(self) -> int:
+		return self.segments[0].base_seq
+
+	def _range(self, first: int, last: int) -> List[Dict[str, Any]]:
+		if last < first:
+			return []
+		if self.ring and first >= self.ring[0]["seq"]:
+			# seqs are contiguous, so the ring is addressable by offset
+			base = self.ring[0]["seq"]
+			return [self.ring[i] for i in range(first - base, last - base + 1)]
+		return self._read_disk(first, last)
+
+	def _read_disk(self, first: int, last: int) -> List[Dict[str, Any]]:
+		out: List[Dict[str, Any]] = []
+		i = bisect.bisect_right(self.segment_bases, first) - 1
+		for segment in self.segments[max(i, 0) :]:
+			if segment.base_seq > last:
+				break
+			with open(segment.log_path, "rb") as f:
+				f.seek(segment.seek_offset(first))
+				for line in f:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						continue
+					if record["seq"] > last:
+						return out
+					if record["seq"] >= first:
+						out.append(record)
+		return out
+
+	def _write(self, record: Dict[str, Any]) -> None:
+		segment = self.segments[-1]
+		offset = self._log.tell()
+		if offset >= self.segment_bytes:
+			self._log.close()
+			self._idx.close()
+			segment = _Segment(self.directory, record["seq"])
+			self.segments.append(segment)
+			self.segment_bases.append(segment.base_seq)
+			self._log = open(segment.log_path, "ab")
+			self._idx = open(segment.idx_path, "ab")
+			offset = 0
+		if (record["seq"] - segment.base_seq) % self.index_interval == 0:
+			self._idx.write(INDEX_ENTRY.pack(record["seq"], offset))
+			self._idx.flush()
+			segment.index_seqs.append(record["seq"])
+			segment.index_offsets.append(offset)
+		self._log.write(json.dumps(record).encode("utf-8") + b"\n")
+		self._log.flush()
+
+	def _load(self) -> None:
+		bases = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".log") and name[:-4].isdigit())
+		for base in bases:
+			segment = _Segment(self.directory, base)
+			segment.load_index()
+			self.segments.append(segment)
+		if not self.segments:
+			self.segments.append(_Segment(self.directory, 1))
+		self.segment_bases = [s.base_seq for s in self.segments]
+		if not bases:
+			return
+		# only the tail of the last segment (one index interval at most) needs reading
+		tail = self.segments[-1]
+		self.next_seq = tail.base_seq
+		good_end = 0
+		if os.path.exists(tail.log_path):
+			with open(tail.log_path, "rb") as f:
+				good_end = offset = tail.index_offsets[-1] if tail.index_offsets else 0
+				f.seek(offset)
+				for line in f:
+					offset += len(line)
+					if not line.endswith(b"\n"):
+						break
+					try:
+						self.next_seq = json.loads(line)["seq"] + 1
+					except (ValueError, KeyError):
+						break
+					good_end = offset
+			# drop a torn final record left by a crash mid-write
+			with open(tail.log_path, "ab") as f:
+				f.truncate(good_end)
+		for record in self._read_disk(max(self._first_seq(), self.next_seq - self.ring_size), self.next_seq - 1):
+			self.ring.append(record)
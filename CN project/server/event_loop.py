@@ -0,0 +1,291 @@
+import heapq
+import selectors
+import socket
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
+
+RECV_SIZE = 65536
+ACCEPT_BATCH = 64
+
+
+class TimerHandle:
+	def __init__(self, when: float, callback: Callable[[], None]) -> None:
+		self.when = when
+		self.callback = callback
+		self.cancelled = False
+
+	def cancel(self) -> None:
+		self.cancelled = True
+
+
+class EventLoop:
+	"""Single-threaded selectors reactor that multiplexes many non-blocking sockets.
+
+	Handlers registered with the loop expose handle_read(), handle_write(), close()
+	and a ``closed`` attribute. Everything except call_soon_threadsafe() must be
+	called from the loop thread.
+	"""
+
+	def __init__(self) -> None:
+		self.selector = selectors.DefaultSelector()
+		self.running = False
+		self.thread_id: Optional[int] = None
+		self._pending: Deque[Callable[[], None]] = deque()
+		self._pending_lock = threading.Lock()
+		self._timers: List[Tuple[float, int, TimerHandle]] = []
+		self._timer_seq = 0
+		self._wake_recv, self._wake_send = socket.socketpair()
+		self._wake_recv.setblocking(False)
+		self._wake_send.setblocking(False)
+		self.selector.register(self._wake_recv, selectors.EVENT_READ, None)
+
+	def in_loop_thread(self) -> bool:
+		return self.thread_id == threading.get_ident()
+
+	def register(self, sock: socket.socket, handler, events: int = selectors.EVENT_READ) -> None:
+		self.selector.register(sock, events, handler)
+
+	def modify(self, sock: socket.socket, handler, events: int) -> None:
+		self.selector.modify(sock, events, handler)
+
+	def unregister(self, sock: socket.socket) -> None:
+		try:
+			self.selector.unregister(sock)
+		except (KeyError, ValueError):
+			pass
+
+	def call_soon_threadsafe(self, callback: Callable[[], None]) -> None:
+		with self._pending_lock:
+			self._pending.append(callback)
+		try:
+			self._wake_send.send(b"\0")
+		except OSError:
+			# wake pipe full (a wakeup is already pending) or loop closed
+			pass
+
+	def call_later(self, delay: float, callback: Callable[[], None]) -> TimerHandle:
+		handle = TimerHandle(time.monotonic() + delay, callback)
+		self._timer_seq += 1
+		heapq.heappush(self._timers, (handle.when, self._timer_seq, handle))
+		return handle
+
+	def run(self) -> None:
+		self.running = True
+		self.thread_id = threading.get_ident()
+		while self.running:
+			for key, mask in self.selector.select(self._next_timeout()):
+				handler = key.data
+				if handler is None:
+					self._drain_wake()
+					continue
+				try:
+					if mask & selectors.EVENT_READ:
+						handler.handle_read()
+					if mask & selectors.EVENT_WRITE and not handler.closed:
+						handler.handle_write()
+				except Exception:
+					traceback.print_exc()
+					handler.close()
+			self._run_pending()
+			self._run_timers()
+
+	def stop(self) -> None:
+		self.running = False
+		try:
+			self._wake_send.send(b"\0")
+		except OSError:
+			pass
+
+	def close(self) -> None:
+		self.selector.close()
+		for s in (self._wake_recv, self._wake_send):
+			try:
+				s.close()
+			except OSError:
+				pass
+
+	def _next_timeout(self) -> Optional[float]:
+		if self._pending:
+			return 0
+		if not self._timers:
+			return None
+		return max(0.0, self._timers[0][0] - time.monotonic())
+
+	def _drain_wake(self) -> None:
+		try:
+			while self._wake_recv.recv(4096):
+				pass
+		except OSError:
+			pass
+
+	def _run_pending(self) -> None:
+		with self._pending_lock:
+			batch = self._pending
+			self._pending = deque()
+		for callback in batch:
+			try:
+				callback()
+			except Exception:
+				traceback.print_exc()
+
+	def _run_timers(self) -> None:
+		now = time.monotonic()
+		while self._timers and self._timers[0][0] <= now:
+			_, _, handle = heapq.heappop(self._timers)
+			if handle.cancelled:
+				continue
+			try:
+				handle.callback()
+			except Exception:
+				traceback.print_exc()
+
+
+class Listener:
+	def __init__(self, loop: EventLoop, sock: socket.socket, on_accept: Callable[[socket.socket, Tuple[str, int]], None]) -> None:
+		self.loop = loop
+		self.sock = sock
+		self.on_accept = on_accept
+		self.closed = False
+		sock.setblocking(False)
+		loop.register(sock, self)
+
+	def handle_read(self) -> None:
+		for _ in range(ACCEPT_BATCH):
+			try:
+				client, addr = self.sock.accept()
+			except (BlockingIOError, InterruptedError):
+				return
+			client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			self.on_accept(client, addr)
+
+	def handle_write(self) -> None:
+		pass
+
+	def close(self) -> None:
+		if self.closed:
+			return
+		self.closed = True
+		self.loop.unregister(self.sock)
+
+
+class StreamConnection:
+	"""Non-blocking TCP connection owned by an EventLoop.
+
+	Subclasses implement data_received(), and optionally connection_lost() and
+	produce() (pull more outbound data once the write buffer has drained).
+	"""
+
+	def __init__(self, loop: EventLoop, sock: socket.socket, address: Tuple[str, int]) -> None:
+		self.loop = loop
+		self.sock = sock
+		self.address = address
+		self.closed = False
+		self.close_when_drained = False
+		self.out_bytes = 0
+		self.stalled_since: Optional[float] = None
+		self._out: Deque[memoryview] = deque()
+		self._writing = False
+		self._broken = False
+		sock.setblocking(False)
+		loop.register(sock, self)
+
+	def data_received(self, data: bytes) -> None:
+		raise NotImplementedError
+
+	def connection_lost(self) -> None:
+		pass
+
+	def produce(self) -> Optional[bytes]:
+		return None
+
+	def handle_read(self) -> None:
+		try:
+			data = self.sock.recv(RECV_SIZE)
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError:
+			self.close()
+			return
+		if not data:
+			self.close()
+			return
+		self.data_received(data)
+
+	def handle_write(self) -> None:
+		self._flush()
+
+	def write(self, data: bytes) -> None:
+		if not self.loop.in_loop_thread():
+			self.loop.call_soon_threadsafe(lambda: self.write(data))
+			return
+		if self.closed or self._broken or not data:
+			return
+		self._out.append(memoryview(data))
+		self.out_bytes += len(data)
+		if not self._writing:
+			self._flush()
+
+	def close(self) -> None:
+		if not self.loop.in_loop_thread():
+			self.loop.call_soon_threadsafe(self.close)
+			return
+		if self.closed:
+			return
+		self.closed = True
+		self.loop.unregister(self.sock)
+		try:
+			self.sock.close()
+		except OSError:
+			pass
+		self._out.clear()
+		self.out_bytes = 0
+		self.connection_lost()
+
+	def _flush(self) -> None:
+		while True:
+			while self._out:
+				view = self._out[0]
+				try:
+					sent = self.sock.send(view)
+				except (BlockingIOError, InterruptedError):
+					sent = 0
+				except OSError:
+					self.abort()
+					return
+				self.out_bytes -= sent
+				if sent < len(view):
+					self._out[0] = view[sent:]
+					self._set_writing(True)
+					return
+				self._out.popleft()
+			more = self.produce()
+			if not more:
+				break
+			self._out.append(memoryview(more))
+			self.out_bytes += len(more)
+		self._set_writing(False)
+		if self.close_when_drained:
+			self.close()
+
+	def abort(self) -> None:
+		# Close on the next loop iteration, not from inside write(): callers may be
+		# iterating their session tables under a lock that connection_lost() needs.
+		self._broken = True
+		if not self.loop.in_loop_thread():
+			# _out belongs to the loop thread, which may be inside _flush() right now
+			self.loop.call_soon_threadsafe(self.abort)
+			return
+		self._out.clear()
+		self.out_bytes = 0
+		self.loop.call_soon_threadsafe(self.close)
+
+	def _set_writing(self, writing: bool) -> None:
+		if writing == self._writing or self.closed:
+			return
+		self._writing = writing
+		self.stalled_since = time.monotonic() if writing else None
+		events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+		self.loop.modify(self.sock, self, events)
@@ -2,9 +2,21 @@ import os
 import socket
 import struct
 import threading
-from typing import Dict, Tuple
+from typing import BinaryIO, Dict, Optional, Tuple
 
 from common.constants import FILE_TCP_PORT
+from server.event_loop import EventLoop, Listener, StreamConnection
+
+
+def safe_filename(raw: bytes) -> Optional[str]:
+	# Stored names are bare file names inside storage_dir; anything else is refused
+	try:
+		name = raw.decode("utf-8")
+	except UnicodeDecodeError:
+		return None
+	if name in ("", ".", "..") or "/" in name or "\\" in name or "\0" in name:
+		return None
+	return name
 
 
 class FileTransferServer:
@@ -26,6 +38,12 @@ class FileTransferServer:
 			client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 			threading.Thread(target=self._client_loop, args=(client,), daemon=True).start()
 
+	def attach(self, loop: EventLoop) -> None:
+		self.server.bind((self.host, self.port))
+		self.server.listen(50)
+		self.running = True
+		Listener(loop, self.server, lambda sock, addr: FileConnection(self, loop, sock, addr))
+
 	def stop(self) -> None:
 		self.running = False
 		try:
@@ -61,10 +79,12 @@ class FileTransferServer:
 		(name_len,) = struct.unpack("!H", name_len_bytes)
 		name = self._recv_exact(sock, name_len)
 		size_bytes = self._recv_exact(sock, 8)
-		if not size_bytes:
+		if name is None or not size_bytes:
 			return
 		(size,) = struct.unpack("!Q", size_bytes)
-		filename = os.path.basename(name.decode("utf-8"))
+		filename = safe_filename(name)
+		if filename is None:
+			return
 		path = os.path.join(self.storage_dir, filename)
 		remaining = size
 		with open(path, "wb") as f:
@@ -82,9 +102,11 @@ class FileTransferServer:
 			return
 		(name_len,) = struct.unpack("!H", name_len_bytes)
 		name = self._recv_exact(sock, name_len)
-		filename = os.path.basename(name.decode("utf-8"))
-		path = os.path.join(self.storage_dir, filename)
-		if not os.path.exists(path):
+		if name is None:
+			return
+		filename = safe_filename(name)
+		path = os.path.join(self.storage_dir, filename) if filename is not None else ""
+		if not os.path.isfile(path):
 			sock.sendall(struct.pack("!Q", 0))
 			return
 		size = os.path.getsize(path)
@@ -104,3 +126,99 @@ class FileTransferServer:
 				return None
 			buf.extend(chunk)
 		return bytes(buf)
+
+
+class FileConnection(StreamConnection):
+	"""Event-loop version of FileTransferServer._client_loop, same wire format."""
+
+	def __init__(self, server: FileTransferServer, loop: EventLoop, sock: socket.socket, address: Tuple[str, int]) -> None:
+		super().__init__(loop, sock, address)
+		self.server = server
+		self.buffer = bytearray()
+		self.op: Optional[bytes] = None
+		self.filename: Optional[str] = None
+		self.upload: Optional[BinaryIO] = None
+		self.download: Optional[BinaryIO] = None
+		self.remaining = 0
+
+	def data_received(self, data: bytes) -> None:
+		if self.upload is not None:
+			self._write_upload(data)
+			return
+		if self.op == b"\x02" and self.filename is not None:
+			return
+		self.buffer.extend(data)
+		if self.op is None:
+			self.op = bytes(self.buffer[:1])
+			del self.buffer[:1]
+			if self.op not in (b"\x01", b"\x02"):
+				self.close()
+				return
+		if self.filename is None:
+			if len(self.buffer) < 2:
+				return
+			(name_len,) = struct.unpack_from("!H", self.buffer)
+			if len(self.buffer) < 2 + name_len:
+				return
+			filename = safe_filename(bytes(self.buffer[2 : 2 + name_len]))
+			del self.buffer[: 2 + name_len]
+			if filename is None:
+				self._reject()
+				return
+			self.filename = filename
+			if self.op == b"\x02":
+				self._start_download()
+				return
+		if len(self.buffer) < 8:
+			return
+		(self.remaining,) = struct.unpack_from("!Q", self.buffer)
+		rest = bytes(self.buffer[8:])
+		self.buffer.clear()
+		try:
+			self.upload = open(os.path.join(self.server.storage_dir, self.filename), "wb")
+		except OSError:
+			self.close()
+			return
+		self._write_upload(rest)
+
+	def _reject(self) -> None:
+		# Downloads get the usual "not found" size of 0, uploads are simply cut off
+		if self.op == b"\x02":
+			self.close_when_drained = True
+			self.write(struct.pack("!Q", 0))
+		else:
+			self.close()
+
+	def _write_upload(self, data: bytes) -> None:
+		assert self.upload is not None
+		chunk = data[: self.remaining]
+		self.upload.write(chunk)
+		self.remaining -= len(chunk)
+		if self.remaining <= 0:
+			self.close()
+
+	def _start_download(self) -> None:
+		assert self.filename is not None
+		path = os.path.join(self.server.storage_dir, self.filename)
+		self.close_when_drained = True
+		if not os.path.isfile(path):
+			self.write(struct.pack("!Q", 0))
+			return
+		self.download = open(path, "rb")
+		self.write(struct.pack("!Q", os.path.getsize(path)))
+
+	def produce(self) -> Optional[bytes]:
+		if self.download is None:
+			return None
+		chunk = self.download.read(65536)
+		if not chunk:
+			self.download.close()
+			self.download = None
+		return chunk or None
+
+	def connection_lost(self) -> None:
+		for f in (self.upload, self.download):
+			if f is not None:
+				f.close()
+		self.upload = None
+		self.download = None
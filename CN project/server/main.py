@@ -5,17 +5,89 @@ import sys
 # Ensure project root is on sys.path when executed as a script
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
-from server_core import ControlServer
+from server_core import ControlServer, HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, OUTBOUND_HIGH_WATER, OUTBOUND_MAX_LAG, PRESENCE_BATCH_INTERVAL
 
 
 def main() -> None:
 	parser = argparse.ArgumentParser(description="LAN Collaboration Server")
 	parser.add_argument("--host", default="0.0.0.0")
 	parser.add_argument("--port", type=int, default=5000)
+	parser.add_argument(
+		"--mode",
+		choices=["threaded", "eventloop"],
+		default="threaded",
+		help="threaded: one thread per TCP connection; eventloop: one selectors loop for all TCP services",
+	)
+	parser.add_argument(
+		"--outbound-high-water",
+		type=int,
+		default=OUTBOUND_HIGH_WATER,
+		help="bytes a control session may have queued before it is evicted as a slow consumer",
+	)
+	parser.add_argument(
+		"--outbound-max-lag",
+		type=float,
+		default=OUTBOUND_MAX_LAG,
+		help="seconds a control session may stay unable to drain its queue before it is evicted",
+	)
+	parser.add_argument("--history-dir", default=os.path.join("storage", "chat"), help="directory for the chat history log")
+	parser.add_argument(
+		"--presence-interval",
+		type=float,
+		default=PRESENCE_BATCH_INTERVAL,
+		help="seconds between batched roster deltas",
+	)
+	parser.add_argument(
+		"--relay-workers",
+		type=int,
+		default=0,
+		help="relay video from this many processes sharing the UDP port via SO_REUSEPORT (0: one in-process thread)",
+	)
+	parser.add_argument(
+		"--heartbeat-interval",
+		type=float,
+		default=HEARTBEAT_INTERVAL,
+		help="seconds of silence after which a heartbeat-capable client is sent a PING",
+	)
+	parser.add_argument(
+		"--heartbeat-timeout",
+		type=float,
+		default=HEARTBEAT_TIMEOUT,
+		help="seconds of silence after which such a client and its media registrations are dropped",
+	)
+	parser.add_argument(
+		"--mosaic-workers",
+		type=int,
+		default=0,
+		help="compose a per-room video mosaic for clients that ask for one, on this many processes (0: off; needs --relay-workers 0)",
+	)
+	parser.add_argument(
+		"--last-n",
+		type=int,
+		default=0,
+		help="forward video at full rate only from each room's N most recent speakers; the rest trickle at 1 fps (0: off)",
+	)
 	args = parser.parse_args()
+	if args.mosaic_workers > 0 and args.relay_workers > 0:
+		parser.error("--mosaic-workers needs the in-process video relay (--relay-workers 0)")
 
-	server = ControlServer(args.host, args.port)
-	server.run()
+	server = ControlServer(
+		args.host,
+		args.port,
+		args.outbound_high_water,
+		args.outbound_max_lag,
+		history_dir=args.history_dir,
+		presence_interval=args.presence_interval,
+		relay_workers=args.relay_workers,
+		heartbeat_interval=args.heartbeat_interval,
+		heartbeat_timeout=args.heartbeat_timeout,
+		mosaic_workers=args.mosaic_workers,
+		last_n=args.last_n,
+	)
+	if args.mode == "eventloop":
+		server.run_event_loop()
+	else:
+		server.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+import math
+import multiprocessing
+import queue
+import socket
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from common.constants import VIDEO_LAYERS
+from common.media import FrameReassembler, MOSAIC_STREAM_NAME, fragment_frame, initial_frame_id, media_timestamp, sender_prefix
+
+Addr = Tuple[str, int]
+
+# Mosaic canvas bound; tiles keep 16:9, so the canvas is usually a little smaller.
+MOSAIC_WIDTH = 1280
+MOSAIC_HEIGHT = 720
+MOSAIC_FPS = 10.0
+MOSAIC_JPEG_QUALITY = 60
+# Simulcast layer the compositor takes from each sender (it still uses whatever a sender has).
+MOSAIC_LAYER = 1
+# A sender whose last frame is older than this drops out of the mosaic.
+MOSAIC_STALE_AFTER = 2.0
+# Datagrams queued from the relay thread; beyond this they are dropped rather than stall relaying.
+MOSAIC_INBOX = 4096
+# Seconds between per-room timing lines in the log.
+MOSAIC_STATS_INTERVAL = 10.0
+
+_REDUCED_DECODE = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def _grid(count: int, width: int, height: int) -> Tuple[int, int, int, int]:
+	"""(columns, rows, tile width, tile height) for count 16:9 tiles inside width x height."""
+	cols = max(1, math.ceil(math.sqrt(count)))
+	rows = max(1, math.ceil(count / cols))
+	tile_w = min(width // cols, (height // rows) * 16 // 9) & ~1
+	tile_h = (tile_w * 9 // 16) & ~1
+	return cols, rows, tile_w, tile_h
+
+
+def compose_mosaic(frames: List[Tuple[str, bytes]], width: int, height: int, quality: int) -> Tuple[Optional[bytes], float, float, float]:
+	"""Worker process: decode, tile and re-encode one mosaic.
+
+	Returns (JPEG or None, decode ms, compose ms, encode ms).
+	"""
+	t0 = time.perf_counter()
+	cols, rows, tile_w, tile_h = _grid(len(frames), width, height)
+	source_w = VIDEO_LAYERS[MOSAIC_LAYER][0]
+	flag = next((f for factor, f in _REDUCED_DECODE if source_w // factor >= tile_w), cv2.IMREAD_COLOR)
+	tiles = np.zeros((rows * cols, tile_h, tile_w, 3), dtype=np.uint8)
+	for i, (name, jpeg) in enumerate(frames):
+		img = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), flag)
+		if img is None:
+			continue
+		tiles[i] = cv2.resize(img, (tile_w, tile_h), interpolation=cv2.INTER_AREA)
+		cv2.putText(tiles[i], name, (6, tile_h - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+	t1 = time.perf_counter()
+	# (rows*cols, h, w, 3) -> (rows*h, cols*w, 3) in one copy
+	mosaic = np.ascontiguousarray(tiles.reshape(rows, cols, tile_h, tile_w, 3).transpose(0, 2, 1, 3, 4).reshape(rows * tile_h, cols * tile_w, 3))
+	t2 = time.perf_counter()
+	ok, enc = cv2.imencode(".jpg", mosaic, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+	t3 = time.perf_counter()
+	return (enc.tobytes() if ok else None), (t1 - t0) * 1000, (t2 - t1) * 1000, (t3 - t2) * 1000
+
+
+class _RoomMosaic:
+	def __init__(self) -> None:
+		self.reassembler = FrameReassembler()
+		# sender name -> (latest JPEG, when it completed)
+		self.latest: Dict[str, Tuple[bytes, float]] = {}
+		self.changed = False
+		self.pending: Optional[Future] = None
+		self.frame_id = initial_frame_id()
+		self.seq = 0
+		# running averages in ms: decode, compose, encode
+		self.timings = [0.0, 0.0, 0.0]
+		self.mosaics = 0
+
+
+class MosaicCompositor:
+	"""Server-side MCU: one composited stream per room for clients that ask for it.
+
+	The video relay feeds it the datagrams of rooms that have mosaic viewers. One
+	coordinator thread reassembles them into the latest frame per sender and, at
+	MOSAIC_FPS, hands each room whose frames changed to a process pool that decodes,
+	tiles and re-encodes the mosaic, so that work never competes with the relay
+	loop for the GIL. At most one mosaic per room is in flight; the result goes
+	out from the relay socket as sender MOSAIC_STREAM_NAME.
+	"""
+
+	def __init__(self, sock: socket.socket, workers: int, fps: float = MOSAIC_FPS) -> None:
+		self.sock = sock
+		self.workers = workers
+		self.interval = 1.0 / fps
+		self.inbox: "queue.Queue[Tuple[str, object]]" = queue.Queue(MOSAIC_INBOX)
+		# room -> receive addresses of its mosaic viewers; replaced wholesale on change
+		self.viewers: Dict[str, List[Addr]] = {}
+		self.rooms: Dict[str, _RoomMosaic] = {}
+		self.dropped = 0
+		self.running = False
+		self.pool: Optional[ProcessPoolExecutor] = None
+		self.prefix = sender_prefix(MOSAIC_STREAM_NAME)
+
+	def set_viewers(self, viewers: Dict[str, List[Addr]]) -> None:
+		self.viewers = viewers
+
+	def feed(self, room: str, packet: bytes) -> None:
+		"""Relay thread: queue one datagram of room for composition; never blocks."""
+		try:
+			self.inbox.put_nowait((room, packet))
+		except queue.Full:
+			self.dropped += 1
+
+	def run(self) -> None:
+		self.running = True
+		# spawn, not fork: the server is multithreaded by now
+		self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+		print(f"Mosaic compositor running on {self.workers} worker processes")
+		next_tick = time.monotonic() + self.interval
+		last_stats = time.monotonic()
+		while self.running:
+			try:
+				room, item = self.inbox.get(timeout=max(0.0, next_tick - time.monotonic()))
+			except queue.Empty:
+				pass
+			else:
+				if isinstance(item, Future):
+					self._send(room, item)
+				else:
+					self._add(room, item)  # type: ignore[arg-type]
+				if time.monotonic() < next_tick:
+					continue
+			now = time.monotonic()
+			next_tick = max(next_tick + self.interval, now)
+			self._tick(now)
+			if now - last_stats >= MOSAIC_STATS_INTERVAL:
+				last_stats = now
+				self._log_stats()
+
+	def stop(self) -> None:
+		self.running = False
+		if self.pool is not None:
+			self.pool.shutdown(wait=False, cancel_futures=True)
+
+	def _add(self, room: str, packet: bytes) -> None:
+		state = self.rooms.get(room)
+		if state is None:
+			state = self.rooms[room] = _RoomMosaic()
+		done = state.reassembler.add(packet)
+		if done is not None:
+			name, jpeg = done
+			state.latest[name] = (jpeg, time.monotonic())
+			state.changed = True
+
+	def _tick(self, now: float) -> None:
+		viewers = self.viewers
+		for room in [r for r in self.rooms if r not in viewers]:
+			del self.rooms[room]
+		for room, state in self.rooms.items():
+			for name in [n for n, (_, t) in state.latest.items() if now - t > MOSAIC_STALE_AFTER]:
+				del state.latest[name]
+				state.changed = True
+			if not state.changed or state.pending is not None or not state.latest or self.pool is None:
+				continue
+			frames = [(name, jpeg) for name, (jpeg, _) in sorted(state.latest.items())]
+			state.changed = False
+			future = self.pool.submit(compose_mosaic, frames, MOSAIC_WIDTH, MOSAIC_HEIGHT, MOSAIC_JPEG_QUALITY)
+			state.pending = future
+			# the result is sent from this thread, in order with everything else it does
+			future.add_done_callback(lambda f, room=room: self.inbox.put((room, f)))
+
+	def _send(self, room: str, future: Future) -> None:
+		state = self.rooms.get(room)
+		if state is None or future.cancelled():
+			return
+		state.pending = None
+		try:
+			jpeg, decode_ms, compose_ms, encode_ms = future.result()
+		except Exception as exc:
+			print(f"Mosaic for room {room} failed: {exc}")
+			return
+		if jpeg is None:
+			return
+		for i, ms in enumerate((decode_ms, compose_ms, encode_ms)):
+			state.timings[i] += (ms - state.timings[i]) * 0.1
+		state.mosaics += 1
+		state.frame_id += 1
+		packets = fragment_frame(self.prefix, state.frame_id, jpeg, seq=state.seq, timestamp=media_timestamp(time.monotonic()))
+		state.seq = (state.seq + len(packets)) & 0xFFFF
+		for target in self.viewers.get(room, []):
+			for packet in packets:
+				try:
+					self.sock.sendto(packet, target)
+				except OSError:
+					break
+
+	def _log_stats(self) -> None:
+		for room, state in self.rooms.items():
+			if state.mosaics:
+				decode_ms, compose_ms, encode_ms = state.timings
+				print(
+					f"Mosaic {room}: {len(state.latest)} tiles, {state.mosaics} mosaics, "
+					f"decode {decode_ms:.1f} ms, compose {compose_ms:.1f} ms, encode {encode_ms:.1f} ms"
+				)
+				state.mosaics = 0
+
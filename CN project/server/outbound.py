@@ -0,0 +1,141 @@
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+
+class OutboundQueue:
+	"""Per-socket send queue for thread-per-connection sessions.
+
+	The socket is non-blocking: write() sends as much as the kernel accepts right
+	away and hands any remainder to the shared SessionWriter, so callers never
+	wait on a slow peer. Mirrors the write side of event_loop.StreamConnection.
+	"""
+
+	def __init__(self, sock: socket.socket, writer: "SessionWriter") -> None:
+		self.sock = sock
+		self.writer = writer
+		self.lock = threading.Lock()
+		self.out_bytes = 0
+		self.stalled_since: Optional[float] = None
+		self.closed = False
+		self._out: Deque[memoryview] = deque()
+		sock.setblocking(False)
+
+	def write(self, data: bytes) -> None:
+		with self.lock:
+			if self.closed or not data:
+				return
+			self._out.append(memoryview(data))
+			self.out_bytes += len(data)
+			if self.stalled_since is not None:
+				# the writer thread already owns the backlog
+				return
+			drained = self._flush_locked()
+		if not drained:
+			self.writer.watch(self)
+
+	def flush(self) -> bool:
+		"""Send what the socket accepts; True once the queue is empty (or dead)."""
+		with self.lock:
+			return self._flush_locked()
+
+	def abort(self) -> None:
+		with self.lock:
+			self.closed = True
+			self._out.clear()
+			self.out_bytes = 0
+		try:
+			# wakes the session's reader thread, which then runs the normal removal path
+			self.sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+
+	def close(self) -> None:
+		with self.lock:
+			self.closed = True
+			self._out.clear()
+			self.out_bytes = 0
+		try:
+			self.sock.close()
+		except OSError:
+			pass
+
+	def _flush_locked(self) -> bool:
+		while self._out:
+			view = self._out[0]
+			try:
+				sent = self.sock.send(view)
+			except (BlockingIOError, InterruptedError):
+				sent = 0
+			except OSError:
+				self.closed = True
+				self._out.clear()
+				self.out_bytes = 0
+				return True
+			self.out_bytes -= sent
+			if sent < len(view):
+				self._out[0] = view[sent:]
+				if self.stalled_since is None:
+					self.stalled_since = time.monotonic()
+				return False
+			self._out.popleft()
+		self.stalled_since = None
+		return True
+
+
+class SessionWriter(threading.Thread):
+	"""Single thread that drains every stalled OutboundQueue when its socket turns writable."""
+
+	def __init__(self) -> None:
+		super().__init__(daemon=True)
+		self.selector = selectors.DefaultSelector()
+		self.running = True
+		self._added: List[OutboundQueue] = []
+		self._added_lock = threading.Lock()
+		self._wake_recv, self._wake_send = socket.socketpair()
+		self._wake_recv.setblocking(False)
+		self._wake_send.setblocking(False)
+		self.selector.register(self._wake_recv, selectors.EVENT_READ, None)
+
+	def watch(self, queue: OutboundQueue) -> None:
+		with self._added_lock:
+			self._added.append(queue)
+		try:
+			self._wake_send.send(b"\0")
+		except OSError:
+			pass
+
+	def run(self) -> None:
+		while self.running:
+			with self._added_lock:
+				added, self._added = self._added, []
+			for queue in added:
+				try:
+					self.selector.register(queue.sock, selectors.EVENT_WRITE, queue)
+				except (KeyError, ValueError, OSError):
+					# already watched, or the socket closed in the meantime
+					pass
+			for key, _ in self.selector.select(1.0):
+				queue = key.data
+				if queue is None:
+					try:
+						while self._wake_recv.recv(4096):
+							pass
+					except OSError:
+						pass
+					continue
+				if queue.flush() or queue.closed:
+					self.selector.unregister(key.fileobj)
+			for key in list(self.selector.get_map().values()):
+				if key.data is not None and key.data.closed:
+					self.selector.unregister(key.fileobj)
+
+	def stop(self) -> None:
+		self.running = False
+		try:
+			self._wake_send.send(b"\0")
+		except OSError:
+			pass
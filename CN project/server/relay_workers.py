@@ -0,0 +1,158 @@
+import multiprocessing
+import socket
+import threading
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional, Tuple
+
+from common.protocol import DEFAULT_ROOM
+from server.av_udp import Addr, VideoRelay
+
+# Seconds stop() waits for a worker to exit before terminating it.
+WORKER_STOP_TIMEOUT = 2.0
+
+
+def reuse_port_supported() -> bool:
+	return hasattr(socket, "SO_REUSEPORT")
+
+
+def _video_worker(host: str, conn: Connection) -> None:
+	"""Worker process: a VideoRelay on the shared port, fed registrations over conn."""
+	relay = VideoRelay(host, reuse_port=True)
+	threading.Thread(target=relay.run, daemon=True).start()
+	try:
+		while True:
+			op = conn.recv()
+			if op[0] == "register":
+				relay.register_client(op[1], op[2], op[3])
+			elif op[0] == "unregister":
+				relay.unregister_client(op[1])
+			elif op[0] == "layer":
+				relay.set_layer(op[1], op[2])
+			elif op[0] == "subscribe":
+				relay.subscribe(op[1], op[2])
+			elif op[0] == "last_n":
+				relay.set_last_n(op[1])
+			elif op[0] == "speakers":
+				relay.set_speakers(op[1], op[2])
+			elif op[0] == "stop":
+				break
+	except (EOFError, OSError, KeyboardInterrupt):
+		pass
+	finally:
+		relay.stop()
+
+
+class VideoRelayPool:
+	"""Drop-in for VideoRelay that relays from N processes sharing VIDEO_UDP_PORT.
+
+	Each worker binds the port with SO_REUSEPORT, so the kernel hashes every sender
+	to one worker and fan-out runs on as many cores as there are workers. Fan-out
+	needs the whole table, so every registration change is sent to every worker
+	over its control pipe; the parent keeps a copy to seed workers started late.
+	"""
+
+	def __init__(self, host: str, workers: int) -> None:
+		if not reuse_port_supported():
+			raise ValueError("relay workers need SO_REUSEPORT, which this platform lacks")
+		self.host = host
+		self.workers = workers
+		self.lock = threading.Lock()
+		self.clients: Dict[Addr, Tuple[Addr, str]] = {}
+		self.wants: Dict[Addr, int] = {}
+		self.subscriptions: Dict[Addr, Dict[Addr, int]] = {}
+		self.last_n = 0
+		self.speakers: Dict[str, List[Addr]] = {}
+		self.pipes: List[Connection] = []
+		self.processes: List[multiprocessing.Process] = []
+		self.running = False
+		# spawn, not fork: the parent is multithreaded by the time run() is called
+		self._ctx = multiprocessing.get_context("spawn")
+
+	def register_client(self, client_addr: Addr, video_recv_addr: Addr, room: str = DEFAULT_ROOM) -> None:
+		with self.lock:
+			self.clients[client_addr] = (video_recv_addr, room)
+			self._send_all(("register", client_addr, video_recv_addr, room))
+
+	def unregister_client(self, client_addr: Addr) -> None:
+		with self.lock:
+			self.wants.pop(client_addr, None)
+			self.subscriptions.pop(client_addr, None)
+			if self.clients.pop(client_addr, None) is not None:
+				self._send_all(("unregister", client_addr))
+
+	def set_layer(self, client_addr: Addr, layer: int) -> None:
+		with self.lock:
+			if client_addr in self.clients:
+				self.wants[client_addr] = layer
+				self._send_all(("layer", client_addr, layer))
+
+	def subscribe(self, client_addr: Addr, streams: Optional[Dict[Addr, int]]) -> None:
+		with self.lock:
+			if client_addr not in self.clients:
+				return
+			if streams is None:
+				self.subscriptions.pop(client_addr, None)
+			else:
+				self.subscriptions[client_addr] = dict(streams)
+			self._send_all(("subscribe", client_addr, streams))
+
+	def set_last_n(self, n: int) -> None:
+		with self.lock:
+			self.last_n = n
+			self._send_all(("last_n", n))
+
+	def set_speakers(self, room: str, senders: List[Addr]) -> None:
+		with self.lock:
+			if senders:
+				self.speakers[room] = list(senders)
+			else:
+				self.speakers.pop(room, None)
+			self._send_all(("speakers", room, senders))
+
+	def set_mosaic(self, client_addr: Addr, enabled: bool) -> None:
+		# mosaic composition needs every stream of a room in one process; clients keep individual streams
+		pass
+
+	def run(self) -> None:
+		self.running = True
+		with self.lock:
+			for _ in range(self.workers):
+				recv_conn, send_conn = self._ctx.Pipe(duplex=False)
+				proc = self._ctx.Process(target=_video_worker, args=(self.host, recv_conn), daemon=True)
+				proc.start()
+				recv_conn.close()
+				for key, (target, room) in self.clients.items():
+					send_conn.send(("register", key, target, room))
+				for key, layer in self.wants.items():
+					send_conn.send(("layer", key, layer))
+				for key, streams in self.subscriptions.items():
+					send_conn.send(("subscribe", key, streams))
+				if self.last_n:
+					send_conn.send(("last_n", self.last_n))
+				for room, senders in self.speakers.items():
+					send_conn.send(("speakers", room, senders))
+				self.pipes.append(send_conn)
+				self.processes.append(proc)
+		print(f"Video relay running on {self.workers} worker processes")
+		for proc in self.processes:
+			proc.join()
+
+	def stop(self) -> None:
+		self.running = False
+		with self.lock:
+			self._send_all(("stop",))
+			pipes, self.pipes = self.pipes, []
+		for proc in self.processes:
+			proc.join(WORKER_STOP_TIMEOUT)
+			if proc.is_alive():
+				proc.terminate()
+		for conn in pipes:
+			conn.close()
+
+	def _send_all(self, op: Tuple[Any, ...]) -> None:
+		for conn in list(self.pipes):
+			try:
+				conn.send(op)
+			except OSError:
+				# the worker is gone; the kernel no longer routes datagrams to its socket
+				self.pipes.remove(conn)
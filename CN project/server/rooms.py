@@ -0,0 +1,78 @@
+import hashlib
+import os
+import re
+import socket
+import threading
+from typing import Any, Dict, List, Optional
+
+from server.chat_history import ChatHistory
+from server.roster import Roster
+
+_UNSAFE_ROOM_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+# Directory names keep this much of the room name, for people browsing the history dir ...
+_ROOM_DIR_PREFIX = 32
+# ... and end in this many hex digits of its SHA-256, which is what keeps them apart.
+_ROOM_DIR_HASH = 16
+
+
+def room_dirname(name: str) -> str:
+	"""Filesystem-safe directory name for a room's chat history, distinct per name."""
+	digest = hashlib.sha256(name.encode("utf-8")).hexdigest()[:_ROOM_DIR_HASH]
+	return f"{_UNSAFE_ROOM_CHARS.sub('_', name[:_ROOM_DIR_PREFIX])}-{digest}"
+
+
+class Room:
+	"""One meeting: its joined sessions, roster and chat history.
+
+	``lock`` guards all of it. Callers hold it around membership changes, roster
+	flushes and chat so seqs and versions reach every session in order; sends
+	made under it only enqueue, so it is never held across blocking I/O.
+	"""
+
+	def __init__(self, name: str, history_dir: str) -> None:
+		self.name = name
+		self.lock = threading.Lock()
+		self.sessions: Dict[socket.socket, Any] = {}
+		self.roster = Roster()
+		self.history = ChatHistory(os.path.join(history_dir, room_dirname(name)))
+		self.refs = 0
+
+
+class RoomRegistry:
+	"""Rooms by name, created on first join and dropped once the last session leaves."""
+
+	def __init__(self, history_dir: str) -> None:
+		self.history_dir = history_dir
+		self.lock = threading.Lock()
+		self.rooms: Dict[str, Room] = {}
+
+	def join(self, name: str) -> Room:
+		with self.lock:
+			room = self.rooms.get(name)
+			if room is None:
+				room = self.rooms[name] = Room(name, self.history_dir)
+			room.refs += 1
+			return room
+
+	def leave(self, room: Room) -> None:
+		with self.lock:
+			room.refs -= 1
+			if room.refs > 0 or self.rooms.get(room.name) is not room:
+				return
+			del self.rooms[room.name]
+		room.history.close()
+
+	def get(self, name: str) -> Optional[Room]:
+		with self.lock:
+			return self.rooms.get(name)
+
+	def snapshot(self) -> List[Room]:
+		with self.lock:
+			return list(self.rooms.values())
+
+	def close(self) -> None:
+		with self.lock:
+			rooms = list(self.rooms.values())
+			self.rooms.clear()
+		for room in rooms:
+			room.history.close()
@@ -0,0 +1,59 @@
+from typing import Any, Dict, List, Set
+
+# Seconds between presence delta broadcasts; joins and leaves in between are coalesced.
+PRESENCE_BATCH_INTERVAL = 0.5
+
+
+class Roster:
+	"""Authoritative participant list with coalesced, versioned deltas.
+
+	Not thread-safe on its own; ControlServer calls it under its state lock.
+	Snapshots reflect the current membership and deltas are idempotent (keyed by
+	member id), so a snapshot followed by the next delta is always consistent.
+	A snapshot taken while changes are pending seals them into a delta of their
+	own and carries its version, so its receiver skips that delta rather than
+	hearing again about members the snapshot already listed; later changes go
+	into the delta after it.
+	"""
+
+	def __init__(self) -> None:
+		self.members: Dict[str, str] = {}
+		self.version = 0
+		self._joined: Dict[str, str] = {}
+		self._left: Set[str] = set()
+		# deltas already versioned by a snapshot, waiting for the next flush
+		self._sealed: List[Dict[str, Any]] = []
+
+	def join(self, member_id: str, username: str) -> None:
+		self.members[member_id] = username
+		self._joined[member_id] = username
+
+	def leave(self, member_id: str) -> None:
+		if self.members.pop(member_id, None) is None:
+			return
+		# a join that was never announced cancels out instead of becoming two deltas
+		if self._joined.pop(member_id, None) is None:
+			self._left.add(member_id)
+
+	def snapshot(self) -> Dict[str, Any]:
+		self._seal()
+		members = [{"id": k, "username": v} for k, v in self.members.items()]
+		return {"version": self.version, "members": members}
+
+	def flush(self) -> List[Dict[str, Any]]:
+		"""Changes since the last flush as versioned deltas, oldest first; empty if nothing changed."""
+		self._seal()
+		deltas, self._sealed = self._sealed, []
+		return deltas
+
+	def _seal(self) -> None:
+		if not self._joined and not self._left:
+			return
+		self.version += 1
+		self._sealed.append({
+			"version": self.version,
+			"joined": [{"id": k, "username": v} for k, v in self._joined.items()],
+			"left": list(self._left),
+		})
+		self._joined = {}
+		self._left = set()
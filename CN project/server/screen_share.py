@@ -4,6 +4,11 @@ import threading
 from typing import Dict, Optional, Tuple
 
 from common.constants import SCREEN_TCP_PORT
+from common.protocol import DEFAULT_ROOM, SCREEN_PRESENT, SCREEN_PRESENT_ROOM, SCREEN_VIEWER, SCREEN_VIEWER_ROOM
+from server.event_loop import EventLoop, Listener, StreamConnection
+
+# Event-loop viewers skip frames instead of queueing more than this many bytes.
+VIEWER_MAX_BACKLOG = 4 * 1024 * 1024
 
 
 class ScreenShareServer:
@@ -12,10 +17,12 @@ class ScreenShareServer:
 		self.port = SCREEN_TCP_PORT
 		self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		# one presenter slot and one viewer set per room
 		self.presenter_lock = threading.Lock()
-		self.presenter: Optional[socket.socket] = None
+		self.presenters: Dict[str, socket.socket] = {}
 		self.viewers_lock = threading.Lock()
-		self.viewers: Dict[socket.socket, Tuple[str, int]] = {}
+		self.viewers: Dict[socket.socket, str] = {}
+		self.viewer_conns: Dict["ScreenConnection", str] = {}
 		self.running = False
 
 	def run(self) -> None:
@@ -27,6 +34,12 @@ class ScreenShareServer:
 			client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 			threading.Thread(target=self._client_loop, args=(client,), daemon=True).start()
 
+	def attach(self, loop: EventLoop) -> None:
+		self.server.bind((self.host, self.port))
+		self.server.listen(50)
+		self.running = True
+		Listener(loop, self.server, lambda sock, addr: ScreenConnection(self, loop, sock, addr))
+
 	def stop(self) -> None:
 		self.running = False
 		try:
@@ -37,12 +50,15 @@ class ScreenShareServer:
 	def _client_loop(self, sock: socket.socket) -> None:
 		try:
 			role_hdr = sock.recv(7)
-			if role_hdr == b"PRESENT":
-				self._presenter_loop(sock)
+			room = DEFAULT_ROOM
+			if role_hdr in (SCREEN_PRESENT_ROOM, SCREEN_VIEWER_ROOM):
+				room = self._recv_room(sock)
+			if role_hdr in (SCREEN_PRESENT, SCREEN_PRESENT_ROOM):
+				self._presenter_loop(sock, room)
 				return
-			elif role_hdr == b"VIEWER\n":
+			elif role_hdr in (SCREEN_VIEWER, SCREEN_VIEWER_ROOM):
 				with self.viewers_lock:
-					self.viewers[sock] = sock.getpeername()
+					self.viewers[sock] = room
 				self._viewer_wait(sock)
 				return
 			else:
@@ -54,12 +70,40 @@ class ScreenShareServer:
 			except OSError:
 				pass
 
-	def _presenter_loop(self, sock: socket.socket) -> None:
+	def _recv_room(self, sock: socket.socket) -> str:
+		# [name_len u8][name bytes]
+		len_hdr = sock.recv(1)
+		if not len_hdr:
+			raise OSError("connection closed while reading room")
+		name_len = len_hdr[0]
+		name = b""
+		while len(name) < name_len:
+			chunk = sock.recv(name_len - len(name))
+			if not chunk:
+				raise OSError("connection closed while reading room")
+			name += chunk
+		try:
+			return name.decode("utf-8") or DEFAULT_ROOM
+		except UnicodeDecodeError:
+			# surfaces as a dropped connection through the caller's OSError path
+			raise OSError("room name is not valid UTF-8") from None
+
+	def claim_presenter(self, room: str, sock: socket.socket) -> bool:
 		with self.presenter_lock:
-			if self.presenter is not None:
-				sock.close()
-				return
-			self.presenter = sock
+			if room in self.presenters:
+				return False
+			self.presenters[room] = sock
+			return True
+
+	def release_presenter(self, room: str, sock: socket.socket) -> None:
+		with self.presenter_lock:
+			if self.presenters.get(room) is sock:
+				del self.presenters[room]
+
+	def _presenter_loop(self, sock: socket.socket, room: str) -> None:
+		if not self.claim_presenter(room, sock):
+			sock.close()
+			return
 		try:
 			while True:
 				len_hdr = sock.recv(4)
@@ -74,12 +118,11 @@ class ScreenShareServer:
 					buf.extend(chunk)
 				if len(buf) != frame_len:
 					break
-				self._broadcast_frame(bytes(buf))
+				self._broadcast_frame(bytes(buf), room)
 		except OSError:
 			pass
 		finally:
-			with self.presenter_lock:
-				self.presenter = None
+			self.release_presenter(room, sock)
 			try:
 				sock.close()
 			except OSError:
@@ -101,11 +144,79 @@ class ScreenShareServer:
 			except OSError:
 				pass
 
-	def _broadcast_frame(self, frame: bytes) -> None:
+	def _broadcast_frame(self, frame: bytes, room: str = DEFAULT_ROOM) -> None:
 		packet = struct.pack("!I", len(frame)) + frame
 		with self.viewers_lock:
-			for s in list(self.viewers.keys()):
+			for s, viewer_room in list(self.viewers.items()):
+				if viewer_room != room:
+					continue
 				try:
 					s.sendall(packet)
 				except OSError:
 					self.viewers.pop(s, None)
+			conns = [c for c, viewer_room in self.viewer_conns.items() if viewer_room == room]
+		for conn in conns:
+			if conn.out_bytes < VIEWER_MAX_BACKLOG:
+				conn.write(packet)
+
+
+class ScreenConnection(StreamConnection):
+	def __init__(self, server: ScreenShareServer, loop: EventLoop, sock: socket.socket, address: Tuple[str, int]) -> None:
+		super().__init__(loop, sock, address)
+		self.server = server
+		self.role: Optional[str] = None
+		self.room = DEFAULT_ROOM
+		self.buffer = bytearray()
+
+	def data_received(self, data: bytes) -> None:
+		if self.role == "viewer":
+			# viewers never send anything meaningful; the socket only signals liveness
+			return
+		self.buffer.extend(data)
+		if self.role is None and not self._read_role():
+			return
+		while len(self.buffer) >= 4:
+			(frame_len,) = struct.unpack_from("!I", self.buffer)
+			if len(self.buffer) < 4 + frame_len:
+				break
+			frame = bytes(self.buffer[4 : 4 + frame_len])
+			del self.buffer[: 4 + frame_len]
+			self.server._broadcast_frame(frame, self.room)
+
+	def _read_role(self) -> bool:
+		"""Consume the role header (and room, if any); True once the role is known."""
+		if len(self.buffer) < 7:
+			return False
+		role_hdr = bytes(self.buffer[:7])
+		header_len = 7
+		if role_hdr in (SCREEN_PRESENT_ROOM, SCREEN_VIEWER_ROOM):
+			if len(self.buffer) < 8 or len(self.buffer) < 8 + self.buffer[7]:
+				return False
+			try:
+				self.room = self.buffer[8 : 8 + self.buffer[7]].decode("utf-8") or DEFAULT_ROOM
+			except UnicodeDecodeError:
+				self.close()
+				return False
+			header_len = 8 + self.buffer[7]
+		del self.buffer[:header_len]
+		if role_hdr in (SCREEN_PRESENT, SCREEN_PRESENT_ROOM):
+			if not self.server.claim_presenter(self.room, self.sock):
+				self.close()
+				return False
+			self.role = "presenter"
+			return True
+		if role_hdr in (SCREEN_VIEWER, SCREEN_VIEWER_ROOM):
+			self.role = "viewer"
+			self.buffer.clear()
+			with self.server.viewers_lock:
+				self.server.viewer_conns[self] = self.room
+			return False
+		self.close()
+		return False
+
+	def connection_lost(self) -> None:
+		if self.role == "presenter":
+			self.server.release_presenter(self.room, self.sock)
+		elif self.role == "viewer":
+			with self.server.viewers_lock:
+				self.server.viewer_conns.pop(self, None)
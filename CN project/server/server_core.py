@@ -1,7 +1,10 @@
 import os
+import selectors
 import socket
 import threading
-from typing import Dict, Tuple
+import time
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from common.protocol import (
 	CHAT,
@@ -13,35 +16,203 @@ from common.protocol import (
 	PING,
 	PONG,
 	REGISTER_AV,
+	WELCOME,
+	HISTORY,
+	HISTORY_REQUEST,
+	ROSTER_SNAPSHOT,
+	ROSTER_DELTA,
+	VIDEO_LAYER,
+	VIDEO_SUBSCRIBE,
+	VIDEO_REPORT,
+	VIDEO_FEEDBACK,
+	AUDIO_FORMAT,
+	ACTIVE_SPEAKER,
+	FEATURE_ROSTER,
+	FEATURE_HEARTBEAT,
+	DEFAULT_ROOM,
+	MAX_ROOM_NAME,
+	CODEC_JSON,
+	encode_message,
 	make_message,
-	send_json_line,
-	recv_json_lines,
+	negotiate_codec,
+	LineFramer,
+	LineTooLongError,
 )
+from common.audio_codecs import negotiate_audio_format
+from common.media import AUDIO_PACKET_VERSION, MOSAIC_STREAM_NAME
 from server.av_udp import VideoRelay, AudioMixerRelay
+from server.chat_history import HISTORY_PAGE_MAX
+from server.roster import PRESENCE_BATCH_INTERVAL
+from server.relay_workers import VideoRelayPool
+from server.rooms import Room, RoomRegistry
+from server.timer_wheel import TimerWheel, WheelTimer
+from server.event_loop import EventLoop, Listener, StreamConnection
+from server.outbound import OutboundQueue, SessionWriter
 from server.screen_share import ScreenShareServer
 from server.file_transfer import FileTransferServer
 
 
+# Outbound bytes a session may have queued before it is evicted as a slow consumer.
+OUTBOUND_HIGH_WATER = 1024 * 1024
+# Seconds a session may stay unable to drain its queue before it is evicted.
+OUTBOUND_MAX_LAG = 10.0
+# Approximate byte budget for one HISTORY reply, keeping it under the framer's line limit.
+HISTORY_REPLY_BYTES = 48 * 1024
+# Heartbeat sessions idle this long are sent a PING ...
+HEARTBEAT_INTERVAL = 2.0
+# ... and are dropped, media registrations included, once idle this long.
+HEARTBEAT_TIMEOUT = 6.0
+
+
 class ClientSession:
-	def __init__(self, sock: socket.socket, address: Tuple[str, int]) -> None:
+	def __init__(
+		self,
+		sock: socket.socket,
+		address: Tuple[str, int],
+		outbound: Union[OutboundQueue, StreamConnection],
+		high_water: int = OUTBOUND_HIGH_WATER,
+		max_lag: float = OUTBOUND_MAX_LAG,
+	) -> None:
 		self.sock = sock
 		self.address = address
+		self.session_id = f"{address[0]}:{address[1]}"
 		self.username = ""
-		self.buffer = bytearray()
+		self.room: Optional[Room] = None
+		self.features: set = set()
+		self.codec = CODEC_JSON
+		self.framer = LineFramer()
+		self.outbound = outbound
+		self.high_water = high_water
+		self.max_lag = max_lag
+		self.evicted = False
+		self.last_seen = time.monotonic()
+		self.heartbeat: Optional[WheelTimer] = None
+		# "video"/"audio" -> relay registration key, released when the session goes away
+		self.media: Dict[str, Tuple[str, int]] = {}
+		# roster id -> priority of the video streams this session asked for; None: everyone in the room
+		self.video_subscription: Optional[Dict[str, int]] = None
+		# receive the room's server-composited mosaic instead of individual streams
+		self.video_mosaic = False
+
+	def send(self, message: dict) -> None:
+		self.send_bytes(encode_message(message, self.codec))
+
+	def send_bytes(self, data: bytes) -> None:
+		"""Queue pre-encoded data; never blocks. Sessions that fall too far behind are evicted."""
+		if self.evicted:
+			return
+		out = self.outbound
+		lagging = out.stalled_since is not None and time.monotonic() - out.stalled_since > self.max_lag
+		if lagging or out.out_bytes + len(data) > self.high_water:
+			self.evict()
+			return
+		out.write(data)
+
+	def evict(self, reason: str = "slow client") -> None:
+		if self.evicted:
+			return
+		self.evicted = True
+		print(f"Evicting {reason} {self.address} ({self.outbound.out_bytes} bytes queued)")
+		# abort() defers the actual teardown, so this is safe from inside a broadcast
+		self.outbound.abort()
+
+	def close(self) -> None:
+		self.outbound.close()
+
+
+def _is_legacy(session: ClientSession) -> bool:
+	return FEATURE_ROSTER not in session.features
+
+
+class ControlConnection(StreamConnection):
+	def __init__(self, server: "ControlServer", loop: EventLoop, sock: socket.socket, address: Tuple[str, int]) -> None:
+		super().__init__(loop, sock, address)
+		self.server = server
+		self.session = ClientSession(sock, address, self, server.outbound_high_water, server.outbound_max_lag)
+
+	def handle_read(self) -> None:
+		# read straight into the session framer instead of going through data_received
+		try:
+			n = self.session.framer.recv_from(self.sock)
+		except (BlockingIOError, InterruptedError):
+			return
+		except OSError:
+			self.close()
+			return
+		if not n:
+			self.close()
+			return
+		self._dispatch(None)
+
+	def data_received(self, data: bytes) -> None:
+		self._dispatch(data)
+
+	def _dispatch(self, data: Optional[bytes]) -> None:
+		framer = self.session.framer
+		too_long = False
+		try:
+			messages = framer.messages() if data is None else framer.feed(data)
+		except LineTooLongError as exc:
+			messages = exc.messages
+			too_long = True
+		for obj in messages:
+			if self.closed:
+				break
+			self.server._handle_message(self.session, obj)
+		if too_long and not self.closed:
+			print(f"Dropping client {self.address}: control line too long")
+			self.close()
+
+	def connection_lost(self) -> None:
+		print(f"Client disconnected: {self.address}")
+		self.server._remove_client(self.session)
 
 
 class ControlServer:
-	def __init__(self, host: str, port: int) -> None:
+	def __init__(
+		self,
+		host: str,
+		port: int,
+		outbound_high_water: int = OUTBOUND_HIGH_WATER,
+		outbound_max_lag: float = OUTBOUND_MAX_LAG,
+		history_dir: str = os.path.join("storage", "chat"),
+		presence_interval: float = PRESENCE_BATCH_INTERVAL,
+		relay_workers: int = 0,
+		heartbeat_interval: float = HEARTBEAT_INTERVAL,
+		heartbeat_timeout: float = HEARTBEAT_TIMEOUT,
+		mosaic_workers: int = 0,
+		last_n: int = 0,
+	) -> None:
+		if mosaic_workers > 0 and relay_workers > 0:
+			raise ValueError("mosaic mode needs the in-process video relay (relay_workers=0)")
 		self.host = host
 		self.port = port
+		self.outbound_high_water = outbound_high_water
+		self.outbound_max_lag = outbound_max_lag
+		self.rooms = RoomRegistry(history_dir)
+		self.presence_interval = presence_interval
+		self.heartbeat_interval = heartbeat_interval
+		self.heartbeat_timeout = heartbeat_timeout
+		self.timers = TimerWheel()
 		self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 		self.clients_lock = threading.Lock()
 		self.clients: Dict[socket.socket, ClientSession] = {}
 		self.running = False
+		self.loop: Optional[EventLoop] = None
+		self.writer = SessionWriter()
 
-		self.video_relay = VideoRelay(self.host)
+		self.video_relay: Union[VideoRelay, VideoRelayPool]
+		if relay_workers > 0:
+			self.video_relay = VideoRelayPool(self.host, relay_workers)
+		else:
+			self.video_relay = VideoRelay(self.host)
+			if mosaic_workers > 0:
+				self.video_relay.enable_mosaic(mosaic_workers)
+		if last_n > 0:
+			self.video_relay.set_last_n(last_n)
 		self.audio_relay = AudioMixerRelay(self.host)
+		self.audio_relay.on_speaker = self._on_active_speaker
 		self.screen_share = ScreenShareServer(self.host)
 		self.file_server = FileTransferServer(self.host, storage_dir=os.path.join("storage", "files"))
 
@@ -55,6 +226,8 @@ class ControlServer:
 		threading.Thread(target=self.audio_relay.run, daemon=True).start()
 		threading.Thread(target=self.screen_share.run, daemon=True).start()
 		threading.Thread(target=self.file_server.run, daemon=True).start()
+		self.writer.start()
+		self._start_timers()
 
 		accept_thread = threading.Thread(target=self._accept_loop, daemon=True)
 		accept_thread.start()
@@ -65,6 +238,27 @@ class ControlServer:
 		finally:
 			self.shutdown()
 
+	def run_event_loop(self) -> None:
+		"""Serve control, screen-share and file sockets from one selectors loop instead of a thread each."""
+		self.loop = EventLoop()
+		self.server_sock.bind((self.host, self.port))
+		self.server_sock.listen(1024)
+		self.running = True
+		print(f"Server listening on {self.host}:{self.port} (event loop)")
+
+		threading.Thread(target=self.video_relay.run, daemon=True).start()
+		threading.Thread(target=self.audio_relay.run, daemon=True).start()
+		Listener(self.loop, self.server_sock, self._accept_connection)
+		self.screen_share.attach(self.loop)
+		self.file_server.attach(self.loop)
+		self._start_timers()
+		try:
+			self.loop.run()
+		except KeyboardInterrupt:
+			print("Shutting down server...")
+		finally:
+			self.shutdown()
+
 	def shutdown(self) -> None:
 		self.running = False
 		with self.clients_lock:
@@ -79,6 +273,52 @@ class ControlServer:
 		self.audio_relay.stop()
 		self.screen_share.stop()
 		self.file_server.stop()
+		self.writer.stop()
+		self.rooms.close()
+		if self.loop is not None:
+			self.loop.stop()
+			self.loop.close()
+
+	def _start_timers(self) -> None:
+		self._every(self.presence_interval, self._flush_presence)
+		self._every(self.timers.tick, self.timers.advance)
+
+	def _every(self, interval: float, fn: Callable[[], None]) -> None:
+		"""Run fn periodically on the event loop, or on a timer thread in threaded mode."""
+		loop = self.loop
+		if loop is not None:
+			def tick() -> None:
+				# the loop logs an exception from fn; the schedule must survive it
+				try:
+					fn()
+				finally:
+					loop.call_later(interval, tick)
+
+			loop.call_later(interval, tick)
+			return
+
+		def run() -> None:
+			while self.running:
+				time.sleep(interval)
+				try:
+					fn()
+				except Exception:
+					traceback.print_exc()
+
+		threading.Thread(target=run, daemon=True).start()
+
+	def _flush_presence(self) -> None:
+		for room in self.rooms.snapshot():
+			with room.lock:
+				for delta in room.roster.flush():
+					self._broadcast(room, make_message(ROSTER_DELTA, delta), where=lambda sess: FEATURE_ROSTER in sess.features)
+
+	def _accept_connection(self, client_sock: socket.socket, addr: Tuple[str, int]) -> None:
+		assert self.loop is not None
+		conn = ControlConnection(self, self.loop, client_sock, addr)
+		with self.clients_lock:
+			self.clients[client_sock] = conn.session
+		print(f"Client connected: {addr}")
 
 	def _accept_loop(self) -> None:
 		while self.running:
@@ -87,83 +327,326 @@ class ControlServer:
 			except OSError:
 				break
 			client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-			session = ClientSession(client_sock, addr)
+			outbound = OutboundQueue(client_sock, self.writer)
+			session = ClientSession(client_sock, addr, outbound, self.outbound_high_water, self.outbound_max_lag)
 			with self.clients_lock:
 				self.clients[client_sock] = session
 			threading.Thread(target=self._client_loop, args=(session,), daemon=True).start()
 
 	def _remove_client(self, session: ClientSession) -> None:
 		with self.clients_lock:
-			if session.sock in self.clients:
-				username = self.clients[session.sock].username
-				del self.clients[session.sock]
-				if username:
-					self._broadcast(make_message(USER_LEFT, {"username": username}))
-		try:
-			session.sock.close()
-		except OSError:
-			pass
+			removed = self.clients.pop(session.sock, None)
+		room = session.room
+		if removed is not None and room is not None:
+			with room.lock:
+				room.sessions.pop(session.sock, None)
+				room.roster.leave(session.session_id)
+				self._broadcast(room, make_message(USER_LEFT, {"username": session.username}), where=_is_legacy)
+			session.room = None
+			self.rooms.leave(room)
+		if session.heartbeat is not None:
+			session.heartbeat.cancel()
+		self._release_media(session)
+		session.close()
 
-	def _broadcast(self, message: dict, exclude: socket.socket | None = None) -> None:
-		with self.clients_lock:
-			for s, sess in list(self.clients.items()):
-				if exclude is not None and s is exclude:
+	def _release_media(self, session: ClientSession) -> None:
+		key = session.media.pop("video", None)
+		if key is not None:
+			self.video_relay.unregister_client(key)
+		key = session.media.pop("audio", None)
+		if key is not None:
+			self.audio_relay.unregister_client(key)
+
+	def _register_media(self, session: ClientSession, kind: str, key: Tuple[str, int], room_name: str) -> None:
+		relay = self.video_relay if kind == "video" else self.audio_relay
+		old = session.media.get(kind)
+		if old is not None and old != key:
+			relay.unregister_client(old)
+		session.media[kind] = key
+		relay.register_client(key, key, room_name)
+
+	def _apply_subscription(self, session: ClientSession) -> None:
+		key = session.media.get("video")
+		room = session.room
+		if key is None or room is None:
+			return
+		self.video_relay.set_mosaic(key, session.video_mosaic)
+		wanted = session.video_subscription
+		if wanted is None:
+			self.video_relay.subscribe(key, None)
+			return
+		with room.lock:
+			by_id = {s.session_id: s for s in room.sessions.values()}
+		streams = {}
+		for member_id, priority in wanted.items():
+			sender = by_id.get(member_id)
+			if sender is not None and "video" in sender.media:
+				streams[sender.media["video"]] = priority
+		self.video_relay.subscribe(key, streams)
+
+	def _route_reports(self, session: ClientSession, room: Room, reports: object) -> None:
+		"""Pass a receiver's per-stream reports on to the senders they describe (by username)."""
+		if not isinstance(reports, list):
+			return
+		with room.lock:
+			senders: Dict[str, list] = {}
+			for s in room.sessions.values():
+				if s is not session and "video" in s.media:
+					senders.setdefault(s.username, []).append(s)
+			for report in reports:
+				if not isinstance(report, dict):
+					continue
+				targets = senders.get(str(report.get("sender", "")))
+				if not targets:
 					continue
 				try:
-					send_json_line(s, message)
-				except OSError:
-					pass
+					feedback = {
+						"from": session.session_id,
+						"layer": int(report.get("layer", 0)),
+						"fraction_lost": float(report.get("fraction_lost", 0.0)),
+						"jitter_ms": float(report.get("jitter_ms", 0.0)),
+						"bitrate_kbps": float(report.get("bitrate_kbps", 0.0)),
+					}
+				except (TypeError, ValueError):
+					continue
+				for target in targets:
+					target.send(make_message(VIDEO_FEEDBACK, feedback))
+
+	def _on_active_speaker(self, room_name: str, speaker: Tuple[str, int], recent: List[Tuple[str, int]]) -> None:
+		"""Mixer callback: announce room_name's new dominant speaker and re-rank its video for last-N."""
+		room = self.rooms.get(room_name)
+		if room is None:
+			return
+		with room.lock:
+			by_audio = {s.media["audio"]: s for s in room.sessions.values() if "audio" in s.media}
+			current = by_audio.get(speaker)
+			if current is None:
+				return
+			speakers = [by_audio[key] for key in recent if key in by_audio]
+			self._broadcast(
+				room,
+				make_message(
+					ACTIVE_SPEAKER,
+					{"id": current.session_id, "username": current.username, "recent": [s.session_id for s in speakers]},
+				),
+			)
+			senders = [s.media["video"] for s in speakers if "video" in s.media]
+		self.video_relay.set_speakers(room_name, senders)
+
+	def _check_heartbeat(self, session: ClientSession) -> None:
+		"""Wheel callback: PING an idle heartbeat session, evict it once silent past the timeout."""
+		if session.evicted or session.room is None:
+			return
+		idle = time.monotonic() - session.last_seen
+		if idle >= self.heartbeat_timeout:
+			session.evict("unresponsive client")
+			return
+		if idle >= self.heartbeat_interval:
+			session.send(make_message(PING, {}))
+			delay = min(self.heartbeat_interval, self.heartbeat_timeout - idle)
+		else:
+			delay = self.heartbeat_interval - idle
+		session.heartbeat = self.timers.schedule(delay, lambda: self._check_heartbeat(session))
+
+	def _broadcast(
+		self,
+		room: Room,
+		message: dict,
+		exclude: socket.socket | None = None,
+		where: Optional[Callable[[ClientSession], bool]] = None,
+	) -> None:
+		"""Send to every session in room; the caller holds room.lock."""
+		encoded: Dict[str, bytes] = {}
+		for s, sess in room.sessions.items():
+			if (exclude is not None and s is exclude) or (where is not None and not where(sess)):
+				continue
+			# encode once per codec, not once per recipient
+			data = encoded.get(sess.codec)
+			if data is None:
+				data = encoded[sess.codec] = encode_message(message, sess.codec)
+			sess.send_bytes(data)
 
 	def _client_loop(self, session: ClientSession) -> None:
 		print(f"Client connected: {session.address}")
+		# the socket is non-blocking so OutboundQueue can write to it without stalling; wait with
+		# a selector (epoll/kqueue where available), which has no FD_SETSIZE limit unlike select()
+		waiter = selectors.DefaultSelector()
 		try:
+			waiter.register(session.sock, selectors.EVENT_READ)
 			while True:
-				chunk = session.sock.recv(4096)
-				if not chunk:
+				waiter.select()
+				try:
+					n = session.framer.recv_from(session.sock)
+				except (BlockingIOError, InterruptedError):
+					continue
+				if not n:
 					break
-				session.buffer.extend(chunk)
-				while True:
-					obj, session.buffer = recv_json_lines(session.buffer)
-					if obj is None:
-						break
+				try:
+					messages = session.framer.messages()
+				except LineTooLongError as exc:
+					for obj in exc.messages:
+						self._handle_message(session, obj)
+					raise
+				for obj in messages:
 					self._handle_message(session, obj)
-		except OSError:
+		except LineTooLongError:
+			print(f"Dropping client {session.address}: control line too long")
+		except (OSError, ValueError):
 			pass
 		finally:
+			waiter.close()
 			print(f"Client disconnected: {session.address}")
 			self._remove_client(session)
 
 	def _handle_message(self, session: ClientSession, msg: dict) -> None:
+		session.last_seen = time.monotonic()
 		type_ = msg.get("type")
 		payload = msg.get("payload", {})
 		if type_ == HELLO:
 			username = str(payload.get("username", "")).strip()
 			if not username:
-				send_json_line(session.sock, make_message(ERROR, {"message": "Username required"}))
+				session.send(make_message(ERROR, {"message": "Username required"}))
+				return
+			if username == MOSAIC_STREAM_NAME:
+				session.send(make_message(ERROR, {"message": "Username reserved"}))
 				return
-			session.username = username
-			self._broadcast(make_message(USER_JOINED, {"username": username}), exclude=None)
+			room = session.room
+			if room is None:
+				room_name = str(payload.get("room") or DEFAULT_ROOM).strip() or DEFAULT_ROOM
+				if len(room_name) > MAX_ROOM_NAME:
+					session.send(make_message(ERROR, {"message": "Room name too long"}))
+					return
+				room = self.rooms.join(room_name)
+				with room.lock:
+					# WELCOME goes out in JSON; everything after it uses the negotiated codec.
+					# Chat up to history_seq is fetched with HISTORY_REQUEST, later chat arrives live.
+					codec = negotiate_codec(payload.get("codecs"))
+					welcome = {
+						"message": f"Welcome, {username}",
+						"codec": codec,
+						"room": room.name,
+						"history_seq": room.history.last_seq,
+					}
+					session.send(make_message(WELCOME, welcome))
+					session.codec = codec
+					features = payload.get("features")
+					if isinstance(features, list):
+						session.features = {str(f) for f in features}
+					session.room = room
+					room.sessions[session.sock] = session
+				if FEATURE_HEARTBEAT in session.features:
+					session.heartbeat = self.timers.schedule(self.heartbeat_interval, lambda: self._check_heartbeat(session))
+			with room.lock:
+				session.username = username
+				# Roster clients get one snapshot now and batched deltas after; legacy
+				# clients keep receiving an individual USER_JOINED per join.
+				room.roster.join(session.session_id, username)
+				if FEATURE_ROSTER in session.features:
+					session.send(make_message(ROSTER_SNAPSHOT, room.roster.snapshot()))
+				self._broadcast(room, make_message(USER_JOINED, {"username": username}), exclude=None, where=_is_legacy)
 			return
 		if type_ == CHAT:
 			text = str(payload.get("text", ""))
-			if not session.username:
-				send_json_line(session.sock, make_message(ERROR, {"message": "Send HELLO first"}))
+			room = session.room
+			if room is None:
+				session.send(make_message(ERROR, {"message": "Send HELLO first"}))
 				return
-			self._broadcast(
-				make_message(CHAT_BROADCAST, {"username": session.username, "text": text}),
-				exclude=None,
-			)
+			with room.lock:
+				record = room.history.append(session.username, text)
+				self._broadcast(
+					room,
+					make_message(CHAT_BROADCAST, {"seq": record["seq"], "username": session.username, "text": text}),
+					exclude=None,
+				)
+			return
+		if type_ == HISTORY_REQUEST:
+			if session.room is None:
+				session.send(make_message(ERROR, {"message": "Send HELLO first"}))
+				return
+			self._send_history(session, session.room, payload)
 			return
 		if type_ == REGISTER_AV:
+			if session.room is None:
+				session.send(make_message(ERROR, {"message": "Send HELLO first"}))
+				return
 			v_port = int(payload.get("video_port", 0))
 			a_port = int(payload.get("audio_port", 0))
-			client_addr = session.sock.getpeername()
+			client_addr = session.address
+			room_name = session.room.name
 			if v_port:
-				self.video_relay.register_client((client_addr[0], v_port), (client_addr[0], v_port))
+				self._register_media(session, "video", (client_addr[0], v_port), room_name)
+				# subscriptions name roster ids; resolve them again now this sender has a relay key
+				with session.room.lock:
+					subscribers = [s for s in session.room.sessions.values() if s.video_subscription is not None]
+				for subscriber in subscribers:
+					self._apply_subscription(subscriber)
 			if a_port:
-				self.audio_relay.register_client((client_addr[0], a_port), (client_addr[0], a_port))
+				key = (client_addr[0], a_port)
+				self._register_media(session, "audio", key, room_name)
+				if payload.get("audio_header") == AUDIO_PACKET_VERSION:
+					codec, rate = negotiate_audio_format(payload.get("audio_codecs"), payload.get("audio_rates"))
+					self.audio_relay.set_format(key, codec, rate, bool(payload.get("audio_fec")))
+					session.send(make_message(AUDIO_FORMAT, {"codec": codec, "rate": rate}))
+				else:
+					self.audio_relay.set_format(key, None)
+			return
+		if type_ == VIDEO_SUBSCRIBE:
+			if session.room is None:
+				session.send(make_message(ERROR, {"message": "Send HELLO first"}))
+				return
+			session.video_mosaic = bool(payload.get("mosaic"))
+			streams = payload.get("streams")
+			if payload.get("all") or not isinstance(streams, list):
+				session.video_subscription = None
+			else:
+				session.video_subscription = {
+					str(s.get("id")): int(s.get("priority", 0)) for s in streams if isinstance(s, dict)
+				}
+			self._apply_subscription(session)
+			return
+		if type_ == VIDEO_REPORT:
+			if session.room is not None:
+				self._route_reports(session, session.room, payload.get("reports"))
+			return
+		if type_ == VIDEO_LAYER:
+			key = session.media.get("video")
+			if key is not None:
+				self.video_relay.set_layer(key, int(payload.get("layer", 0)))
 			return
 		if type_ == PING:
-			send_json_line(session.sock, make_message(PONG, {}))
+			session.send(make_message(PONG, {}))
+			return
+		if type_ == PONG:
+			# answer to a heartbeat PING; last_seen is already refreshed
 			return
-		send_json_line(session.sock, make_message(ERROR, {"message": "Unknown type"}))
+		session.send(make_message(ERROR, {"message": "Unknown type"}))
+
+	def _send_history(self, session: ClientSession, room: Room, payload: dict) -> None:
+		history = room.history
+		limit = max(1, min(int(payload.get("limit") or HISTORY_PAGE_MAX), HISTORY_PAGE_MAX))
+		since = payload.get("since")
+		if since is not None:
+			messages = history.since(int(since), limit)
+		else:
+			before = payload.get("before")
+			messages = history.before(int(before) if before is not None else history.next_seq, limit)
+		# trim the page so the reply fits in one control line; the client pages again on has_more
+		budget = HISTORY_REPLY_BYTES
+		keep = 0
+		ordered = messages if since is not None else list(reversed(messages))
+		for record in ordered:
+			budget -= len(record["text"]) + len(record["username"]) + 64
+			if budget < 0 and keep:
+				break
+			keep += 1
+		if keep < len(messages):
+			messages = messages[:keep] if since is not None else messages[len(messages) - keep :]
+		# has_more: records remain beyond this page in the direction being paged
+		if not messages:
+			has_more = False
+		elif since is not None:
+			has_more = messages[-1]["seq"] < history.last_seq
+		else:
+			has_more = messages[0]["seq"] > history.first_seq
+		reply = {"messages": messages, "last_seq": history.last_seq, "has_more": has_more}
+		session.send(make_message(HISTORY, reply))
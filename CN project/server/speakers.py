@@ -0,0 +1,103 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+Addr = Tuple[str, int]
+
+# Each source's speech power is smoothed with this time constant, in seconds.
+SPEAKER_SMOOTHING = 0.3
+# A smoothed level at or above this counts as speaking.
+SPEAKER_MIN_DBFS = -45.0
+# The floor changes hands only to a speaker this much louder than the current one ...
+SPEAKER_SWITCH_DB = 3.0
+# ... and not within this many seconds of the last change, so crosstalk does not flap it.
+SPEAKER_MIN_HOLD = 1.0
+# Smoothed power (full scale = 1) below this, about -90 dBFS, is dropped to 0.
+_POWER_FLOOR = 1e-9
+
+
+class _RoomSpeakers:
+	def __init__(self) -> None:
+		self.speaker: Optional[Addr] = None
+		self.since = 0.0
+		# audio keys that have held the floor, most recent first
+		self.recent: List[Addr] = []
+
+
+class ActiveSpeakerDetector:
+	"""Dominant speaker per room from the chunks the mixer plays.
+
+	Not thread-safe on its own; AudioMixerRelay calls it from its mixer thread.
+	Each tick, every source's chunk power (0 for sources not in the mix, such as
+	those in DTX) goes into an exponential average. The loudest source above
+	SPEAKER_MIN_DBFS takes the floor if nobody holds it, or if it is
+	SPEAKER_SWITCH_DB louder than the holder and the holder has had it for
+	SPEAKER_MIN_HOLD. update() returns the changes as (room, speaker, recent).
+	"""
+
+	def __init__(self, interval: float) -> None:
+		self.alpha = min(1.0, interval / SPEAKER_SMOOTHING)
+		# audio key -> (room, smoothed power in full-scale units)
+		self.power: Dict[Addr, Tuple[str, float]] = {}
+		self.rooms: Dict[str, _RoomSpeakers] = {}
+
+	def update(self, active: Dict[str, List[Tuple[Addr, bytes]]], now: float) -> List[Tuple[str, Addr, List[Addr]]]:
+		alpha = self.alpha
+		observed: Dict[Addr, Tuple[str, float]] = {}
+		for room, chunks in active.items():
+			rows = np.frombuffer(b"".join(chunk for _, chunk in chunks), dtype=np.int16).reshape(len(chunks), -1)
+			power = np.einsum("ij,ij->i", rows, rows, dtype=np.float64) / (rows.shape[1] * 32768.0 * 32768.0)
+			for (addr, _), p in zip(chunks, power):
+				observed[addr] = (room, float(p))
+		for addr, (room, p) in list(self.power.items()):
+			if addr not in observed:
+				p -= alpha * p
+				self.power[addr] = (room, p if p > _POWER_FLOOR else 0.0)
+		for addr, (room, p) in observed.items():
+			previous = self.power.get(addr)
+			smoothed = previous[1] if previous is not None and previous[0] == room else 0.0
+			self.power[addr] = (room, smoothed + alpha * (p - smoothed))
+		return self._elect(now)
+
+	def forget(self, addr: Addr) -> None:
+		entry = self.power.pop(addr, None)
+		if entry is None:
+			return
+		state = self.rooms.get(entry[0])
+		if state is None:
+			return
+		if addr in state.recent:
+			state.recent.remove(addr)
+		if state.speaker == addr:
+			state.speaker = None
+		if not state.recent and not any(room == entry[0] for room, _ in self.power.values()):
+			del self.rooms[entry[0]]
+
+	def _elect(self, now: float) -> List[Tuple[str, Addr, List[Addr]]]:
+		loudest: Dict[str, Tuple[float, Addr]] = {}
+		levels: Dict[Addr, float] = {}
+		for addr, (room, p) in self.power.items():
+			if p <= 0.0:
+				continue
+			level = 10 * math.log10(p)
+			levels[addr] = level
+			if level >= SPEAKER_MIN_DBFS and (room not in loudest or level > loudest[room][0]):
+				loudest[room] = (level, addr)
+		changes = []
+		for room, (level, addr) in loudest.items():
+			state = self.rooms.get(room)
+			if state is None:
+				state = self.rooms[room] = _RoomSpeakers()
+			current = state.speaker
+			if current == addr:
+				continue
+			if current is not None and (now - state.since < SPEAKER_MIN_HOLD or level < levels.get(current, -math.inf) + SPEAKER_SWITCH_DB):
+				continue
+			state.speaker = addr
+			state.since = now
+			if addr in state.recent:
+				state.recent.remove(addr)
+			state.recent.insert(0, addr)
+			changes.append((room, addr, list(state.recent)))
+		return changes
@@ -0,0 +1,92 @@
+import threading
+import time
+import traceback
+from typing import Callable, List
+
+# Seconds per wheel tick; timers fire at most one tick late.
+TIMER_WHEEL_TICK = 0.1
+
+
+class WheelTimer:
+	__slots__ = ("expires", "callback", "cancelled")
+
+	def __init__(self, expires: int, callback: Callable[[], None]) -> None:
+		self.expires = expires
+		self.callback = callback
+		self.cancelled = False
+
+	def cancel(self) -> None:
+		# lazily skipped when its slot comes up
+		self.cancelled = True
+
+
+class TimerWheel:
+	"""Hierarchical timing wheel for large numbers of coarse timeouts.
+
+	Level 0 has one slot per tick; each higher level has one slot per full turn of
+	the level below, and its slot is cascaded down when that turn comes round.
+	schedule() and cancel() are O(1) and advance() only touches due slots, so
+	thousands of per-session deadlines cost nothing while they are pending.
+	Callbacks run on the thread calling advance(), outside the wheel's lock; one
+	that raises is logged and the rest still run.
+	"""
+
+	def __init__(self, tick: float = TIMER_WHEEL_TICK, slots: int = 64, levels: int = 4) -> None:
+		self.tick = tick
+		self.slots = slots
+		self.levels = levels
+		self.lock = threading.Lock()
+		self.wheels: List[List[List[WheelTimer]]] = [[[] for _ in range(slots)] for _ in range(levels)]
+		self.spans = [slots**level for level in range(levels + 1)]
+		self.current = 0
+		self.origin = time.monotonic()
+
+	def schedule(self, delay: float, callback: Callable[[], None]) -> WheelTimer:
+		with self.lock:
+			timer = WheelTimer(self.current + max(1, int(delay / self.tick + 0.999)), callback)
+			self._insert(timer)
+			return timer
+
+	def advance(self) -> None:
+		"""Fire every timer due by now."""
+		target = int((time.monotonic() - self.origin) / self.tick)
+		due: List[WheelTimer] = []
+		with self.lock:
+			while self.current < target:
+				self.current += 1
+				# top-down, so a cascade may land in a lower slot that is due this same tick
+				for level in range(self.levels - 1, 0, -1):
+					if self.current % self.spans[level] == 0:
+						self._cascade(level)
+				slot = self.current % self.slots
+				bucket = self.wheels[0][slot]
+				self.wheels[0][slot] = []
+				for timer in bucket:
+					if timer.cancelled:
+						continue
+					if timer.expires <= self.current:
+						due.append(timer)
+					else:
+						# parked beyond the top level's range; go round again
+						self._insert(timer)
+		for timer in due:
+			try:
+				timer.callback()
+			except Exception:
+				traceback.print_exc()
+
+	def _cascade(self, level: int) -> None:
+		slot = (self.current // self.spans[level]) % self.slots
+		bucket = self.wheels[level][slot]
+		self.wheels[level][slot] = []
+		for timer in bucket:
+			if not timer.cancelled:
+				self._insert(timer)
+
+	def _insert(self, timer: WheelTimer) -> None:
+		delta = timer.expires - self.current
+		level = 0
+		while level < self.levels - 1 and delta >= self.spans[level + 1]:
+			level += 1
+		slot = (timer.expires // self.spans[level]) % self.slots
+		self.wheels[level][slot].append(timer)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Ensure project root is on sys.path when pytest runs from elsewhere
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
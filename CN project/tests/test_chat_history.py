@@ -0,0 +1,92 @@
+import os
+
+from server.chat_history import INDEX_ENTRY, ChatHistory
+
+
+def _history(tmp_path, **kwargs):
+	# small segments, index interval and ring so every path is exercised with few records
+	options = {"ring_size": 5, "segment_bytes": 400, "index_interval": 4}
+	options.update(kwargs)
+	return ChatHistory(str(tmp_path), **options)
+
+
+def _fill(history, count):
+	for i in range(count):
+		history.append("alice", f"message {i + 1}")
+
+
+def _seqs(records):
+	return [r["seq"] for r in records]
+
+
+def test_segments_roll_over_and_index_sparsely(tmp_path):
+	history = _history(tmp_path)
+	_fill(history, 40)
+	assert len(history.segments) > 2
+	assert history.segment_bases == [s.base_seq for s in history.segments]
+	for segment in history.segments:
+		assert all((seq - segment.base_seq) % 4 == 0 for seq in segment.index_seqs)
+		assert os.path.getsize(segment.idx_path) == len(segment.index_seqs) * INDEX_ENTRY.size
+	history.close()
+
+
+def test_seek_offset_lands_on_the_indexed_record(tmp_path):
+	history = _history(tmp_path)
+	_fill(history, 40)
+	segment = history.segments[1]
+	with open(segment.log_path, "rb") as f:
+		data = f.read()
+	for seq in range(segment.base_seq, segment.base_seq + 8):
+		offset = segment.seek_offset(seq)
+		indexed = segment.index_seqs[segment.index_offsets.index(offset)]
+		assert indexed <= seq < indexed + 4
+		assert data[offset:].startswith(b'{"seq": %d,' % indexed)
+	history.close()
+
+
+def test_pages_from_disk_and_ring_agree(tmp_path):
+	history = _history(tmp_path)
+	_fill(history, 40)
+	assert _seqs(history.since(0, 10)) == list(range(1, 11))
+	assert _seqs(history.before(41, 3)) == [38, 39, 40]
+	# a page that starts on disk and ends in the ring
+	assert _seqs(history.since(30, 10)) == list(range(31, 41))
+	for first in range(0, 40):
+		page = history.since(first, 7)
+		assert _seqs(page) == list(range(first + 1, min(first + 8, 41)))
+		assert [r["text"] for r in page] == [f"message {s}" for s in _seqs(page)]
+	history.close()
+
+
+def test_pages_past_either_end(tmp_path):
+	history = _history(tmp_path)
+	_fill(history, 10)
+	assert history.since(10, 5) == []
+	assert history.before(1, 5) == []
+	assert _seqs(history.before(1000, 2)) == [9, 10]
+	history.close()
+
+
+def test_reload_continues_the_sequence(tmp_path):
+	history = _history(tmp_path)
+	_fill(history, 30)
+	history.close()
+	reopened = _history(tmp_path)
+	assert reopened.last_seq == 30
+	assert _seqs(reopened.ring) == list(range(26, 31))
+	assert reopened.append("bob", "after restart")["seq"] == 31
+	assert _seqs(reopened.since(0, 100)) == list(range(1, 32))
+	reopened.close()
+
+
+def test_reload_drops_a_torn_record(tmp_path):
+	history = _history(tmp_path, segment_bytes=1 << 20)
+	_fill(history, 6)
+	history.close()
+	with open(history.segments[-1].log_path, "ab") as f:
+		f.write(b'{"seq": 7, "us')
+	reopened = _history(tmp_path, segment_bytes=1 << 20)
+	assert reopened.last_seq == 6
+	assert reopened.append("bob", "next")["seq"] == 7
+	assert _seqs(reopened.since(5, 10)) == [6, 7]
+	reopened.close()
@@ -0,0 +1,33 @@
+import socket
+import threading
+
+from server.event_loop import EventLoop, StreamConnection
+
+
+class _Sink(StreamConnection):
+	def data_received(self, data):
+		pass
+
+
+def test_abort_from_another_thread_is_handed_to_the_loop():
+	loop = EventLoop()
+	loop.thread_id = threading.get_ident()
+	ours, peer = socket.socketpair()
+	conn = _Sink(loop, ours, ("127.0.0.1", 0))
+	conn._out.append(memoryview(b"queued"))
+	conn.out_bytes = 6
+
+	worker = threading.Thread(target=conn.abort)
+	worker.start()
+	worker.join()
+	# the buffer is still the loop thread's to touch; only new writes are refused
+	assert len(conn._out) == 1 and not conn.closed
+	conn.write(b"more")
+	assert len(conn._out) == 1
+
+	loop._run_pending()
+	assert not conn._out and conn.out_bytes == 0
+	loop._run_pending()
+	assert conn.closed
+	peer.close()
+	loop.close()
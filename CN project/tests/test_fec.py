@@ -0,0 +1,173 @@
+import os
+import random
+
+from common.fec import FEC_MIN_GROUP, VIDEO_FEC_MAX_GROUP, LossMeter, fec_group_size, xor_parity, xor_parity_interleaved, xor_recover
+from common.media import (
+	AUDIO_FEC_FORMAT,
+	AudioFecDecoder,
+	AudioFecEncoder,
+	FrameReassembler,
+	fragment_frame,
+	frame_parity,
+	pack_audio,
+	parse_audio,
+	sender_prefix,
+)
+
+
+def test_xor_recover_rebuilds_each_member():
+	packets = [os.urandom(n) for n in (40, 7, 0, 33)]
+	parity = xor_parity(packets)
+	for lost in range(len(packets)):
+		others = [p for i, p in enumerate(packets) if i != lost]
+		assert xor_recover(parity, others) == packets[lost]
+
+
+def test_xor_recover_rejects_malformed_parity():
+	assert xor_recover(b"\x00", []) is None
+	parity = xor_parity([b"ab", b"c"])
+	assert xor_recover(parity, [b"too long for it"]) is None
+
+
+def test_interleaved_parity_matches_per_group_parity():
+	chunk, groups = 10, 3
+	data = os.urandom(95)
+	chunks = [data[i : i + chunk] for i in range(0, len(data), chunk)]
+	expected = [xor_parity(chunks[g::groups]) for g in range(groups)]
+	actual = xor_parity_interleaved(data, chunk, groups)
+	for g in range(groups):
+		# bodies may differ only in zero padding past the longest member
+		assert xor_recover(actual[g], chunks[g::groups][1:]) == chunks[g]
+		assert actual[g][:2] == expected[g][:2]
+
+
+def test_group_size_shrinks_with_loss():
+	sizes = [fec_group_size(loss, 16) for loss in (0.0, 0.01, 0.05, 0.2)]
+	assert sizes == sorted(sizes, reverse=True)
+	assert sizes[0] == 16
+	assert sizes[-1] == FEC_MIN_GROUP
+
+
+def test_loss_meter_counts_gaps():
+	meter = LossMeter()
+	for seq in range(100):
+		if seq % 10 != 5:
+			meter.packet(seq)
+	assert 0.05 < meter.fraction < 0.1
+
+
+def _send(encoder, seqs, payload_size=20):
+	out = []
+	for seq in seqs:
+		packet = pack_audio(seq, seq * 960, os.urandom(payload_size), 0x82)
+		out.append((seq, packet))
+		parity = encoder.add(seq, packet)
+		if parity is not None:
+			out.append((None, parity))
+	return out
+
+
+def _receive(decoder, datagrams):
+	heard = {}
+	for _, datagram in datagrams:
+		seq, _, fmt, body = parse_audio(datagram)
+		if fmt == AUDIO_FEC_FORMAT:
+			recovered = decoder.add_parity(seq, body)
+		else:
+			heard[seq] = datagram
+			recovered = decoder.add(seq, datagram)
+		if recovered is not None:
+			heard[parse_audio(recovered)[0]] = recovered
+	return heard
+
+
+def test_audio_fec_recovers_one_loss_per_group():
+	datagrams = _send(AudioFecEncoder(3), range(9))
+	sent = {seq: d for seq, d in datagrams if seq is not None}
+	# lose seq 1 (first group) and seq 5 (second), keep every parity
+	kept = [(seq, d) for seq, d in datagrams if seq not in (1, 5)]
+	decoder = AudioFecDecoder()
+	assert _receive(decoder, kept) == sent
+	assert decoder.recovered == 2
+
+
+def test_audio_fec_recovers_when_parity_arrives_first():
+	datagrams = _send(AudioFecEncoder(2), range(2))
+	data, parity = [d for seq, d in datagrams if seq is not None], [d for seq, d in datagrams if seq is None]
+	decoder = AudioFecDecoder()
+	assert _receive(decoder, [(None, parity[0])]) == {}
+	heard = _receive(decoder, [(0, data[0])])
+	assert heard[1] == data[1]
+
+
+def test_audio_fec_gives_up_on_two_losses():
+	datagrams = _send(AudioFecEncoder(3), range(3))
+	kept = [(seq, d) for seq, d in datagrams if seq not in (0, 1)]
+	decoder = AudioFecDecoder()
+	assert set(_receive(decoder, kept)) == {2}
+	assert decoder.recovered == 0
+
+
+def test_audio_fec_flush_covers_a_short_group_across_wraparound():
+	encoder = AudioFecEncoder(3)
+	first = pack_audio(0xFFFF, 0, b"\x01" * 10, 0x82)
+	sid = pack_audio(0, 960, b"\x2a")
+	assert encoder.add(0xFFFF, first) is None
+	parity = encoder.add(0, sid, flush=True)
+	seq, _, fmt, body = parse_audio(parity)
+	assert (seq, fmt, body[0]) == (0xFFFF, AUDIO_FEC_FORMAT, 2)
+	decoder = AudioFecDecoder()
+	decoder.add(0, sid)
+	assert decoder.add_parity(seq, body) == first
+
+
+def test_audio_fec_ignores_malformed_parity():
+	decoder = AudioFecDecoder()
+	assert decoder.add_parity(0, b"") is None
+	assert decoder.add_parity(0, b"\x00\x00\x00") is None
+
+
+def test_audio_fec_random_single_losses():
+	rng = random.Random(3)
+	datagrams = _send(AudioFecEncoder(3), range(300))
+	sent = {seq: d for seq, d in datagrams if seq is not None}
+	# one data datagram lost per group, never its parity
+	lost = {base + rng.randrange(3) for base in range(0, 300, 3)}
+	decoder = AudioFecDecoder()
+	assert _receive(decoder, [(seq, d) for seq, d in datagrams if seq not in lost]) == sent
+
+
+def _frame_delivery(loss, fec, frames=300, frame_bytes=10000, seed=7):
+	"""Share of frames delivered through a channel dropping each datagram with probability loss."""
+	rng = random.Random(seed)
+	receiver = FrameReassembler()
+	prefix = sender_prefix("bench")
+	data = random.Random(seed + 1).randbytes(frame_bytes)
+	group = fec_group_size(loss, VIDEO_FEC_MAX_GROUP)
+	delivered = seq = 0
+	for frame_id in range(1, frames + 1):
+		packets = fragment_frame(prefix, frame_id, data, seq=seq)
+		first, seq = seq, seq + len(packets)
+		if fec:
+			# parity repeats the frame's first seq rather than using up seqs of its own
+			packets += frame_parity(prefix, frame_id, data, group, seq=first)
+		for packet in packets:
+			if rng.random() >= loss:
+				frame = receiver.add(packet)
+				if frame is not None:
+					assert frame[1] == data
+					delivered += 1
+	return delivered / frames
+
+
+def test_fec_delivers_more_frames_under_loss():
+	for loss in (0.01, 0.05, 0.1):
+		plain = _frame_delivery(loss, fec=False)
+		protected = _frame_delivery(loss, fec=True)
+		assert protected > plain
+		# one-loss-per-group recovery leaves well under half the frames the plain stream loses
+		assert 1 - protected < (1 - plain) / 2
+
+
+def test_fec_costs_nothing_without_loss():
+	assert _frame_delivery(0.0, fec=False) == _frame_delivery(0.0, fec=True) == 1.0
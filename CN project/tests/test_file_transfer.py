@@ -0,0 +1,57 @@
+import os
+import socket
+import struct
+import threading
+
+import pytest
+
+from server.event_loop import EventLoop
+from server.file_transfer import FileConnection, FileTransferServer, safe_filename
+
+
+@pytest.mark.parametrize("raw", [b"", b".", b"..", b"a/b", b"../x", b"a\\b", b"/etc/passwd", b"a\0b", b"\xff"])
+def test_safe_filename_rejects(raw):
+	assert safe_filename(raw) is None
+
+
+def test_safe_filename_accepts_plain_names():
+	assert safe_filename(b"report.pdf") == "report.pdf"
+	assert safe_filename("résumé.txt".encode("utf-8")) == "résumé.txt"
+
+
+def _connection(tmp_path):
+	loop = EventLoop()
+	loop.thread_id = threading.get_ident()
+	server = FileTransferServer("127.0.0.1", str(tmp_path))
+	server.server.close()
+	ours, theirs = socket.socketpair()
+	conn = FileConnection(server, loop, ours, ("127.0.0.1", 0))
+	return loop, conn, theirs
+
+
+@pytest.mark.parametrize("name", [b"", b"..", b"sub/evil"])
+def test_upload_with_bad_name_closes_without_writing(tmp_path, name):
+	loop, conn, peer = _connection(tmp_path)
+	conn.data_received(b"\x01" + struct.pack("!H", len(name)) + name + struct.pack("!Q", 3) + b"abc")
+	assert conn.closed
+	assert os.listdir(tmp_path) == []
+	peer.close()
+	loop.close()
+
+
+def test_download_with_bad_name_reports_missing(tmp_path):
+	loop, conn, peer = _connection(tmp_path)
+	conn.data_received(b"\x02" + struct.pack("!H", 0))
+	assert conn.closed
+	assert peer.recv(16) == struct.pack("!Q", 0)
+	peer.close()
+	loop.close()
+
+
+def test_upload_with_plain_name_is_stored(tmp_path):
+	loop, conn, peer = _connection(tmp_path)
+	conn.data_received(b"\x01" + struct.pack("!H", 5) + b"a.txt" + struct.pack("!Q", 3) + b"abc")
+	assert conn.closed
+	assert (tmp_path / "a.txt").read_bytes() == b"abc"
+	peer.close()
+	loop.close()
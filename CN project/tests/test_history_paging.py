@@ -0,0 +1,96 @@
+import json
+from types import SimpleNamespace
+
+from client.net import ClientThread
+from common.protocol import HISTORY, HISTORY_REQUEST, WELCOME, make_message
+from server.chat_history import ChatHistory
+from server.server_core import ControlServer
+
+
+class _Window:
+	def __init__(self):
+		self.messages = []
+
+	def handle_server_message(self, msg):
+		self.messages.append(msg)
+
+
+class _Session:
+	def __init__(self):
+		self.sent = []
+
+	def send(self, message):
+		self.sent.append(json.loads(json.dumps(message)))
+
+
+def _serve(history, payload):
+	# _send_history only touches its arguments
+	session = _Session()
+	ControlServer._send_history(None, session, SimpleNamespace(history=history), payload)
+	return session.sent[0]
+
+
+def _client(history):
+	"""ClientThread whose requests are answered synchronously from ``history``."""
+	client = ClientThread(_Window())
+	client.requests = []
+
+	def send_message(message):
+		assert message["type"] == HISTORY_REQUEST
+		client.requests.append(message["payload"])
+		client._handle_all([_serve(history, message["payload"])])
+
+	client.send_message = send_message
+	return client
+
+
+def _fill(history, count, text="hi"):
+	for i in range(count):
+		history.append("alice", f"{text} {i + 1}")
+
+
+def test_has_more_tracks_older_records(tmp_path):
+	history = ChatHistory(str(tmp_path))
+	_fill(history, 30)
+	page = _serve(history, {"before": 31, "limit": 10})["payload"]
+	assert [m["seq"] for m in page["messages"]] == list(range(21, 31))
+	assert page["has_more"]
+	page = _serve(history, {"before": 11, "limit": 10})["payload"]
+	assert [m["seq"] for m in page["messages"]] == list(range(1, 11))
+	assert not page["has_more"]
+	assert _serve(history, {"since": 20, "limit": 5})["payload"]["has_more"]
+	assert not _serve(history, {"since": 25, "limit": 5})["payload"]["has_more"]
+	history.close()
+
+
+def test_client_keeps_paging_until_a_trimmed_load_is_full(tmp_path):
+	history = ChatHistory(str(tmp_path))
+	# long enough that the server trims each page well below the requested 100
+	_fill(history, 150, "x" * 2000)
+	client = _client(history)
+	client._handle_all([make_message(WELCOME, {"history_seq": 150})])
+	loaded = [m["seq"] for msg in client.window.messages if msg["type"] == HISTORY for m in msg["payload"]["messages"]]
+	assert len(client.requests) > 1
+	assert sorted(loaded) == list(range(51, 151))
+	assert client.history_oldest == 51 and client.history_more and client.history_wanted == 0
+	history.close()
+
+
+def test_load_older_fetches_the_next_page_until_none_remain(tmp_path):
+	history = ChatHistory(str(tmp_path))
+	_fill(history, 120)
+	client = _client(history)
+	client._handle_all([make_message(WELCOME, {"history_seq": 120})])
+	assert client.requests == [{"before": 121, "limit": 100}]
+	assert client.history_more
+	assert client.request_older_history()
+	assert client.requests[-1] == {"before": 21, "limit": 100}
+	assert client.history_oldest == 1 and not client.history_more
+	assert not client.request_older_history()
+	history.close()
+
+
+def test_empty_room_requests_no_history(tmp_path):
+	client = _client(ChatHistory(str(tmp_path)))
+	client._handle_all([make_message(WELCOME, {"history_seq": 0})])
+	assert client.requests == [] and not client.request_older_history()
@@ -0,0 +1,124 @@
+import os
+import random
+
+from common.media import FrameReassembler, fragment_frame, frame_parity, sender_prefix
+
+MTU = 100
+
+
+def _fragments(data, frame_id=1, group=0, seq=0):
+	prefix = sender_prefix("alice")
+	packets = fragment_frame(prefix, frame_id, data, mtu=MTU, seq=seq)
+	parity = frame_parity(prefix, frame_id, data, group, mtu=MTU, seq=seq) if group else []
+	return packets, parity
+
+
+def _feed(receiver, packets):
+	frames = [receiver.add(p) for p in packets]
+	return [f for f in frames if f is not None]
+
+
+def test_empty_frame_is_one_empty_fragment():
+	packets, _ = _fragments(b"")
+	assert len(packets) == 1
+	assert _feed(FrameReassembler(), packets) == [("alice", b"")]
+
+
+def test_empty_frame_rebuilt_from_parity_alone():
+	packets, parity = _fragments(b"", group=2)
+	receiver = FrameReassembler()
+	assert _feed(receiver, parity) == [("alice", b"")]
+	assert _feed(receiver, packets) == []
+
+
+def test_out_of_order_fragments():
+	data = os.urandom(1000)
+	packets, _ = _fragments(data)
+	random.Random(1).shuffle(packets)
+	receiver = FrameReassembler()
+	assert _feed(receiver, packets) == [("alice", data)]
+
+
+def test_duplicate_fragments_are_ignored():
+	data = os.urandom(300)
+	packets, _ = _fragments(data)
+	receiver = FrameReassembler()
+	assert _feed(receiver, packets[:1] + packets) == [("alice", data)]
+	assert _feed(receiver, packets) == []
+
+
+def test_older_frame_is_dropped_once_a_newer_one_completes():
+	old, _ = _fragments(os.urandom(300), frame_id=1)
+	new_data = os.urandom(300)
+	new, _ = _fragments(new_data, frame_id=2, seq=len(old))
+	receiver = FrameReassembler()
+	assert _feed(receiver, old[:-1] + new + old[-1:]) == [("alice", new_data)]
+
+
+def test_restarted_sender_is_not_dropped_as_stale():
+	receiver = FrameReassembler()
+	for frame_id in range(1, 501):
+		assert len(_feed(receiver, _fragments(b"old", frame_id=frame_id)[0])) == 1
+	# a sender from before random initial ids starts over at 1
+	delivered = [_feed(receiver, _fragments(b"new", frame_id=frame_id)[0]) for frame_id in range(1, 101)]
+	assert delivered == [[("alice", b"new")]] * 100
+	assert receiver.restarts == 1
+
+
+def test_restart_at_a_random_id():
+	rng = random.Random(2)
+	for _ in range(20):
+		receiver = FrameReassembler()
+		first, second = rng.getrandbits(32), rng.getrandbits(32)
+		for frame_id in range(first, first + 10):
+			_feed(receiver, _fragments(b"old", frame_id=frame_id)[0])
+		for frame_id in range(second, second + 10):
+			assert _feed(receiver, _fragments(b"new", frame_id=frame_id)[0]) == [("alice", b"new")]
+
+
+def test_late_frame_just_behind_is_still_dropped():
+	receiver = FrameReassembler()
+	late, _ = _fragments(b"late", frame_id=8)
+	for frame_id in range(1, 11):
+		if frame_id != 8:
+			_feed(receiver, _fragments(b"x", frame_id=frame_id)[0])
+	assert _feed(receiver, late) == []
+	assert receiver.restarts == 0
+
+
+def test_parity_rebuilds_a_lost_fragment_in_any_order():
+	data = os.urandom(2000)
+	packets, parity = _fragments(data, group=4)
+	for lost in range(len(packets)):
+		datagrams = packets[:lost] + packets[lost + 1 :] + parity
+		random.Random(lost).shuffle(datagrams)
+		receiver = FrameReassembler()
+		assert _feed(receiver, datagrams) == [("alice", data)]
+		# parity that overtakes a group's last fragment rebuilds it early, so at least one
+		assert receiver.recovered >= 1
+
+
+def test_interleaved_parity_survives_a_burst():
+	data = os.urandom(2000)
+	packets, parity = _fragments(data, group=4)
+	# one parity datagram per group: a burst as long as that loses one fragment per group
+	burst = len(parity)
+	receiver = FrameReassembler()
+	assert _feed(receiver, packets[:3] + packets[3 + burst :] + parity) == [("alice", data)]
+	assert receiver.recovered == burst
+
+
+def test_two_losses_in_one_group_are_not_recovered():
+	data = os.urandom(2000)
+	packets, parity = _fragments(data, group=4)
+	groups = len(parity)
+	receiver = FrameReassembler()
+	assert _feed(receiver, packets[1:groups] + packets[groups + 1 :] + parity) == []
+
+
+def test_truncated_datagrams_are_ignored():
+	packets, _ = _fragments(os.urandom(300))
+	receiver = FrameReassembler()
+	assert receiver.add(b"") is None
+	assert receiver.add(b"\x09ab") is None
+	assert receiver.add(packets[0][:10]) is None
@@ -0,0 +1,110 @@
+import pytest
+
+from common.protocol import (
+	CHAT,
+	CHAT_BROADCAST,
+	CODEC_BINARY,
+	FRAMER_INITIAL_BUFFER,
+	FRAME_HEADER,
+	MAX_FRAME_PAYLOAD,
+	MAX_LINE_LENGTH,
+	LineFramer,
+	LineTooLongError,
+	encode_json_line,
+	encode_message,
+	make_message,
+)
+
+
+def _largest_frame():
+	message = make_message(CHAT, {"text": "x" * MAX_FRAME_PAYLOAD})
+	frame = encode_message(message, CODEC_BINARY)
+	assert len(frame) == FRAME_HEADER.size + MAX_FRAME_PAYLOAD
+	return message, frame
+
+
+def test_limit_fits_the_largest_binary_frame():
+	assert MAX_LINE_LENGTH == FRAME_HEADER.size + MAX_FRAME_PAYLOAD
+
+
+def test_largest_frame_decodes_whole():
+	message, frame = _largest_frame()
+	assert LineFramer().feed(frame) == [message]
+
+
+def test_largest_frame_decodes_byte_by_byte_at_the_end():
+	message, frame = _largest_frame()
+	framer = LineFramer()
+	assert framer.feed(frame[:-1]) == []
+	assert framer.feed(frame[-1:]) == [message]
+
+
+class _Socket:
+	"""Hands out a byte stream in reads of at most read_size bytes."""
+
+	def __init__(self, data, read_size):
+		self.data = memoryview(data)
+		self.read_size = read_size
+
+	def recv_into(self, buf):
+		n = min(len(buf), self.read_size, len(self.data))
+		buf[:n] = self.data[:n]
+		self.data = self.data[n:]
+		return n
+
+
+def test_buffer_grows_for_a_long_frame_and_shrinks_back():
+	message, frame = _largest_frame()
+	small = make_message(CHAT, {"text": "after"})
+	sock = _Socket(frame + encode_json_line(small), 1500)
+	framer = LineFramer()
+	assert len(framer.buf) == FRAMER_INITIAL_BUFFER
+	out = []
+	largest = 0
+	while framer.recv_from(sock):
+		largest = max(largest, len(framer.buf))
+		out.extend(framer.messages())
+	assert out == [message, small]
+	assert largest > MAX_LINE_LENGTH
+	assert len(framer.buf) == FRAMER_INITIAL_BUFFER
+
+
+def test_fixed_shape_frames_decode_from_the_buffer():
+	messages = [make_message(CHAT_BROADCAST, {"seq": i, "username": "ålice" * i, "text": "x" * i}) for i in range(40)]
+	stream = b"".join(encode_message(m, CODEC_BINARY) for m in messages)
+	assert LineFramer().feed(stream) == messages
+
+
+def test_truncated_fixed_shape_payload_is_malformed():
+	frame = FRAME_HEADER.pack(0, 4, 3) + b"\0\0\0"
+	out = LineFramer().feed(frame + encode_json_line(make_message("PING", {})))
+	assert out[0]["type"] == "ERROR"
+	assert out[1]["type"] == "PING"
+
+
+def test_partial_line_at_the_limit_is_kept():
+	framer = LineFramer()
+	assert framer.feed(b"x" * MAX_LINE_LENGTH) == []
+
+
+def test_partial_line_over_the_limit_raises_with_earlier_messages():
+	ping = make_message("PING", {})
+	framer = LineFramer()
+	with pytest.raises(LineTooLongError) as raised:
+		framer.feed(encode_json_line(ping) + b"x" * (MAX_LINE_LENGTH + 1))
+	assert raised.value.messages == [ping]
+
+
+def test_messages_split_across_feeds():
+	messages = [make_message(CHAT, {"text": str(i)}) for i in range(50)]
+	stream = b"".join(encode_message(m, CODEC_BINARY) + encode_json_line(m) for m in messages)
+	framer = LineFramer()
+	out = []
+	for i in range(0, len(stream), 7):
+		out.extend(framer.feed(stream[i : i + 7]))
+	assert out == [m for m in messages for _ in range(2)]
+
+
+def test_malformed_json_line_becomes_an_error():
+	out = LineFramer().feed(b"{not json\n")
+	assert out[0]["type"] == "ERROR"
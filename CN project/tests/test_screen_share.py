@@ -0,0 +1,37 @@
+import socket
+import threading
+
+from common.protocol import SCREEN_PRESENT_ROOM, SCREEN_VIEWER_ROOM
+from server.event_loop import EventLoop
+from server.screen_share import ScreenConnection, ScreenShareServer
+
+BAD_ROOM = b"\xff\xfe"
+
+
+def _server():
+	server = ScreenShareServer("127.0.0.1")
+	server.server.close()
+	return server
+
+
+def test_threaded_bad_room_name_closes_socket():
+	server = _server()
+	ours, peer = socket.socketpair()
+	peer.sendall(SCREEN_VIEWER_ROOM + bytes([len(BAD_ROOM)]) + BAD_ROOM)
+	server._client_loop(ours)
+	assert ours.fileno() == -1
+	assert server.viewers == {}
+	peer.close()
+
+
+def test_event_loop_bad_room_name_closes_connection():
+	server = _server()
+	loop = EventLoop()
+	loop.thread_id = threading.get_ident()
+	ours, peer = socket.socketpair()
+	conn = ScreenConnection(server, loop, ours, ("127.0.0.1", 0))
+	conn.data_received(SCREEN_PRESENT_ROOM + bytes([len(BAD_ROOM)]) + BAD_ROOM)
+	assert conn.closed
+	assert server.presenters == {}
+	peer.close()
+	loop.close()
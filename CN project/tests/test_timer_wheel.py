@@ -0,0 +1,109 @@
+from server.timer_wheel import TimerWheel
+
+TICK = 0.1
+
+
+class _Clock:
+	"""Moves a wheel's notion of now by shifting its origin back."""
+
+	def __init__(self, wheel):
+		self.wheel = wheel
+		self.ticks = 0
+
+	def run_to(self, ticks):
+		self.wheel.origin -= (ticks - self.ticks) * self.wheel.tick
+		self.ticks = ticks
+		self.wheel.advance()
+
+
+def _wheel(**kwargs):
+	wheel = TimerWheel(tick=TICK, **kwargs)
+	# advance() never rounds a tick up from a slightly late clock reading
+	wheel.origin -= TICK / 2
+	return wheel, _Clock(wheel)
+
+
+def test_timer_fires_on_its_tick():
+	wheel, clock = _wheel()
+	fired = []
+	wheel.schedule(0.5, lambda: fired.append(clock.ticks))
+	clock.run_to(4)
+	assert fired == []
+	clock.run_to(5)
+	assert fired == [5]
+
+
+def test_delays_round_up_to_a_whole_tick():
+	wheel, clock = _wheel()
+	fired = []
+	wheel.schedule(0.0, lambda: fired.append("zero"))
+	wheel.schedule(0.15, lambda: fired.append("one and a half"))
+	clock.run_to(1)
+	assert fired == ["zero"]
+	clock.run_to(2)
+	assert fired == ["zero", "one and a half"]
+
+
+def test_cancelled_timer_does_not_fire():
+	wheel, clock = _wheel()
+	fired = []
+	timer = wheel.schedule(0.3, lambda: fired.append("cancelled"))
+	wheel.schedule(0.3, lambda: fired.append("kept"))
+	timer.cancel()
+	clock.run_to(10)
+	assert fired == ["kept"]
+
+
+def test_long_delays_cascade_through_levels():
+	wheel, clock = _wheel(slots=4, levels=3)
+	fired = {}
+	delays = [1, 3, 4, 5, 15, 16, 17, 63, 64, 100]
+	for ticks in delays:
+		wheel.schedule(ticks * TICK, lambda ticks=ticks: fired.setdefault(ticks, clock.ticks))
+	for now in range(1, 130):
+		clock.run_to(now)
+	assert fired == {ticks: ticks for ticks in delays}
+
+
+def test_timers_beyond_the_top_level_go_round_again():
+	wheel, clock = _wheel(slots=4, levels=2)
+	fired = []
+	wheel.schedule(40 * TICK, lambda: fired.append(clock.ticks))
+	for now in range(1, 50):
+		clock.run_to(now)
+	assert fired == [40]
+
+
+def test_one_advance_fires_everything_due():
+	wheel, clock = _wheel(slots=4, levels=3)
+	fired = []
+	for ticks in (2, 9, 30):
+		wheel.schedule(ticks * TICK, lambda ticks=ticks: fired.append(ticks))
+	clock.run_to(31)
+	assert sorted(fired) == [2, 9, 30]
+
+
+def test_schedule_counts_from_the_current_tick():
+	wheel, clock = _wheel()
+	clock.run_to(7)
+	fired = []
+	wheel.schedule(0.2, lambda: fired.append(clock.ticks))
+	clock.run_to(8)
+	assert fired == []
+	clock.run_to(9)
+	assert fired == [9]
+
+
+def test_a_raising_callback_does_not_skip_the_rest(capsys):
+	wheel, clock = _wheel()
+	fired = []
+
+	def fail():
+		raise RuntimeError("bad callback")
+
+	wheel.schedule(0.1, lambda: fired.append("before"))
+	wheel.schedule(0.1, fail)
+	wheel.schedule(0.1, lambda: fired.append("after"))
+	clock.run_to(1)
+	assert fired == ["before", "after"]
+	assert "bad callback" in capsys.readouterr().err